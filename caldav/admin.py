@@ -1,3 +1,24 @@
 from django.contrib import admin
 
-# Register your models here.
+from caldav.models import CalDAVAppPassword, CalDAVPushSubscription
+
+
+@admin.register(CalDAVAppPassword)
+class CalDAVAppPasswordAdmin(admin.ModelAdmin):
+    list_display = ['name', 'user', 'created_at']
+    fields = ['name', 'user', 'created_at']
+    readonly_fields = ['user', 'created_at']
+
+    def has_add_permission(self, request):
+        # App passwords are generated with the create_caldav_app_password command, only the digest is stored
+        return False
+
+
+@admin.register(CalDAVPushSubscription)
+class CalDAVPushSubscriptionAdmin(admin.ModelAdmin):
+    list_display = ['tasklist', 'user', 'push_resource', 'expires_at']
+    readonly_fields = ['uuid', 'user', 'tasklist', 'push_resource', 'expires_at', 'created_at']
+
+    def has_add_permission(self, request):
+        # Subscriptions are registered by the CalDAV clients
+        return False
@@ -0,0 +1,173 @@
+from typing import AsyncIterator, Iterator
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseRedirect, HttpResponseNotAllowed, HttpResponseBadRequest, \
+    StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+
+from caldav import helper, ical, props, report, sync, views
+from caldav.models import CalDAVPushSubscription, CalDAVTasklist
+from caldav.views import CollectionRequest
+
+
+# Async versions of the handlers in views, served when CALDAV_ASYNC_VIEWS is set. Reads use the async ORM, writes
+# run in transactions and signal receivers and are handed to the sync thread.
+
+@csrf_exempt
+async def well_known_caldav_redirect(request):
+    return HttpResponseRedirect('/caldav/principal/')
+
+
+@csrf_exempt
+async def principal_handler(request):
+    if request.method != 'PROPFIND':
+        return HttpResponseNotAllowed(['PROPFIND'])
+
+    return HttpResponse(helper.principal_multistatus(), content_type='application/xml')
+
+
+@csrf_exempt
+async def home_handler(request):
+    if request.method != 'PROPFIND':
+        return HttpResponseNotAllowed(['PROPFIND'])
+
+    try:
+        propfind = props.parse_propfind(request.body)
+    except report.ReportError as e:
+        return HttpResponseBadRequest(str(e))
+
+    tasklists = [tasklist async for tasklist in CalDAVTasklist.objects.values('code', 'etag', 'uuid')]
+    etags = {tasklist['code']: tasklist['etag'] for tasklist in tasklists}
+
+    home_etag = views.get_home_etag(etags)
+
+    if len(etags.values()) > 0 and helper.etag_matches(request.headers.get('If-None-Match', ''), home_etag):
+        return HttpResponse(status=304)
+
+    tokens = await sync.aget_current_tokens() if views.wants_sync_tokens(request, propfind) else {}
+    response = HttpResponse(views.home_multistatus(request, propfind, etags, tokens, views.get_topics(tasklists)),
+                            content_type='application/xml')
+    response['ETag'] = home_etag
+    return response
+
+
+async def parse_collection_request(request, calendar_id: str) -> CollectionRequest | HttpResponse:
+    # Only reports look up sync changes, a PROPFIND is parsed without touching the database
+    if request.method == 'REPORT':
+        return await sync_to_async(views.parse_collection_request)(request, calendar_id)
+    return views.parse_collection_request(request, calendar_id)
+
+
+async def collection_fragments(request, calendar_id: str, tasklist: CalDAVTasklist | None,
+                               collection: CollectionRequest) -> AsyncIterator[bytes]:
+    # The sync-token is looked up before rendering, the property builders cannot await
+    sync_token = sync.format_sync_token(0)
+    if request.method == 'PROPFIND' and collection.propfind.wants('{DAV:}sync-token'):
+        sync_token = sync.format_sync_token(await sync.aget_current_token(calendar_id))
+
+    head = views.collection_head(request, calendar_id, tasklist, collection, lambda: sync_token)
+    for fragment in head:
+        yield fragment
+    if head and collection.depth == '0':
+        return
+
+    found = set()
+    async for task_id, etag, render in helper.aget_todos(calendar_id, collection.condition):
+        if not views.matches_summary(calendar_id, task_id, etag, render, collection):
+            continue
+        found.add(str(task_id))
+        yield helper.todo_fragment(calendar_id, task_id, etag, render, collection.propfind)
+
+    for fragment in views.collection_tail(collection, found):
+        yield fragment
+
+
+async def iterate_in_thread(chunks: Iterator[bytes]) -> AsyncIterator[bytes]:
+    # Rendering reads from the database, each chunk is taken in the sync thread
+    next_chunk = sync_to_async(next)
+    while (chunk := await next_chunk(chunks, None)) is not None:
+        yield chunk
+
+
+@csrf_exempt
+async def tasklist_handler(request, calendar_id):
+    if request.method not in views.allowed_collection_methods():
+        return HttpResponseNotAllowed(views.allowed_collection_methods())
+
+    if request.method == 'POST':
+        return await sync_to_async(views.push_register)(request, calendar_id)
+
+    collection = await parse_collection_request(request, calendar_id)
+    if isinstance(collection, HttpResponse):
+        return collection
+
+    tasklist = await CalDAVTasklist.objects.filter(code=calendar_id).afirst()
+    if views.is_not_modified(request, tasklist, collection):
+        return HttpResponse(status=304)
+
+    cache_key = views.get_collection_cache_key(request, calendar_id, tasklist, collection)
+    if cache_key is not None:
+        # Concurrent renders of one response wait for each other, which blocks, so the cache runs in the sync thread
+        response = await sync_to_async(views.cached_collection_response)(
+            request, cache_key,
+            lambda: helper.stream_multistatus(views.collection_fragments(request, calendar_id, tasklist, collection)),
+        )
+        if response.streaming:
+            response.streaming_content = iterate_in_thread(iter(response.streaming_content))
+    elif settings.CALDAV_STREAMING:
+        response = StreamingHttpResponse(
+            helper.astream_multistatus(collection_fragments(request, calendar_id, tasklist, collection)),
+            content_type='application/xml',
+        )
+    else:
+        fragments = [fragment async for fragment in collection_fragments(request, calendar_id, tasklist, collection)]
+        response = HttpResponse(helper.render_multistatus(fragments), content_type='application/xml')
+
+    if tasklist is not None:
+        response['ETag'] = tasklist.etag
+    return response
+
+
+@csrf_exempt
+async def subscription_handler(request, subscription_id):
+    if request.method != 'DELETE':
+        return HttpResponseNotAllowed(['DELETE'])
+
+    user = await request.auser()
+    deleted, _ = await CalDAVPushSubscription.objects.filter(uuid=subscription_id, user=user).adelete()
+    return HttpResponse(status=204 if deleted else 404)
+
+
+@csrf_exempt
+async def task_handler(request, calendar_id: str, event_uid: str):
+    if event_uid.endswith('.ics'):
+        event_uid = event_uid[:-4]
+
+    error = views.content_length_error(request)
+    if error is not None:
+        return error
+
+    if views.has_preconditions(request):
+        failed = views.failed_precondition(request, await helper.aget_todo(calendar_id, event_uid))
+        if failed is not None:
+            return failed
+
+    if request.method == 'DELETE':
+        await sync_to_async(helper.delete_todo)(calendar_id, event_uid)
+        return HttpResponse(status=204)
+
+    if request.method == 'PUT':
+        try:
+            todo = helper.calendar_from_request(request)
+        except helper.BodyTooLarge:
+            return HttpResponse(status=413)
+        except (ical.ParseError, UnicodeDecodeError) as e:
+            return HttpResponseBadRequest(str(e))
+
+        return views.changed_response(await sync_to_async(helper.change_todo)(calendar_id, event_uid, todo))
+
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    return views.todo_response(request, calendar_id, event_uid, await helper.aget_todo(calendar_id, event_uid))
@@ -0,0 +1,84 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import aauthenticate, authenticate, get_user_model
+from django.db.models import QuerySet
+from django.utils.crypto import salted_hmac
+
+from caldav.cache import credential_cache
+from caldav.models import CalDAVAppPassword
+
+CREDENTIAL_SALT = 'caldav.auth.credential'
+APP_PASSWORD_SALT = 'caldav.auth.app_password'
+
+
+def credential_digest(username: str, password: str) -> str:
+    return salted_hmac(CREDENTIAL_SALT, f'{username}\0{password}', algorithm='sha256').hexdigest()
+
+
+def app_password_digest(password: str) -> str:
+    return salted_hmac(APP_PASSWORD_SALT, password, algorithm='sha256').hexdigest()
+
+
+def cached_user(key: str) -> QuerySet | None:
+    """The user of recently verified credentials, filtered by the password hash they were verified against."""
+    entry = credential_cache.get(key)
+    if entry is not None:
+        user_id, password_hash, expires_at = entry
+        if expires_at > time.monotonic():
+            return get_user_model().objects.filter(pk=user_id, password=password_hash, is_active=True)
+    return None
+
+
+def app_password_user(username: str, password: str) -> QuerySet:
+    return CalDAVAppPassword.objects.select_related('user').filter(
+        digest=app_password_digest(password),
+        user__username=username,
+        user__is_active=True,
+    )
+
+
+def remember_credentials(key: str, user):
+    expires_at = time.monotonic() + settings.CALDAV_AUTH_CACHE_TTL.total_seconds()
+    credential_cache.set(key, (user.pk, user.password, expires_at), tag=user.pk)
+
+
+def authenticate_basic(request, username: str, password: str):
+    """Verify Basic credentials, skipping the password hasher for recently verified credentials and app passwords.
+
+    Cache entries remember the password hash they were verified against, so a password change made by another
+    process invalidates them as well.
+    """
+    key = credential_digest(username, password)
+    cached = cached_user(key)
+    if cached is not None:
+        user = cached.first()
+        if user is not None:
+            return user
+
+    app_password = app_password_user(username, password).first()
+    if app_password is not None:
+        return app_password.user
+
+    user = authenticate(request, username=username, password=password)
+    if user is not None:
+        remember_credentials(key, user)
+    return user
+
+
+async def aauthenticate_basic(request, username: str, password: str):
+    key = credential_digest(username, password)
+    cached = cached_user(key)
+    if cached is not None:
+        user = await cached.afirst()
+        if user is not None:
+            return user
+
+    app_password = await app_password_user(username, password).afirst()
+    if app_password is not None:
+        return app_password.user
+
+    user = await aauthenticate(request, username=username, password=password)
+    if user is not None:
+        remember_credentials(key, user)
+    return user
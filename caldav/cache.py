@@ -0,0 +1,106 @@
+import itertools
+import time
+from threading import Lock
+from typing import Callable, Iterator
+
+from django.conf import settings
+from django.core.cache import caches
+
+from caldav.compression import compress_variants
+from cleverlist.cache import LRUCache
+
+# Rendered <D:response> fragments and iCalendar bodies, keyed by collection, uuid and item etag
+fragment_cache = LRUCache(settings.CALDAV_FRAGMENT_CACHE_SIZE)
+ical_cache = LRUCache(settings.CALDAV_FRAGMENT_CACHE_SIZE)
+
+# Seconds between two looks for a response another request renders
+POLL_INTERVAL = 0.05
+
+# Verified Basic credentials, keyed by a keyed digest of username and password and tagged by user id
+credential_cache = LRUCache(settings.CALDAV_AUTH_CACHE_SIZE)
+
+
+def invalidate(uuid):
+    fragment_cache.invalidate(str(uuid))
+    ical_cache.invalidate(str(uuid))
+
+
+# Stored instead of the variants for responses above CALDAV_RESPONSE_CACHE_MAX_SIZE, those are streamed
+TOO_LARGE = 'too-large'
+
+
+class ResponseCache:
+    """Rendered responses in a Django cache, stored with their compressed variants.
+
+    Concurrent misses for one key are rendered once, a lock key added to the cache makes the other requests wait for
+    that result, across processes when the cache is shared. Responses above the size limit are not cached, the
+    renderer marks them and every request streams them instead.
+    """
+
+    def __init__(self, alias: str):
+        self.alias = alias
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.streamed = 0
+
+    def count(self, status: str):
+        with self.lock:
+            setattr(self, status, getattr(self, status) + 1)
+
+    def get_or_render(self, key: str, render: Callable[[], Iterator[bytes]]) \
+            -> tuple[dict[str, bytes] | Iterator[bytes], str]:
+        """Return the variants by content coding, or the chunks of a response too large to cache, and whether they
+        were a HIT, a MISS, COALESCED or STREAMED."""
+        backend = caches[self.alias]
+        lock_key = f'{key}:lock'
+        deadline = time.monotonic() + settings.CALDAV_RESPONSE_CACHE_WAIT
+        variants = backend.get(key)
+        waited = locked = False
+        while variants is None and not locked:
+            locked = backend.add(lock_key, True, timeout=settings.CALDAV_RESPONSE_CACHE_WAIT)
+            if not locked:
+                # Another request renders the response, one that fails or takes too long is not waited for
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(POLL_INTERVAL)
+                variants = backend.get(key)
+                waited = True
+
+        if variants == TOO_LARGE:
+            self.count('streamed')
+            return render(), 'STREAMED'
+        if variants is not None:
+            self.count('coalesced' if waited else 'hits')
+            return variants, 'COALESCED' if waited else 'HIT'
+
+        try:
+            chunks = render()
+            body = bytearray()
+            for chunk in chunks:
+                body += chunk
+                if len(body) > settings.CALDAV_RESPONSE_CACHE_MAX_SIZE:
+                    backend.set(key, TOO_LARGE)
+                    self.count('streamed')
+                    return itertools.chain([bytes(body)], chunks), 'STREAMED'
+            variants = compress_variants(bytes(body))
+            backend.set(key, variants)
+        finally:
+            if locked:
+                backend.delete(lock_key)
+
+        self.count('misses')
+        return variants, 'MISS'
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'streamed': self.streamed,
+        }
+
+
+# Whole collection responses, keyed by collection version and request
+response_cache = ResponseCache('caldav')
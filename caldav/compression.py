@@ -0,0 +1,122 @@
+import zlib
+from typing import AsyncIterator, Callable, Iterable, Iterator, NamedTuple
+
+from django.conf import settings
+
+# brotli and zstandard are optional, their encodings are only offered when the package is installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class Codec(NamedTuple):
+    compress: Callable[[bytes, int], bytes]
+    # Returns the functions to feed a chunk to a new stream and to finish it
+    compressor: Callable[[int], tuple[Callable[[bytes], bytes], Callable[[], bytes]]]
+
+
+def gzip_compressor(level: int):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+
+def gzip_compress(body: bytes, level: int) -> bytes:
+    compress, flush = gzip_compressor(level)
+    return compress(body) + flush()
+
+
+def brotli_compressor(level: int):
+    compressor = brotli.Compressor(quality=level)
+    return compressor.process, compressor.finish
+
+
+def brotli_compress(body: bytes, level: int) -> bytes:
+    return brotli.compress(body, quality=level)
+
+
+def zstd_compressor(level: int):
+    compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    return compressor.compress, compressor.flush
+
+
+def zstd_compress(body: bytes, level: int) -> bytes:
+    return zstandard.ZstdCompressor(level=level).compress(body)
+
+
+# In order of preference when a client accepts several encodings with the same quality
+CODECS = {}
+if zstandard is not None:
+    CODECS['zstd'] = Codec(zstd_compress, zstd_compressor)
+if brotli is not None:
+    CODECS['br'] = Codec(brotli_compress, brotli_compressor)
+CODECS['gzip'] = Codec(gzip_compress, gzip_compressor)
+
+
+def parse_accept_encoding(header: str) -> dict[str, float]:
+    qualities = {}
+    for part in header.split(','):
+        name, *params = [value.strip() for value in part.split(';')]
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.lower()] = quality
+    return qualities
+
+
+def choose_encoding(header: str, codings: Iterable[str]) -> str:
+    """The accepted coding with the highest quality, the earliest of the given ones on a tie, else identity."""
+    qualities = parse_accept_encoding(header)
+    best, best_quality = 'identity', 0.0
+    for coding in codings:
+        quality = qualities.get(coding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def get_level(coding: str) -> int:
+    return settings.CALDAV_COMPRESSION_LEVELS[coding]
+
+
+def compress(coding: str, body: bytes) -> bytes:
+    return CODECS[coding].compress(body, get_level(coding))
+
+
+def compress_stream(coding: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+    feed, finish = CODECS[coding].compressor(get_level(coding))
+    for chunk in chunks:
+        compressed = feed(chunk)
+        if compressed:
+            yield compressed
+    yield finish()
+
+
+async def compress_async_stream(coding: str, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    feed, finish = CODECS[coding].compressor(get_level(coding))
+    async for chunk in chunks:
+        compressed = feed(chunk)
+        if compressed:
+            yield compressed
+    yield finish()
+
+
+def compress_variants(body: bytes) -> dict[str, bytes]:
+    """The body and, unless it is too small to benefit, its compressed form in every available coding."""
+    variants = {'identity': body}
+    if settings.CALDAV_COMPRESSION and len(body) >= settings.CALDAV_COMPRESSION_MIN_SIZE:
+        for coding in CODECS:
+            variants[coding] = compress(coding, body)
+    return variants
@@ -1,94 +1,391 @@
 import hashlib
-
-from django.http import HttpRequest
+from functools import partial
+from typing import AsyncIterator, Callable, Iterable, Iterator
+from uuid import UUID
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, QuerySet
+from django.http import HttpRequest, HttpResponse
 from django.utils import timezone
+from django.utils.cache import patch_vary_headers
 from icalendar import Todo, vDatetime, Calendar, Alarm
 from lxml import etree
 
-from caldav.models import CalDAVTasklist
-from inventory.admin import add_shopping_item
+from caldav import cache, compression, ical, props, push
 from inventory.models import ProductWithStock
-from master.models import Product
-from shopping.admin import move_to_inventory
+from inventory.services import add_missing_items, consume_stock, move_items_to_inventory
+from master.models import Product, resolve_product
 from shopping.models import Item
 from todo.models import Task
 
+nsmap = {'D': 'DAV:', 'C': 'urn:ietf:params:xml:ns:caldav'}
 
-def add_tasklist(multistatus: etree.Element, id: str, name: str, color='#FF0000', etag: str = None):
-    response = etree.SubElement(multistatus, '{DAV:}response')
-    href = etree.SubElement(response, '{DAV:}href')
-    href.text = f'/caldav/{id}/'
+MULTISTATUS_START = (
+    b'<?xml version="1.0" encoding="utf-8"?>\n'
+    b'<D:multistatus xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">\n'
+)
+MULTISTATUS_END = b'</D:multistatus>\n'
 
-    propstat = etree.SubElement(response, '{DAV:}propstat')
-    prop = etree.SubElement(propstat, '{DAV:}prop')
 
-    if etag is not None:
-        etagElem = etree.SubElement(prop, "{DAV:}getetag")
-        etagElem.text = etag
+TASKLISTS = {
+    'tasks': ('Aufgaben', '#EE81EE'),
+    'shoppinglist': ('Einkaufsliste 📋', '#FFA600'),
+    'shoppingcart': ('Einkaufswagen 🛒', '#FFA600'),
+    'inventory': ('Bestand 🏠', '#FFA600'),
+}
 
-    displayname = etree.SubElement(prop, '{DAV:}displayname')
-    displayname.text = name
+SUPPORTED_REPORTS = [
+    '{DAV:}sync-collection',
+    '{urn:ietf:params:xml:ns:caldav}calendar-multiget',
+    '{urn:ietf:params:xml:ns:caldav}calendar-query',
+]
 
+
+def add_supported_report_set(prop: etree.Element):
+    supported_report_set = etree.SubElement(prop, '{DAV:}supported-report-set')
+    for report_name in SUPPORTED_REPORTS:
+        supported_report = etree.SubElement(supported_report_set, '{DAV:}supported-report')
+        etree.SubElement(etree.SubElement(supported_report, '{DAV:}report'), report_name)
+
+
+def add_calendar_resourcetype(prop: etree.Element):
     resourcetype = etree.SubElement(prop, '{DAV:}resourcetype')
     etree.SubElement(resourcetype, '{DAV:}collection')
     etree.SubElement(resourcetype, '{urn:ietf:params:xml:ns:caldav}calendar')
 
+
+def add_collection_resourcetype(prop: etree.Element):
+    etree.SubElement(etree.SubElement(prop, '{DAV:}resourcetype'), '{DAV:}collection')
+
+
+def add_supported_calendar_component_set(prop: etree.Element):
     supported_calendar_component_set = etree.SubElement(
         prop, '{urn:ietf:params:xml:ns:caldav}supported-calendar-component-set'
     )
     etree.SubElement(supported_calendar_component_set, '{urn:ietf:params:xml:ns:caldav}comp', name='VTODO')
 
-    calendar_color = etree.SubElement(prop, '{http://apple.com/ns/ical/}calendar-color')
-    calendar_color.text = color  # The color should be a hex value like "#FF0000" for red
 
-    status = etree.SubElement(propstat, '{DAV:}status')
-    status.text = 'HTTP/1.1 200 OK'
+def add_push_transports(prop: etree.Element):
+    transports = etree.SubElement(prop, f'{{{push.PUSH_NS}}}transports')
+    etree.SubElement(transports, f'{{{push.PUSH_NS}}}web-push')
+
+
+def tasklist_response(id: str, propfind: props.Propfind, etag: str = None,
+                      sync_token: Callable[[], str] = None, topic: str = None) -> etree.Element:
+    name, color = TASKLISTS[id]
+    properties = {}
+
+    if etag is not None:
+        properties['{DAV:}getetag'] = props.text_property('{DAV:}getetag', etag)
+        properties['{http://calendarserver.org/ns/}getctag'] = props.text_property(
+            '{http://calendarserver.org/ns/}getctag', etag
+        )
+
+    if sync_token is not None:
+        def add_sync_token(prop: etree.Element):
+            etree.SubElement(prop, '{DAV:}sync-token').text = sync_token()
+
+        properties['{DAV:}sync-token'] = add_sync_token
+
+    if topic is not None:
+        properties[f'{{{push.PUSH_NS}}}topic'] = props.text_property(f'{{{push.PUSH_NS}}}topic', topic)
+        properties[f'{{{push.PUSH_NS}}}transports'] = add_push_transports
+
+    properties['{DAV:}displayname'] = props.text_property('{DAV:}displayname', name)
+    properties['{DAV:}supported-report-set'] = add_supported_report_set
+    properties['{DAV:}resourcetype'] = add_calendar_resourcetype
+    properties['{urn:ietf:params:xml:ns:caldav}supported-calendar-component-set'] = \
+        add_supported_calendar_component_set
+    # The color should be a hex value like "#FF0000" for red
+    properties['{http://apple.com/ns/ical/}calendar-color'] = props.text_property(
+        '{http://apple.com/ns/ical/}calendar-color', color
+    )
 
+    return props.render_response(f'/caldav/{id}/', properties, propfind, nsmap)
 
-def add_todo(multistatus: etree.Element, calendar_id: str, event_id: str, icalendar_data: Calendar):
+
+def principal_multistatus() -> str:
+    # Create the multistatus element
+    multistatus = etree.Element('{DAV:}multistatus', nsmap=nsmap)
+
+    # Create a response element for the principal resource
     response = etree.SubElement(multistatus, '{DAV:}response')
     href = etree.SubElement(response, '{DAV:}href')
-    href.text = f'/caldav/{calendar_id}/{event_id}/'  # Make sure this is correct
+    href.text = '/caldav/principal/'
 
+    # Create propstat element to hold properties
     propstat = etree.SubElement(response, '{DAV:}propstat')
     prop = etree.SubElement(propstat, '{DAV:}prop')
 
-    # Ensure getetag is correct
-    etree.SubElement(prop, '{DAV:}getetag').text = f'"{event_id}"'
+    # Add current-user-principal
+    current_user_principal = etree.SubElement(prop, '{DAV:}current-user-principal')
+    principal_href = etree.SubElement(current_user_principal, '{DAV:}href')
+    principal_href.text = '/caldav/principal/'
 
-    # Add calendar-data element
-    calendar_data = etree.SubElement(prop, '{urn:ietf:params:xml:ns:caldav}calendar-data')
+    # Add calendar-home-set
+    calendar_home_set = etree.SubElement(prop, '{urn:ietf:params:xml:ns:caldav}calendar-home-set')
+    home_href = etree.SubElement(calendar_home_set, '{DAV:}href')
+    home_href.text = '/caldav/home/'  # This should be the URL where calendars are located
 
-    # Generate iCalendar data for the VTODO component
+    # Add displayname
+    displayname = etree.SubElement(prop, '{DAV:}displayname')
+    displayname.text = 'Cleverlist'
 
-    calendar_data.text = icalendar_data.to_ical().decode('utf-8')  # Ensure this is correct
+    # Add supported-calendar-component-set
+    supported_calendar_component_set = etree.SubElement(
+        prop, '{urn:ietf:params:xml:ns:caldav}supported-calendar-component-set'
+    )
+    # etree.SubElement(supported_calendar_component_set, '{urn:ietf:params:xml:ns:caldav}comp', name='VEVENT')
+    etree.SubElement(supported_calendar_component_set, '{urn:ietf:params:xml:ns:caldav}comp', name='VTODO')
 
+    # Set the status for the propstat
     status = etree.SubElement(propstat, '{DAV:}status')
     status.text = 'HTTP/1.1 200 OK'
 
+    # Convert the XML tree to a string
+    xml_str = etree.tostring(multistatus, pretty_print=True).decode()
+    return xml_str
+
+
+def home_response(propfind: props.Propfind) -> etree.Element:
+    return props.render_response('/caldav/home/', {
+        '{DAV:}resourcetype': add_collection_resourcetype,
+        '{DAV:}displayname': props.text_property('{DAV:}displayname', 'Cleverlist'),
+        '{DAV:}current-user-principal': props.href_property('{DAV:}current-user-principal', '/caldav/principal/'),
+    }, propfind, nsmap)
+
+
+def todo_response(calendar_id: str, event_id: str, render: Callable[[], str], etag: str,
+                  propfind: props.Propfind = props.ALLPROP) -> etree.Element:
+    def add_calendar_data(prop: etree.Element):
+        # iCalendar data is only rendered when it was asked for
+        etree.SubElement(prop, '{urn:ietf:params:xml:ns:caldav}calendar-data').text = render()
+
+    return props.render_response(f'/caldav/{calendar_id}/{event_id}/', {
+        '{DAV:}getetag': props.text_property('{DAV:}getetag', etag),
+        '{DAV:}getcontenttype': props.text_property('{DAV:}getcontenttype', 'text/calendar; component=vtodo'),
+        '{DAV:}resourcetype': lambda prop: etree.SubElement(prop, '{DAV:}resourcetype'),
+        '{urn:ietf:params:xml:ns:caldav}calendar-data': add_calendar_data,
+    }, propfind, nsmap)
+
+
+def not_found_response(href: str) -> etree.Element:
+    response = etree.Element('{DAV:}response', nsmap=nsmap)
+    etree.SubElement(response, '{DAV:}href').text = href
+    etree.SubElement(response, '{DAV:}status').text = 'HTTP/1.1 404 Not Found'
+    return response
+
+
+def sync_token_element(sync_token: str) -> etree.Element:
+    element = etree.Element('{DAV:}sync-token', nsmap=nsmap)
+    element.text = sync_token
+    return element
+
+
+def serialize(element: etree.Element) -> bytes:
+    return etree.tostring(element, pretty_print=True, encoding='utf-8')
+
+
+def todo_fragment(calendar_id: str, event_id, etag: str, render: Callable[[], str],
+                  propfind: props.Propfind = props.ALLPROP) -> bytes:
+    key = (calendar_id, str(event_id), etag, propfind.key())
+    fragment = cache.fragment_cache.get(key)
+    if fragment is None:
+        fragment = serialize(todo_response(calendar_id, event_id, render, etag, propfind))
+        cache.fragment_cache.set(key, fragment, tag=str(event_id))
+    return fragment
+
+
+def render_multistatus(fragments: Iterable[bytes]) -> bytes:
+    return b''.join(stream_multistatus(fragments))
+
+
+def stream_multistatus(fragments: Iterable[bytes]) -> Iterator[bytes]:
+    # Every response is serialized on its own, so at most one chunk and one response are held in memory
+    chunk = bytearray(MULTISTATUS_START)
+    for fragment in fragments:
+        chunk += fragment
+        if len(chunk) >= settings.CALDAV_STREAMING_CHUNK_SIZE:
+            yield bytes(chunk)
+            chunk.clear()
+    chunk += MULTISTATUS_END
+    yield bytes(chunk)
+
 
-def get_tasks() -> list[Calendar]:
-    for task in Task.objects.order_by('name').prefetch_related('tags').all():
-        cal = get_task(task)
-        yield cal.subcomponents[0]['uid'], cal
+def encoded_response(request: HttpRequest, variants: dict[str, bytes], content_type: str) -> HttpResponse:
+    """Answer with the compressed variant the client accepts, the uncompressed body otherwise."""
+    coding = compression.choose_encoding(request.headers.get('Accept-Encoding', ''),
+                                         [coding for coding in variants if coding != 'identity'])
+    response = HttpResponse(variants[coding], content_type=content_type)
+    if coding != 'identity':
+        response['Content-Encoding'] = coding
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
 
 
-def get_shoppingitems() -> list[Calendar]:
-    for item in Item.objects.order_by('name').prefetch_related('tags').filter(in_cart=False).all():
-        cal = get_shoppingitem(item, False)
-        yield cal.subcomponents[0]['uid'], cal
+async def astream_multistatus(fragments: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    chunk = bytearray(MULTISTATUS_START)
+    async for fragment in fragments:
+        chunk += fragment
+        if len(chunk) >= settings.CALDAV_STREAMING_CHUNK_SIZE:
+            yield bytes(chunk)
+            chunk.clear()
+    chunk += MULTISTATUS_END
+    yield bytes(chunk)
 
 
-def get_shoppingcart() -> list[Calendar]:
-    for item in Item.objects.order_by('name').prefetch_related('tags').filter(in_cart=True).all():
-        cal = get_shoppingitem(item, True)
-        yield cal.subcomponents[0]['uid'], cal
+def error_response(precondition: str, status: int) -> HttpResponse:
+    error = etree.Element('{DAV:}error', nsmap={'D': 'DAV:'})
+    etree.SubElement(error, precondition)
+    return HttpResponse(etree.tostring(error, pretty_print=True).decode(), content_type='application/xml',
+                        status=status)
 
 
-def get_inventory() -> list[Calendar]:
-    for item in ProductWithStock.default_manager.order_by('name').all():
-        cal = get_inventory_item(item)
-        yield cal.subcomponents[0]['uid'], cal
+def make_etag(*values) -> str:
+    return '"' + hashlib.md5('\x1f'.join(str(value) for value in values).encode('utf-8')).hexdigest() + '"'
+
+
+# The ETags of tasks and shopping items cover the fields whose changes the model signals record, a save that changes
+# nothing else must not hand out a new ETag while the collection stays the same. The DTSTAMP is left out for that.
+def get_task_etag(task: Task) -> str:
+    return make_etag(task.uuid, task.name, task.done, task.deadline, *[tag.name for tag in task.tags.all()])
+
+
+def get_shoppingitem_etag(item: Item, is_cart: bool) -> str:
+    return make_etag(item.uuid, is_cart, item.in_cart, str(item), *[tag.name for tag in item.tags.all()])
+
+
+def get_inventory_item_etag(item: ProductWithStock) -> str:
+    # Inventory items are rendered with the current time as DTSTAMP, so only the stock aggregates identify a version
+    return make_etag(item.uuid, item.name, item.stock, item.minimum_stock)
+
+
+def etag_matches(header: str, etag: str | None) -> bool:
+    if etag is None:
+        return False
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate.removeprefix('W/') == etag:
+            return True
+    return False
+
+
+def todo_base_queryset(calendar_id: str) -> QuerySet | None:
+    if calendar_id == 'tasks':
+        return Task.objects.prefetch_related('tags')
+    if calendar_id in ['shoppinglist', 'shoppingcart']:
+        return Item.objects.select_related('product').prefetch_related('tags')
+    if calendar_id == 'inventory':
+        return ProductWithStock.default_manager.all()
+    return None
+
+
+def todo_queryset(calendar_id: str, condition: Q = Q()) -> QuerySet | None:
+    """The resources listed in a collection, ordered by name."""
+    queryset = todo_base_queryset(calendar_id)
+    if queryset is None:
+        return None
+    queryset = queryset.order_by('name').filter(condition)
+    if calendar_id in ['shoppinglist', 'shoppingcart']:
+        queryset = queryset.filter(in_cart=calendar_id == 'shoppingcart')
+    return queryset
+
+
+def todo_entry(calendar_id: str, obj) -> tuple[UUID, str, Callable[[], str]]:
+    if calendar_id == 'tasks':
+        return obj.uuid, get_task_etag(obj), partial(get_task_ical, obj)
+    if calendar_id == 'inventory':
+        return obj.uuid, get_inventory_item_etag(obj), partial(get_inventory_item_ical, obj)
+    is_cart = calendar_id == 'shoppingcart'
+    return obj.uuid, get_shoppingitem_etag(obj, is_cart), partial(get_shoppingitem_ical, obj, is_cart)
+
+
+def todo_lookup(calendar_id: str, uuid: str) -> QuerySet | None:
+    try:
+        UUID(uuid)
+    except ValueError:
+        return None
+    queryset = todo_base_queryset(calendar_id)
+    return queryset.filter(uuid=uuid) if queryset is not None else None
+
+
+def get_todo(calendar_id: str, uuid: str) -> tuple[str, Callable[[], str]] | None:
+    queryset = todo_lookup(calendar_id, uuid)
+    obj = queryset.first() if queryset is not None else None
+    if obj is None:
+        return None
+    return todo_entry(calendar_id, obj)[1:]
+
+
+async def aget_todo(calendar_id: str, uuid: str) -> tuple[str, Callable[[], str]] | None:
+    queryset = todo_lookup(calendar_id, uuid)
+    obj = await queryset.afirst() if queryset is not None else None
+    if obj is None:
+        return None
+    return todo_entry(calendar_id, obj)[1:]
+
+
+def get_todo_ical(calendar_id: str, uuid: str, etag: str, render: Callable[[], str]) -> str:
+    key = (calendar_id, uuid, etag)
+    icalendar_data = cache.ical_cache.get(key)
+    if icalendar_data is None:
+        icalendar_data = render()
+        cache.ical_cache.set(key, icalendar_data, tag=uuid)
+    return icalendar_data
+
+
+def get_todos(calendar_id: str, condition: Q = Q()) -> Iterator[tuple[UUID, str, Callable[[], str]]]:
+    queryset = todo_queryset(calendar_id, condition)
+    if queryset is None:
+        return
+    for obj in queryset.iterator(chunk_size=settings.CALDAV_QUERY_CHUNK_SIZE):
+        yield todo_entry(calendar_id, obj)
+
+
+async def aget_todos(calendar_id: str, condition: Q = Q()) -> AsyncIterator[tuple[UUID, str, Callable[[], str]]]:
+    queryset = todo_queryset(calendar_id, condition)
+    if queryset is None:
+        return
+    async for obj in queryset.aiterator(chunk_size=settings.CALDAV_QUERY_CHUNK_SIZE):
+        yield todo_entry(calendar_id, obj)
+
+
+def get_task_ical(task: Task) -> str:
+    try:
+        return ical.vtodo(
+            task.uuid,
+            task.updated_at,
+            str(task),
+            'COMPLETED' if task.done else 'NEEDS-ACTION',
+            description=", ".join([str(tag) for tag in task.tags.all()]),
+            due=task.deadline,
+            completed=task.done,
+        )
+    except ical.UnsupportedValue:
+        return get_task(task).to_ical().decode('utf-8')
+
+
+def get_shoppingitem_ical(item: Item, is_cart: bool) -> str:
+    try:
+        return ical.vtodo(
+            item.uuid,
+            item.updated_at,
+            str(item),
+            'COMPLETED' if item.in_cart != is_cart else 'NEEDS-ACTION',
+            description=", ".join([str(tag) for tag in item.tags.all()]),
+        )
+    except ical.UnsupportedValue:
+        return get_shoppingitem(item, is_cart).to_ical().decode('utf-8')
+
+
+def get_inventory_item_ical(item: ProductWithStock) -> str:
+    if item.minimum_stock > 0:
+        summary = f'{item.stock} / {item.minimum_stock} x {item.name}'
+    else:
+        summary = f'{item.stock} x {item.name}'
+
+    return ical.vtodo(item.uuid, timezone.now(), summary, 'COMPLETED' if item.stock == 0 else 'NEEDS-ACTION')
 
 
 def get_task(uuid_or_task: str | Task) -> Calendar:
@@ -176,50 +473,73 @@ def get_inventory_item(uuid_or_item: str | ProductWithStock) -> Calendar:
     return cal
 
 
-def calendar_from_request(request: HttpRequest) -> Calendar:
-    return Calendar.from_ical(request.body.decode('utf-8'))
+class BodyTooLarge(Exception):
+    pass
+
+
+def calendar_from_request(request: HttpRequest) -> ical.ParsedTodo:
+    # Read one byte past the limit, a body sent without a Content-Length is not read in full either
+    body = request.read(settings.CALDAV_MAX_BODY_SIZE + 1)
+    if len(body) > settings.CALDAV_MAX_BODY_SIZE:
+        raise BodyTooLarge()
+    body = body.decode('utf-8')
+    try:
+        return ical.parse_vtodo(body)
+    except ical.UnsupportedValue:
+        pass
+
+    # icalendar handles what the fast parser does not, for example custom VTIMEZONE definitions
+    try:
+        todos = Calendar.from_ical(body).walk('VTODO')
+    except ValueError as e:
+        raise ical.ParseError(str(e))
+    if not todos:
+        raise ical.ParseError('No VTODO component found')
+
+    todo = todos[0]
+    return ical.ParsedTodo(
+        status=str(todo['status']) if todo.get('status') is not None else None,
+        summary=str(todo['summary']) if todo.get('summary') is not None else None,
+        due=todo['due'].dt if todo.get('due') is not None else None,
+    )
+
 
+def save_changes(instance: Task | Item, changed: list[str]):
+    # New rows are inserted, existing rows only get the changed columns written
+    if instance.pk is None:
+        instance.save()
+    elif changed:
+        instance.save(update_fields=[*changed, 'updated_at'])
 
-def change_task(uuid: str, cal: Calendar):
-    if not Task.objects.filter(uuid=uuid).exists():
-        task = Task.objects.create(
-            name='',
-            uuid=uuid,
-        )
-        changed = True
-    else:
-        task = Task.objects.get(uuid=uuid)
-        changed = False
 
-    todo = cal.walk('VTODO')[0]
-    if todo.get('status') == 'NEEDS-ACTION' and task.done:
+def change_task(uuid: str, todo: ical.ParsedTodo) -> Task:
+    task = Task.objects.prefetch_related('tags').filter(uuid=uuid).first()
+    if task is None:
+        task = Task(name='', uuid=uuid)
+    changed = []
+
+    if todo.status == 'NEEDS-ACTION' and task.done:
         task.done = None
-        changed = True
+        changed.append('done')
 
-    if todo.get('status') == 'COMPLETED' and task.done is None:
+    if todo.status == 'COMPLETED' and task.done is None:
         task.done = timezone.now()
-        changed = True
-
-    summary = todo.get('summary')
-    if summary and summary != task.name:
-        task.name = str(summary)
-        changed = True
+        changed.append('done')
 
-    due = None
-    if todo.get('due') is not None:
-        due = todo.get('due').dt
+    if todo.summary and todo.summary != task.name:
+        task.name = todo.summary
+        changed.append('name')
 
-    if task.deadline != due:
-        task.deadline = due
-        changed = True
+    if task.deadline != todo.due:
+        task.deadline = todo.due
+        changed.append('deadline')
 
-    if changed:
-        task.save()
+    save_changes(task, changed)
+    return task
 
 
-def change_shoppingitem_base(uuid: str, cal: Calendar, in_cart_default: bool):
-    todo = cal.walk('VTODO')[0]
-    summary = str(todo.get('summary'))
+def change_shoppingitem_base(uuid: str, todo: ical.ParsedTodo, in_cart_default: bool) -> tuple[Item, list[str]]:
+    summary = str(todo.summary)
     if ' x ' in summary:
         quantity, name = summary.split(' x ', 2)
     else:
@@ -233,76 +553,65 @@ def change_shoppingitem_base(uuid: str, cal: Calendar, in_cart_default: bool):
     else:
         quantity = 1
 
-    if not Item.objects.filter(uuid=uuid).exists():
-        product = Product.objects.filter(name__iexact=name.strip()).first()
+    item = Item.objects.select_related('product').prefetch_related('tags').filter(uuid=uuid).first()
+    if item is None:
+        product = resolve_product(name)
         if product is None:
-            product = Product.objects.create(
+            created = Product.objects.create(
                 name=name,
             )
+            product = created.pk, created.name
 
-        item = Item.objects.create(
-            product=product,
-            quantity=int(quantity),
-            in_cart=in_cart_default,
-            uuid=uuid,
-        )
-
-        name = item.name
-    else:
-        item = Item.objects.get(uuid=uuid)
+        # Not saved yet, the caller inserts it together with its own changes
+        product_id, product_name = product
+        return Item(product_id=product_id, name=product_name, quantity=quantity, in_cart=in_cart_default,
+                    uuid=uuid), []
 
+    changed = []
     if item.product is None and len(name) and name != item.name:
         item.name = name
-        item.save()
+        changed.append('name')
 
     if 0 < quantity != item.quantity:
         item.quantity = quantity
-        item.save()
+        changed.append('quantity')
 
-    return item, todo
+    return item, changed
 
 
-def on_change_tasklist(code: str):
-    CalDAVTasklist.objects.update_or_create(
-        code=code,
-        defaults={
-            'etag': hashlib.md5(str(timezone.now()).encode('utf-8')).hexdigest(),
-        }
-    )
-
-
-def change_shoppingitem(uuid: str, cal: Calendar):
-    item, todo = change_shoppingitem_base(uuid, cal, False)
-    if todo.get('status') == 'NEEDS-ACTION' and item.in_cart is True:
+def change_shoppingitem(uuid: str, todo: ical.ParsedTodo) -> Item | None:
+    item, changed = change_shoppingitem_base(uuid, todo, False)
+    created = item.pk is None
+    if todo.status == 'NEEDS-ACTION' and item.in_cart is True:
         item.in_cart = False
-        item.save()
-        on_change_tasklist('shoppingcart')
+        changed.append('in_cart')
 
-    if todo.get('status') == 'COMPLETED' and item.in_cart is False:
+    if todo.status == 'COMPLETED' and item.in_cart is False:
         item.in_cart = True
-        item.save()
-        on_change_tasklist('shoppingcart')
+        changed.append('in_cart')
 
+    save_changes(item, changed)
+    # New items inherit their tags once the transaction commits, they have to be read again
+    return None if created else item
 
-def change_shoppingcart(uuid: str, cal: Calendar):
-    item, todo = change_shoppingitem_base(uuid, cal, True)
-    if todo.get('status') == 'COMPLETED' and item.in_cart is True:
-        move_to_inventory(None, None, Item.objects.filter(uuid=uuid))
-        on_change_tasklist('inventory')
 
+def change_shoppingcart(uuid: str, todo: ical.ParsedTodo) -> Item | None:
+    item, changed = change_shoppingitem_base(uuid, todo, True)
+    created = item.pk is None
+    save_changes(item, changed)
+    if todo.status == 'COMPLETED' and item.in_cart is True:
+        move_items_to_inventory(Item.objects.filter(pk=item.pk))
+        return None
+    return None if created else item
 
-def change_inventory(uuid: str, cal: Calendar):
+
+def change_inventory(uuid: str, todo: ical.ParsedTodo):
     item = ProductWithStock.default_manager.filter(uuid=uuid).first()
     if item is None:
         return
-    todo = cal.walk('VTODO')[0]
 
-    if todo.get('status') == 'COMPLETED' and item.stock > 0:
-        productstock = item.productstock_set.filter(stock__gt=0).first()
-        productstock.stock -= 1
-        productstock.save()
-        add_shopping_item(None, None, ProductWithStock.default_manager.filter(uuid=uuid))
-        on_change_tasklist('shoppinglist')
+    if todo.status == 'COMPLETED' and item.stock > 0 and consume_stock(item.pk):
+        add_missing_items(Product.objects.filter(uuid=uuid))
 
 
 def delete_task(uuid: str):
@@ -311,3 +620,31 @@ def delete_task(uuid: str):
 
 def delete_shoppingitem(uuid: str):
     Item.objects.get(uuid=uuid).delete()
+
+
+def change_todo(calendar_id: str, uuid: str, todo: ical.ParsedTodo) -> tuple[str, Callable[[], str]] | None:
+    """Apply a PUT to the resource and return its new ETag and renderer, None if it is gone."""
+    # Collection versions are bumped by model signals, once per transaction
+    with transaction.atomic():
+        changed = None
+        if calendar_id == 'tasks':
+            changed = change_task(uuid, todo)
+        if calendar_id == 'shoppinglist':
+            changed = change_shoppingitem(uuid, todo)
+        if calendar_id == 'shoppingcart':
+            changed = change_shoppingcart(uuid, todo)
+        if calendar_id == 'inventory':
+            change_inventory(uuid, todo)
+
+    # The saved instance is current unless the change continued after the save, those resources are read again
+    if changed is None:
+        return get_todo(calendar_id, uuid)
+    return todo_entry(calendar_id, changed)[1:]
+
+
+def delete_todo(calendar_id: str, uuid: str):
+    with transaction.atomic():
+        if calendar_id == 'tasks':
+            delete_task(uuid)
+        if calendar_id in ['shoppinglist', 'shoppingcart']:
+            delete_shoppingitem(uuid)
@@ -0,0 +1,212 @@
+from datetime import date, datetime, timezone as dt_timezone
+from typing import NamedTuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+PRODID = '-//CleverList//1.0//DE'
+
+
+class UnsupportedValue(ValueError):
+    pass
+
+
+class ParseError(ValueError):
+    pass
+
+
+class ParsedTodo(NamedTuple):
+    status: str | None
+    summary: str | None
+    due: date | datetime | None
+
+
+def escape_text(text: str) -> str:
+    # Same order as icalendar.parser.escape_char, the output has to be byte-identical
+    return text.replace('\\N', '\n') \
+        .replace('\\', '\\\\') \
+        .replace(';', '\\;') \
+        .replace(',', '\\,') \
+        .replace('\r\n', '\\n') \
+        .replace('\n', '\\n')
+
+
+def fold_line(line: str, limit: int = 75) -> str:
+    if line.isascii():
+        if len(line) < limit:
+            return line
+        return '\r\n '.join(line[i:i + limit - 1] for i in range(0, len(line), limit - 1))
+
+    chars = []
+    byte_count = 0
+    for char in line:
+        char_byte_len = len(char.encode('utf-8'))
+        byte_count += char_byte_len
+        if byte_count >= limit:
+            chars.append('\r\n ')
+            byte_count = char_byte_len
+        chars.append(char)
+    return ''.join(chars)
+
+
+def format_datetime(value: datetime) -> str:
+    formatted = f'{value.year:04d}{value.month:02d}{value.day:02d}T{value.hour:02d}{value.minute:02d}{value.second:02d}'
+    if value.tzinfo is None:
+        return formatted
+    if value.tzinfo is dt_timezone.utc or value.tzinfo.tzname(value) == 'UTC':
+        return formatted + 'Z'
+    # Other zones are written with a TZID parameter, leave those to icalendar
+    raise UnsupportedValue(value)
+
+
+def text_line(name: str, value) -> str:
+    return fold_line(f'{name}:{escape_text(str(value))}')
+
+
+def datetime_line(name: str, value: datetime) -> str:
+    return fold_line(f'{name}:{format_datetime(value)}')
+
+
+def vtodo(uid, dtstamp: datetime, summary: str, status: str, description: str | None = None,
+          due: datetime | None = None, completed: datetime | None = None) -> str:
+    # Properties are written in the alphabetical order icalendar uses for components without a canonical order
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        text_line('PRODID', PRODID),
+        'BEGIN:VTODO',
+    ]
+    if completed is not None:
+        lines.append(datetime_line('COMPLETED', completed))
+    if description is not None:
+        lines.append(text_line('DESCRIPTION', description))
+    lines.append(datetime_line('DTSTAMP', dtstamp))
+    if due is not None:
+        lines.append(datetime_line('DUE', due))
+    lines.append(text_line('STATUS', status))
+    lines.append(text_line('SUMMARY', summary))
+    lines.append(text_line('UID', uid))
+    if due is not None:
+        lines.append('BEGIN:VALARM')
+        lines.append('ACTION:DISPLAY')
+        lines.append(datetime_line('TRIGGER', due))
+        lines.append('END:VALARM')
+    lines.append('END:VTODO')
+    lines.append('END:VCALENDAR')
+    lines.append('')
+    return '\r\n'.join(lines)
+
+
+def unescape_text(text: str) -> str:
+    if '\\' not in text:
+        return text
+
+    chars = []
+    escaped = False
+    for char in text:
+        if escaped:
+            chars.append('\n' if char in 'nN' else char)
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        else:
+            chars.append(char)
+    return ''.join(chars)
+
+
+def unfolded_lines(body: str):
+    current = None
+    for line in body.split('\n'):
+        line = line.rstrip('\r')
+        if line[:1] in (' ', '\t'):
+            if current is None:
+                raise ParseError('Continuation line without property')
+            current += line[1:]
+            continue
+        if current:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def split_property(line: str) -> tuple[str, dict[str, str], str]:
+    quoted = False
+    for index, char in enumerate(line):
+        if char == '"':
+            quoted = not quoted
+        elif char == ':' and not quoted:
+            break
+    else:
+        raise ParseError(f'Invalid content line: {line}')
+
+    name, *params = line[:index].split(';')
+    parameters = {}
+    for param in params:
+        key, _, value = param.partition('=')
+        parameters[key.upper()] = value.strip('"')
+    return name.upper(), parameters, line[index + 1:]
+
+
+def parse_date_or_datetime(value: str, parameters: dict[str, str]) -> date | datetime:
+    try:
+        if parameters.get('VALUE', '').upper() == 'DATE' or len(value) == 8:
+            return datetime.strptime(value, '%Y%m%d').date()
+
+        if value.endswith('Z'):
+            return datetime.strptime(value, '%Y%m%dT%H%M%SZ').replace(tzinfo=dt_timezone.utc)
+
+        parsed = datetime.strptime(value, '%Y%m%dT%H%M%S')
+    except ValueError:
+        raise UnsupportedValue(value)
+
+    tzid = parameters.get('TZID')
+    if tzid:
+        # Zones defined by a VTIMEZONE of the client are resolved by icalendar
+        try:
+            return parsed.replace(tzinfo=ZoneInfo(tzid))
+        except (ZoneInfoNotFoundError, ValueError):
+            raise UnsupportedValue(tzid)
+    return parsed
+
+
+WANTED_PREFIXES = {'BEG', 'END', 'STA', 'SUM', 'DUE'}
+
+
+def parse_vtodo(body: str) -> ParsedTodo:
+    """Read STATUS, SUMMARY and DUE of the first VTODO without building a component tree."""
+    properties = {}
+    depth = 0
+    in_todo = False
+    for line in unfolded_lines(body):
+        # Cheap look at the property name, only the few properties we need are split into parameters and value
+        if line[:3].upper() not in WANTED_PREFIXES:
+            continue
+
+        name, parameters, value = split_property(line)
+        if name == 'BEGIN':
+            if in_todo:
+                depth += 1
+            elif value.upper() == 'VTODO':
+                in_todo = True
+            continue
+
+        if name == 'END' and in_todo:
+            if depth == 0:
+                break
+            depth -= 1
+            continue
+
+        if in_todo and depth == 0 and name in ('STATUS', 'SUMMARY', 'DUE') and name not in properties:
+            properties[name] = (parameters, value)
+    else:
+        if not in_todo:
+            raise ParseError('No VTODO component found')
+
+    due = None
+    if 'DUE' in properties:
+        due = parse_date_or_datetime(properties['DUE'][1], properties['DUE'][0])
+
+    return ParsedTodo(
+        status=unescape_text(properties['STATUS'][1]) if 'STATUS' in properties else None,
+        summary=unescape_text(properties['SUMMARY'][1]) if 'SUMMARY' in properties else None,
+        due=due,
+    )
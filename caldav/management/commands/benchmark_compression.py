@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from caldav import compression, helper
+from master.models import Tag
+from todo.models import Task
+
+# Levels compared per encoding, the configured level is added to them
+LEVELS = {
+    'gzip': [1, 6, 9],
+    'br': [1, 5, 11],
+    'zstd': [1, 3, 19],
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Reports size and compression time of a rendered collection for every available encoding and level'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=2000)
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                body = self.render_collection(options['items'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+        self.stdout.write(f'{"identity":>8}    {len(body):10d} bytes')
+        for coding, codec in compression.CODECS.items():
+            for level in sorted({*LEVELS[coding], compression.get_level(coding)}):
+                best = None
+                for _ in range(options['rounds']):
+                    start = time.perf_counter()
+                    compressed = codec.compress(body, level)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                self.stdout.write(
+                    f'{coding:>8} {level:2d} {len(compressed):10d} bytes {len(body) / len(compressed):6.1f}x '
+                    f'{best * 1000:8.2f} ms {len(body) / best / 1024 / 1024:8.1f} MB/s'
+                )
+
+        missing = [name for name, module in [('br', compression.brotli), ('zstd', compression.zstandard)] if not module]
+        if missing:
+            self.stdout.write(f'Not available: {", ".join(missing)}, install brotli and zstandard to compare them')
+
+    def render_collection(self, count: int) -> bytes:
+        tags = [Tag.objects.create(name=f'benchmark-{i}') for i in range(3)]
+        now = timezone.now()
+        Task.objects.bulk_create([
+            Task(name=f'Benchmark task {i}', deadline=now if i % 2 else None, updated_at=now) for i in range(count)
+        ])
+        for task in Task.objects.filter(name__startswith='Benchmark task')[::3]:
+            task.tags.set(tags)
+        return helper.render_multistatus(
+            helper.todo_fragment('tasks', task_id, etag, render) for task_id, etag, render in helper.get_todos('tasks')
+        )
@@ -0,0 +1,61 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from caldav import helper
+from master.models import Tag
+from todo.models import Task
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compares the per-item cost of the icalendar based and the direct VTODO serializer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=2000)
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.benchmark(options['items'], options['rounds'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def benchmark(self, count: int, rounds: int):
+        tags = [Tag.objects.create(name=f'benchmark-{i}') for i in range(3)]
+        now = timezone.now()
+        Task.objects.bulk_create([
+            Task(name=f'Benchmark task {i}, with; escaping', deadline=now if i % 2 else None, updated_at=now)
+            for i in range(count)
+        ])
+        tasks = list(Task.objects.filter(name__startswith='Benchmark task').prefetch_related('tags'))
+        for task in tasks[::3]:
+            task.tags.set(tags)
+        tasks = list(Task.objects.filter(name__startswith='Benchmark task').prefetch_related('tags'))
+
+        mismatches = sum(1 for task in tasks if helper.get_task_ical(task) != helper.get_task(task).to_ical().decode())
+
+        results = {}
+        for name, serialize in [
+            ('icalendar', lambda task: helper.get_task(task).to_ical().decode('utf-8')),
+            ('direct', helper.get_task_ical),
+        ]:
+            best = None
+            for _ in range(rounds):
+                start = time.perf_counter()
+                for task in tasks:
+                    serialize(task)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[name] = best / len(tasks)
+            self.stdout.write(f'{name:>10}: {results[name] * 1e6:8.1f} µs per item')
+
+        self.stdout.write(f'   speedup: {results["icalendar"] / results["direct"]:8.1f}x')
+        self.stdout.write(f'mismatches: {mismatches}')
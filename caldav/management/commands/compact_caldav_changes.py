@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from caldav.sync import compact_changes
+
+
+class Command(BaseCommand):
+    help = 'Removes CalDAV change log entries older than the sync retention window'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Retention in days, defaults to CALDAV_SYNC_RETENTION')
+
+    def handle(self, *args, **options):
+        retention = timedelta(days=options['days']) if options['days'] is not None else None
+        deleted = compact_changes(retention)
+        self.stdout.write(f'Removed {deleted} change log entries')
@@ -0,0 +1,25 @@
+import secrets
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from caldav.auth import app_password_digest
+from caldav.models import CalDAVAppPassword
+
+
+class Command(BaseCommand):
+    help = 'Creates an app password for CalDAV clients, the password is only shown once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('name', help='Name of the client the password is used by')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get_by_natural_key(options['username'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'User {options["username"]} does not exist')
+
+        password = secrets.token_urlsafe(24)
+        CalDAVAppPassword.objects.create(user=user, name=options['name'], digest=app_password_digest(password))
+        self.stdout.write(password)
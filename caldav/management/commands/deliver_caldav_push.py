@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from caldav.push import deliver_notifications
+
+
+class Command(BaseCommand):
+    help = 'Sends WebDAV-Push messages for collections that changed, once their changes have settled'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--watch', type=float, metavar='SECONDS',
+                            help='Keep running and deliver every SECONDS instead of once')
+
+    def handle(self, *args, **options):
+        if options['watch'] is None:
+            self.deliver()
+            return
+
+        while True:
+            close_old_connections()
+            self.deliver(quiet=True)
+            time.sleep(options['watch'])
+
+    def deliver(self, quiet: bool = False):
+        result = deliver_notifications()
+        if not quiet or result.delivered or result.failed or result.removed:
+            self.stdout.write(
+                f'Delivered {result.delivered} push messages, {result.failed} failed, '
+                f'removed {result.removed} subscriptions'
+            )
@@ -0,0 +1,85 @@
+import base64
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+
+PROPFIND_BODY = b'<D:propfind xmlns:D="DAV:"><D:prop><D:getetag/><C:calendar-data ' \
+                b'xmlns:C="urn:ietf:params:xml:ns:caldav"/></D:prop></D:propfind>'
+
+
+class Command(BaseCommand):
+    help = 'Compares the throughput of running deployments, for example the WSGI and the ASGI server, under ' \
+           'concurrent CalDAV clients. Targets are given as name=url, e.g. wsgi=http://127.0.0.1:8000'
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='+')
+        parser.add_argument('--username', required=True)
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--collection', default='tasks')
+        parser.add_argument('--clients', type=int, default=20)
+        parser.add_argument('--requests', type=int, default=50, help='Requests per client')
+        parser.add_argument('--depth', default='1')
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['targets']:
+            name, _, url = target.partition('=')
+            if not url:
+                raise CommandError(f'Expected name=url, got {target}')
+            targets.append((name, url.rstrip('/')))
+
+        credentials = base64.b64encode(f'{options["username"]}:{options["password"]}'.encode('utf-8')).decode()
+        headers = {
+            'Authorization': f'Basic {credentials}',
+            'Depth': options['depth'],
+            'Content-Type': 'application/xml',
+            'Accept-Encoding': 'gzip',
+        }
+
+        for name, url in targets:
+            collection_url = f'{url}/caldav/{options["collection"]}/'
+            # One request first, so failures show up before the load and lazy startup is not measured
+            try:
+                self.request(collection_url, headers)
+            except (HTTPError, URLError, OSError) as e:
+                raise CommandError(f'{name}: {collection_url} failed: {e}')
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['clients']) as executor:
+                results = list(executor.map(
+                    lambda _: self.run_client(collection_url, headers, options['requests']), range(options['clients'])
+                ))
+            elapsed = time.perf_counter() - start
+
+            latencies = sorted(latency for client_latencies, _ in results for latency in client_latencies)
+            errors = sum(client_errors for _, client_errors in results)
+            if not latencies:
+                self.stdout.write(f'{name:>8} {errors} errors, no successful request')
+                continue
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            self.stdout.write(
+                f'{name:>8} {len(latencies) / elapsed:8.1f} req/s p50 {statistics.median(latencies) * 1000:7.1f} ms '
+                f'p95 {p95 * 1000:7.1f} ms {errors} errors'
+            )
+
+    def run_client(self, url: str, headers: dict[str, str], count: int) -> tuple[list[float], int]:
+        latencies = []
+        errors = 0
+        for _ in range(count):
+            start = time.perf_counter()
+            try:
+                self.request(url, headers)
+            except (HTTPError, URLError, OSError):
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+        return latencies, errors
+
+    def request(self, url: str, headers: dict[str, str]):
+        request = Request(url, data=PROPFIND_BODY, headers=headers, method='PROPFIND')
+        with urlopen(request, timeout=60) as response:
+            response.read()
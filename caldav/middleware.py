@@ -1,44 +1,154 @@
 import base64
-from django.contrib.auth import authenticate, login
+from django.conf import settings
+from django.contrib.auth import alogin, login
 from django.http import HttpResponse
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
 from django.utils.deprecation import MiddlewareMixin
 
+from caldav import compression
+from caldav.auth import aauthenticate_basic, authenticate_basic
+
+
+def options_response() -> HttpResponse:
+    response = HttpResponse()
+    response['Allow'] = 'OPTIONS, PROPFIND, REPORT, GET, PUT, DELETE, POST'
+    response['DAV'] = '1, 2, calendar-access'
+    response['Content-Length'] = '0'
+    return response
+
+
+def unauthorized_response() -> HttpResponse:
+    response = HttpResponse('Unauthorized', status=401)
+    response['WWW-Authenticate'] = 'Basic realm="CalDAV"'
+    return response
+
+
+def get_basic_credentials(request) -> tuple[str, str] | None:
+    auth_header = request.META.get('HTTP_AUTHORIZATION')
+    if auth_header and auth_header.startswith('Basic '):
+        try:
+            # Decode the base64-encoded credentials
+            auth_decoded = base64.b64decode(auth_header[6:]).decode('utf-8')
+            username, password = auth_decoded.split(':', 1)
+            return username, password
+        except ValueError:
+            pass
+    return None
+
+
+def requires_authentication(request) -> bool:
+    # Apply authentication only to /caldav/ paths, the well-known endpoint and the admin are left alone
+    return request.path.startswith('/caldav/')
+
 
 class CaldavMiddleware(MiddlewareMixin):
     def process_request(self, request):
-        # Exclude the well-known endpoint from authentication
-        if request.path == '/.well-known/caldav':
-            return None  # Skip authentication for the well-known path
-
-        # Apply authentication only to /caldav/ paths
-        if request.path.startswith('/caldav/'):
-            if request.method == 'OPTIONS':
-                response = HttpResponse()
-                response['Allow'] = 'OPTIONS, PROPFIND, REPORT, GET, PUT, DELETE'
-                response['DAV'] = '1, 2, calendar-access'
-                response['Content-Length'] = '0'
-                return response
-
-            if request.user.is_authenticated:
+        if not requires_authentication(request):
+            return None
+
+        if request.method == 'OPTIONS':
+            return options_response()
+
+        if request.user.is_authenticated:
+            return None
+
+        credentials = get_basic_credentials(request)
+        if credentials is not None:
+            user = authenticate_basic(request, username=credentials[0], password=credentials[1])
+            if user is not None:
+                if settings.CALDAV_SESSIONLESS_AUTH:
+                    set_user(request, user)  # Authenticate this request only, no session is written
+                else:
+                    login(request, user)  # Log the user in if authentication is successful
                 return None
 
-            auth_header = request.META.get('HTTP_AUTHORIZATION')
-            if auth_header and auth_header.startswith('Basic '):
-                try:
-                    # Decode the base64-encoded credentials
-                    auth_decoded = base64.b64decode(auth_header[6:]).decode('utf-8')
-                    username, password = auth_decoded.split(':', 1)
-                    user = authenticate(request, username=username, password=password)
-                    if user is not None:
-                        login(request, user)  # Log the user in if authentication is successful
-                        return None
-                except ValueError:
-                    pass
-
-            # If authentication fails, return a 401 Unauthorized response
-            response = HttpResponse('Unauthorized', status=401)
-            response['WWW-Authenticate'] = 'Basic realm="CalDAV"'
+        # If authentication fails, return a 401 Unauthorized response
+        return unauthorized_response()
+
+    async def __acall__(self, request):
+        # Authenticates on the event loop instead of handing every request to the sync thread
+        response = await self.aprocess_request(request)
+        return response or await self.get_response(request)
+
+    async def aprocess_request(self, request):
+        if not requires_authentication(request):
+            return None
+
+        if request.method == 'OPTIONS':
+            return options_response()
+
+        if (await request.auser()).is_authenticated:
+            return None
+
+        credentials = get_basic_credentials(request)
+        if credentials is not None:
+            user = await aauthenticate_basic(request, username=credentials[0], password=credentials[1])
+            if user is not None:
+                if settings.CALDAV_SESSIONLESS_AUTH:
+                    set_user(request, user)
+                else:
+                    await alogin(request, user)
+                    set_user(request, user)
+                return None
+
+        return unauthorized_response()
+
+
+def set_user(request, user):
+    request.user = user
+
+    async def auser():
+        return user
+
+    request.auser = auser
+
+
+def weaken_etag(response):
+    # An encoded body is not byte for byte the entity the ETag names, as in Django's GZipMiddleware it becomes weak
+    etag = response.get('ETag')
+    if etag and not etag.startswith('W/'):
+        response['ETag'] = f'W/{etag}'
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """Compresses /caldav/ responses with the best encoding the client accepts, streamed responses chunk by chunk.
+
+    Responses that already carry a Content-Encoding, like the precompressed collection responses, are left alone. The
+    admin is compressed by Django's GZipMiddleware, which also mitigates BREACH for its pages with CSRF tokens.
+    """
+
+    async def __acall__(self, request):
+        # Compression only needs the CPU, there is nothing to gain from running it in the sync thread
+        response = await self.get_response(request)
+        return self.process_response(request, response)
+
+    def process_response(self, request, response):
+        if not request.path.startswith('/caldav/'):
+            return super().process_response(request, response)
+
+        if response.has_header('Content-Encoding'):
+            weaken_etag(response)
+            return response
+        if not settings.CALDAV_COMPRESSION or response.status_code not in [200, 207]:
+            return response
+        if not response.streaming and len(response.content) < settings.CALDAV_COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ['Accept-Encoding'])
+        coding = compression.choose_encoding(request.headers.get('Accept-Encoding', ''), compression.CODECS)
+        if coding == 'identity':
             return response
 
-        # If the request is for the root path (admin) or anything else, let the default behavior happen
-        return None
+        if response.streaming and response.is_async:
+            response.streaming_content = compression.compress_async_stream(coding, response.streaming_content)
+            del response.headers['Content-Length']
+        elif response.streaming:
+            response.streaming_content = compression.compress_stream(coding, response.streaming_content)
+            del response.headers['Content-Length']
+        else:
+            response.content = compression.compress(coding, response.content)
+            response['Content-Length'] = str(len(response.content))
+        response['Content-Encoding'] = coding
+        weaken_etag(response)
+        return response
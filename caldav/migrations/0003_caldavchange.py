@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caldav', '0002_remove_caldavtasklist_sync_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='caldavtasklist',
+            name='sync_floor',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='CalDAVChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tasklist', models.CharField(max_length=255)),
+                ('uuid', models.UUIDField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tasklist', 'id'], name='caldav_cald_tasklis_38c73c_idx'), models.Index(fields=['tasklist', 'uuid'], name='caldav_cald_tasklis_295318_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caldav', '0005_caldavpushsubscription'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='caldavchange',
+            name='caldav_cald_tasklis_38c73c_idx',
+        ),
+        migrations.AddField(
+            model_name='caldavchange',
+            name='token',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='caldavtasklist',
+            name='sync_counter',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='caldavchange',
+            index=models.Index(fields=['tasklist', 'token'], name='caldav_cald_tasklis_fc9197_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:42
+from django.db import migrations
+from django.db.models import F, Max
+
+
+def populate_tokens(apps, schema_editor):
+    # Tokens were change ids so far, keeping them lets clients continue with the token they hold
+    CalDAVChange = apps.get_model('caldav', 'CalDAVChange')
+    CalDAVTasklist = apps.get_model('caldav', 'CalDAVTasklist')
+    CalDAVChange.objects.update(token=F('id'))
+    latest = dict(CalDAVChange.objects.values('tasklist').annotate(latest=Max('id')).values_list('tasklist', 'latest'))
+    for tasklist in CalDAVTasklist.objects.all():
+        tasklist.sync_counter = max(latest.get(tasklist.code, 0), tasklist.sync_floor)
+        tasklist.save(update_fields=['sync_counter'])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('caldav', '0006_caldavchange_token'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_tokens, reverse_code=migrations.RunPython.noop),
+    ]
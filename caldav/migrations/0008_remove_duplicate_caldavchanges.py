@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:40
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def remove_duplicates(apps, schema_editor):
+    # Concurrent writes could record a resource twice, the latest change is the one clients need
+    CalDAVChange = apps.get_model('caldav', 'CalDAVChange')
+    duplicates = CalDAVChange.objects.values('tasklist', 'uuid').annotate(count=Count('id'), latest=Max('id')).filter(
+        count__gt=1)
+    for duplicate in duplicates:
+        CalDAVChange.objects.filter(tasklist=duplicate['tasklist'], uuid=duplicate['uuid']).exclude(
+            id=duplicate['latest']).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('caldav', '0007_populate_caldavchange_token'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caldav', '0008_remove_duplicate_caldavchanges'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='caldavchange',
+            name='caldav_cald_tasklis_295318_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='caldavchange',
+            constraint=models.UniqueConstraint(fields=('tasklist', 'uuid'), name='unique_caldav_change'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caldav', '0009_caldavchange_unique_caldav_change'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='caldavpushsubscription',
+            name='pending_since',
+        ),
+        migrations.AddField(
+            model_name='caldavtasklist',
+            name='push_pending_since',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
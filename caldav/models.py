@@ -1,6 +1,22 @@
-from django.db import models
+from threading import local
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Case, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_init, post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
 import uuid
 
+from caldav import cache
+from inventory.models import ProductStock, MinimumProductStock
+from master.models import Product, Tag, broadcast_invalidation, register_invalidation
+from master.signals import bulk_changed
+from shopping.models import Item
+from todo.models import Task
+
 
 # Create your models here.
 class CalDAVTasklist(models.Model):
@@ -9,3 +25,319 @@ class CalDAVTasklist(models.Model):
     uuid = models.UUIDField(unique=True, default=uuid.uuid4, editable=False)
     etag = models.CharField(max_length=255)
     last_modified = models.DateTimeField(auto_now=True)
+    sync_floor = models.BigIntegerField(default=0)
+    # Latest sync token handed out, incremented under the row lock of the bump
+    sync_counter = models.BigIntegerField(default=0)
+    # Time of the first change not yet pushed to the subscribers, None when they are up to date
+    push_pending_since = models.DateTimeField(null=True, blank=True)
+
+
+class CalDAVChange(models.Model):
+    tasklist = models.CharField(max_length=255)
+    uuid = models.UUIDField()
+    deleted = models.BooleanField(default=False)
+    # Assigned by the collection bump after the commit, changes without a token are not visible to clients yet
+    token = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['tasklist', 'token']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['tasklist', 'uuid'], name='unique_caldav_change'),
+        ]
+
+
+class CalDAVAppPassword(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='caldav_app_passwords')
+    name = models.CharField(max_length=255)
+    # HMAC-SHA256 of the password keyed with SECRET_KEY, app passwords are random so no slow hash is needed
+    digest = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class CalDAVPushSubscription(models.Model):
+    uuid = models.UUIDField(unique=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                             related_name='caldav_push_subscriptions')
+    tasklist = models.CharField(max_length=255)
+    push_resource = models.URLField(max_length=500)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+register_invalidation('caldav.credentials', cache.credential_cache.clear)
+
+
+CREDENTIAL_FIELDS = ['password', 'is_active']
+
+
+def get_credentials(user) -> tuple:
+    # Read from the instance dict, deferred fields must not be loaded here
+    return tuple(user.__dict__.get(field_name) for field_name in CREDENTIAL_FIELDS)
+
+
+@receiver(post_init, sender=settings.AUTH_USER_MODEL)
+def remember_user_credentials(sender, instance, **kwargs):
+    instance._loaded_credentials = get_credentials(instance)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def on_user_save(sender, instance, created, update_fields=None, **kwargs):
+    # Logins save last_login only, those must not flush the credentials every process has verified
+    if update_fields is not None and not set(update_fields) & set(CREDENTIAL_FIELDS):
+        return
+    loaded_credentials = instance._loaded_credentials
+    instance._loaded_credentials = get_credentials(instance)
+    if created or loaded_credentials == instance._loaded_credentials:
+        return
+    invalidate_user_credentials(instance)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def on_user_delete(sender, instance, **kwargs):
+    invalidate_user_credentials(instance)
+
+
+def invalidate_user_credentials(user):
+    # Drops verified credentials after a password change, the hash check of a cache hit covers the time until the
+    # other processes have cleared theirs
+    cache.credential_cache.invalidate(user.pk)
+    broadcast_invalidation('caldav.credentials')
+
+
+TASK_TASKLISTS = ['tasks']
+ITEM_TASKLISTS = ['shoppinglist', 'shoppingcart']
+INVENTORY_TASKLISTS = ['inventory']
+
+_pending = local()
+
+
+def record_change(tasklist: str, uuid, deleted: bool = False):
+    record_changes(tasklist, [uuid], deleted)
+
+
+def record_changes(tasklist: str, uuids, deleted: bool = False):
+    record_resource_changes({tasklist: deleted}, uuids)
+
+
+def record_resource_change(uuid, deleted: dict[str, bool]):
+    """Record the change of one resource in several collections at once, deleted maps each collection to its flag."""
+    record_resource_changes(deleted, [uuid])
+
+
+def record_resource_changes(deleted: dict[str, bool], uuids):
+    """Record the change of resources in the collections, deleted maps each collection to its flag.
+
+    Only the latest change of a resource is needed to answer a sync-collection report. The rows of resources that
+    changed before are updated in place, resources changing for the first time are inserted.
+    """
+    # Compared with the values read back below, which come in the hyphenated form
+    uuids = [str(uuid.UUID(str(value))) for value in uuids]
+    if not uuids:
+        return
+    for value in uuids:
+        cache.invalidate(value)
+
+    flags = [When(tasklist=tasklist, then=Value(is_deleted)) for tasklist, is_deleted in deleted.items()]
+    now = timezone.now()
+    for chunk in chunked(uuids):
+        changes = CalDAVChange.objects.filter(tasklist__in=deleted.keys(), uuid__in=chunk)
+        updated = changes.update(deleted=Case(*flags, output_field=models.BooleanField()), token=None, created_at=now)
+        if updated == len(deleted) * len(set(chunk)):
+            continue
+
+        existing = {(tasklist, str(value)) for tasklist, value in changes.values_list('tasklist', 'uuid')} \
+            if updated else set()
+        CalDAVChange.objects.bulk_create([
+            CalDAVChange(tasklist=tasklist, uuid=value, deleted=is_deleted)
+            for tasklist, is_deleted in deleted.items() for value in dict.fromkeys(chunk)
+            if (tasklist, value) not in existing
+        ], ignore_conflicts=True)
+
+
+def bump_tasklists(codes: list[str]):
+    """Give the collections a new etag once the current transaction commits.
+
+    Bumps requested within one transaction are collected and written together. A callback is registered per call,
+    the first one to run writes all pending collections and the others find nothing left to do.
+    """
+    pending = getattr(_pending, 'codes', None)
+    if pending is None:
+        pending = _pending.codes = set()
+    pending.update(codes)
+    transaction.on_commit(flush_tasklist_bumps)
+
+
+def flush_tasklist_bumps():
+    codes = getattr(_pending, 'codes', None)
+    if not codes:
+        return
+    _pending.codes = set()
+
+    etag = uuid4().hex
+    now = timezone.now()
+    # The update keeps the collection rows locked until the commit, so concurrent bumps hand out their tokens in the
+    # order they become visible and a client never holds a token above a change it cannot see yet
+    with transaction.atomic():
+        # Pushes are delivered by deliver_caldav_push once the collection has settled, see caldav.push
+        pending_since = now if settings.CALDAV_PUSH else None
+        updated = CalDAVTasklist.objects.filter(code__in=codes).update(
+            etag=etag, last_modified=now, sync_counter=F('sync_counter') + 1,
+            push_pending_since=Coalesce(F('push_pending_since'), Value(pending_since)) if pending_since else None,
+        )
+        if updated < len(codes):
+            existing = set(CalDAVTasklist.objects.filter(code__in=codes).values_list('code', flat=True))
+            CalDAVTasklist.objects.bulk_create([
+                CalDAVTasklist(code=code, etag=etag, sync_counter=1, push_pending_since=pending_since)
+                for code in codes if code not in existing
+            ], ignore_conflicts=True)
+        CalDAVChange.objects.filter(tasklist__in=codes, token__isnull=True).update(
+            token=Subquery(CalDAVTasklist.objects.filter(code=OuterRef('tasklist')).values('sync_counter')[:1])
+        )
+
+
+@receiver(post_save, sender=Task)
+def on_task_change(sender, instance, **kwargs):
+    if instance.has_changed('name', 'deadline', 'done'):
+        record_change('tasks', instance.uuid)
+        bump_tasklists(TASK_TASKLISTS)
+
+
+@receiver(post_delete, sender=Task)
+def on_task_delete(sender, instance, **kwargs):
+    record_change('tasks', instance.uuid, deleted=True)
+    bump_tasklists(TASK_TASKLISTS)
+
+
+@receiver(post_save, sender=Item)
+def on_item_change(sender, instance, **kwargs):
+    if instance.has_changed('name', 'quantity', 'in_cart', 'product_id'):
+        record_resource_change(instance.uuid, {'shoppinglist': instance.in_cart, 'shoppingcart': not instance.in_cart})
+        bump_tasklists(ITEM_TASKLISTS)
+
+
+@receiver(post_delete, sender=Item)
+def on_item_delete(sender, instance, **kwargs):
+    record_resource_change(instance.uuid, {'shoppinglist': True, 'shoppingcart': True})
+    bump_tasklists(ITEM_TASKLISTS)
+
+
+def record_task_changes(tasks):
+    record_changes('tasks', tasks.values_list('uuid', flat=True))
+    bump_tasklists(TASK_TASKLISTS)
+
+
+def record_item_changes(items):
+    uuids = {True: [], False: []}
+    for item_uuid, in_cart in items.values_list('uuid', 'in_cart'):
+        uuids[in_cart].append(item_uuid)
+    for in_cart, item_uuids in uuids.items():
+        record_resource_changes({'shoppinglist': in_cart, 'shoppingcart': not in_cart}, item_uuids)
+    bump_tasklists(ITEM_TASKLISTS)
+
+
+def record_stock_change(instance):
+    record_product_changes({instance.product_id, instance.get_loaded_value('product_id')} - {None})
+
+
+def record_product_changes(product_ids):
+    record_changes('inventory', Product.objects.filter(pk__in=product_ids).values_list('uuid', flat=True))
+    bump_tasklists(INVENTORY_TASKLISTS)
+
+
+@receiver(m2m_changed, sender=Task.tags.through)
+@receiver(m2m_changed, sender=Item.tags.through)
+def on_tags_change(sender, instance, action, reverse, model, pk_set, **kwargs):
+    # Tag names are rendered as the description of tasks and shopping items
+    if reverse:
+        related = Task.objects if sender is Task.tags.through else Item.objects
+        if action == 'pre_clear':
+            related = related.filter(tags=instance)
+        elif action in ['post_add', 'post_remove']:
+            related = related.filter(pk__in=pk_set)
+        else:
+            return
+    elif action in ['post_add', 'post_remove', 'post_clear']:
+        related = type(instance).objects.filter(pk=instance.pk)
+    else:
+        return
+
+    if sender is Task.tags.through:
+        record_task_changes(related)
+    else:
+        record_item_changes(related)
+
+
+@receiver(post_save, sender=Tag)
+def on_tag_change(sender, instance, created, **kwargs):
+    if not created and instance.has_changed('name'):
+        record_task_changes(Task.objects.filter(tags=instance))
+        record_item_changes(Item.objects.filter(tags=instance))
+
+
+@receiver(pre_delete, sender=Tag)
+def on_tag_delete(sender, instance, **kwargs):
+    # The tag assignments are gone by the time post_delete is sent
+    record_task_changes(Task.objects.filter(tags=instance))
+    record_item_changes(Item.objects.filter(tags=instance))
+
+
+@receiver(post_save, sender=Product)
+def on_product_change(sender, instance, created, **kwargs):
+    if instance.has_changed('name'):
+        record_change('inventory', instance.uuid)
+        bump_tasklists(INVENTORY_TASKLISTS)
+
+
+@receiver(post_delete, sender=Product)
+def on_product_delete(sender, instance, **kwargs):
+    record_change('inventory', instance.uuid, deleted=True)
+    bump_tasklists(INVENTORY_TASKLISTS)
+
+
+@receiver(post_save, sender=ProductStock)
+def on_stock_change(sender, instance, **kwargs):
+    if instance.has_changed('stock', 'product_id'):
+        record_stock_change(instance)
+
+
+@receiver(post_save, sender=MinimumProductStock)
+def on_minimum_stock_change(sender, instance, **kwargs):
+    if instance.has_changed('minimum_stock', 'product_id'):
+        record_stock_change(instance)
+
+
+@receiver(post_delete, sender=ProductStock)
+@receiver(post_delete, sender=MinimumProductStock)
+def on_stock_delete(sender, instance, **kwargs):
+    record_stock_change(instance)
+
+
+def chunked(values, size: int = 1000):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+@receiver(bulk_changed, sender=Task)
+def on_tasks_bulk_change(sender, pks, **kwargs):
+    for chunk in chunked(pks):
+        record_task_changes(Task.objects.filter(pk__in=chunk))
+
+
+@receiver(bulk_changed, sender=Item)
+def on_items_bulk_change(sender, pks, **kwargs):
+    for chunk in chunked(pks):
+        record_item_changes(Item.objects.filter(pk__in=chunk))
+
+
+@receiver(bulk_changed, sender=ProductStock)
+@receiver(bulk_changed, sender=MinimumProductStock)
+def on_stock_bulk_change(sender, pks, **kwargs):
+    for chunk in chunked(pks):
+        record_product_changes(sender.objects.filter(pk__in=chunk).values('product_id'))
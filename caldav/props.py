@@ -0,0 +1,96 @@
+from typing import Callable
+
+from lxml import etree
+
+from caldav.report import ReportError, parse_report
+
+DAV_NS = 'DAV:'
+
+# Builders append one property element to the given <D:prop>
+PropertyBuilder = Callable[[etree.Element], None]
+
+
+class Propfind:
+    def __init__(self, requested: list[str] | None = None, names_only: bool = False):
+        # None requests all properties
+        self.requested = requested
+        self.names_only = names_only
+
+    def wants(self, name: str) -> bool:
+        return self.requested is None or name in self.requested
+
+    def key(self) -> tuple:
+        return tuple(self.requested) if self.requested is not None else (), self.requested is None, self.names_only
+
+
+ALLPROP = Propfind()
+
+
+def parse_propfind(body: bytes) -> Propfind:
+    if not body:
+        return ALLPROP
+
+    propfind = parse_report(body)
+    if propfind.tag != f'{{{DAV_NS}}}propfind':
+        raise ReportError(f'Unexpected element {propfind.tag}')
+
+    if propfind.find(f'{{{DAV_NS}}}propname') is not None:
+        return Propfind(names_only=True)
+
+    return get_requested_props(propfind)
+
+
+def get_requested_props(element: etree.Element) -> Propfind:
+    prop = element.find(f'{{{DAV_NS}}}prop')
+    if prop is None:
+        return ALLPROP
+    return Propfind([child.tag for child in prop if isinstance(child.tag, str)])
+
+
+def text_property(name: str, value: str) -> PropertyBuilder:
+    def build(prop: etree.Element):
+        etree.SubElement(prop, name).text = value
+
+    return build
+
+
+def href_property(name: str, href: str) -> PropertyBuilder:
+    def build(prop: etree.Element):
+        etree.SubElement(etree.SubElement(prop, name), '{DAV:}href').text = href
+
+    return build
+
+
+def propstat(response: etree.Element, status: str) -> etree.Element:
+    propstat_element = etree.SubElement(response, '{DAV:}propstat')
+    prop = etree.SubElement(propstat_element, '{DAV:}prop')
+    etree.SubElement(propstat_element, '{DAV:}status').text = status
+    return prop
+
+
+def render_response(href: str, properties: dict[str, PropertyBuilder], propfind: Propfind,
+                    nsmap: dict[str, str]) -> etree.Element:
+    response = etree.Element('{DAV:}response', nsmap=nsmap)
+    etree.SubElement(response, '{DAV:}href').text = href
+
+    if propfind.names_only:
+        prop = propstat(response, 'HTTP/1.1 200 OK')
+        for name in properties.keys():
+            etree.SubElement(prop, name)
+        return response
+
+    requested = propfind.requested if propfind.requested is not None else properties.keys()
+    found = [name for name in requested if name in properties]
+    missing = [name for name in requested if name not in properties]
+
+    if found or not missing:
+        prop = propstat(response, 'HTTP/1.1 200 OK')
+        for name in found:
+            properties[name](prop)
+
+    if missing:
+        prop = propstat(response, 'HTTP/1.1 404 Not Found')
+        for name in missing:
+            etree.SubElement(prop, name)
+
+    return response
@@ -0,0 +1,145 @@
+import ipaddress
+import socket
+from datetime import datetime, timezone as dt_timezone
+from typing import NamedTuple
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.http.request import validate_host
+from django.utils import timezone
+from django.utils.http import parse_http_date
+from lxml import etree
+
+from caldav import sync
+from caldav.models import CalDAVPushSubscription, CalDAVTasklist
+from caldav.report import ReportError, parse_report
+
+PUSH_NS = 'https://bitfire.at/webdav-push'
+
+
+class PushRegistration(NamedTuple):
+    push_resource: str
+    expires: datetime | None
+
+
+class DeliveryResult(NamedTuple):
+    delivered: int
+    failed: int
+    removed: int
+
+
+def parse_push_register(body: bytes) -> PushRegistration:
+    register = parse_report(body)
+    if register.tag != f'{{{PUSH_NS}}}push-register':
+        raise ReportError(f'Unexpected element {register.tag}')
+
+    push_resource = register.findtext(
+        f'{{{PUSH_NS}}}subscription/{{{PUSH_NS}}}web-push-subscription/{{{PUSH_NS}}}push-resource'
+    )
+    if not push_resource or urlparse(push_resource.strip()).scheme not in ['http', 'https']:
+        raise ReportError('Missing or invalid push resource')
+    if not is_allowed_push_resource(push_resource.strip()):
+        raise ReportError('Push resource not allowed')
+
+    expires = None
+    expires_text = register.findtext(f'{{{PUSH_NS}}}expires')
+    if expires_text:
+        try:
+            expires = datetime.fromtimestamp(parse_http_date(expires_text.strip()), dt_timezone.utc)
+        except ValueError:
+            raise ReportError(f'Invalid expiry {expires_text}')
+    return PushRegistration(push_resource.strip(), expires)
+
+
+def register_subscription(user, tasklist: str, registration: PushRegistration) -> tuple[CalDAVPushSubscription, bool]:
+    """Create the subscription or renew the one the client registered before, the expiry is capped."""
+    latest_expiry = timezone.now() + settings.CALDAV_PUSH_MAX_EXPIRY
+    expires_at = min(registration.expires, latest_expiry) if registration.expires else latest_expiry
+    subscription = CalDAVPushSubscription.objects.filter(
+        user=user, tasklist=tasklist, push_resource=registration.push_resource
+    ).first()
+    if subscription is not None:
+        subscription.expires_at = expires_at
+        subscription.save(update_fields=['expires_at'])
+        return subscription, False
+    return CalDAVPushSubscription.objects.create(
+        user=user, tasklist=tasklist, push_resource=registration.push_resource, expires_at=expires_at
+    ), True
+
+
+def push_message(topic: str, sync_token: str) -> bytes:
+    message = etree.Element(f'{{{PUSH_NS}}}push-message', nsmap={'P': PUSH_NS, 'D': 'DAV:'})
+    etree.SubElement(message, f'{{{PUSH_NS}}}topic').text = topic
+    content_update = etree.SubElement(message, f'{{{PUSH_NS}}}content-update')
+    etree.SubElement(content_update, '{DAV:}sync-token').text = sync_token
+    return etree.tostring(message, xml_declaration=True, encoding='utf-8')
+
+
+def is_allowed_push_resource(push_resource: str) -> bool:
+    """Whether the push resource is on an allowed host whose addresses are all public.
+
+    The server POSTs to registered push resources, they must not reach services on the internal network.
+    """
+    url = urlparse(push_resource)
+    if not url.hostname or not validate_host(url.hostname, settings.CALDAV_PUSH_ALLOWED_HOSTS):
+        return False
+    try:
+        addresses = socket.getaddrinfo(url.hostname, url.port or (443 if url.scheme == 'https' else 80),
+                                       proto=socket.IPPROTO_TCP)
+    except (OSError, ValueError):
+        return False
+    return all(ipaddress.ip_address(address[4][0]).is_global for address in addresses)
+
+
+def send_push_message(push_resource: str, body: bytes):
+    # Checked again on delivery, the host may resolve to other addresses by now
+    if not is_allowed_push_resource(push_resource):
+        raise URLError(f'Push resource not allowed: {push_resource}')
+    request = Request(push_resource, data=body, method='POST', headers={
+        'Content-Type': 'application/xml; charset=utf-8',
+        # Push services drop the message if the client stays offline longer, it will sync on its next poll anyway
+        'TTL': str(int(settings.CALDAV_PUSH_MAX_EXPIRY.total_seconds())),
+    })
+    with urlopen(request, timeout=settings.CALDAV_PUSH_TIMEOUT) as response:
+        response.read()
+
+
+def is_due(tasklist: CalDAVTasklist, now: datetime) -> bool:
+    # Debounced on the last change of the collection, a collection that keeps changing is still notified regularly
+    settled = tasklist.last_modified <= now - settings.CALDAV_PUSH_DEBOUNCE
+    return settled or tasklist.push_pending_since <= now - settings.CALDAV_PUSH_MAX_DELAY
+
+
+def deliver_notifications() -> DeliveryResult:
+    """Send one push message per subscription whose collection changed and has settled since."""
+    now = timezone.now()
+    removed, _ = CalDAVPushSubscription.objects.filter(expires_at__lte=now).delete()
+    delivered = failed = 0
+    for tasklist in CalDAVTasklist.objects.filter(push_pending_since__isnull=False):
+        if not is_due(tasklist, now):
+            continue
+
+        # Claimed with the time it was read with, a second worker skips it and changes made meanwhile mark it again
+        claimed = CalDAVTasklist.objects.filter(
+            pk=tasklist.pk, push_pending_since=tasklist.push_pending_since
+        ).update(push_pending_since=None)
+        subscriptions = list(CalDAVPushSubscription.objects.filter(tasklist=tasklist.code)) if claimed else []
+        if not subscriptions:
+            continue
+
+        message = push_message(str(tasklist.uuid), sync.format_sync_token(sync.get_current_token(tasklist.code)))
+        for subscription in subscriptions:
+            try:
+                send_push_message(subscription.push_resource, message)
+                delivered += 1
+            except HTTPError as e:
+                failed += 1
+                # The push service no longer knows the subscription
+                if e.code in [404, 410]:
+                    subscription.delete()
+                    removed += 1
+            except (URLError, OSError):
+                failed += 1
+    return DeliveryResult(delivered, failed, removed)
@@ -0,0 +1,259 @@
+from datetime import datetime, timezone as dt_timezone
+from typing import NamedTuple
+from urllib.parse import unquote, urlparse
+from uuid import UUID
+
+from django.db.models import Q
+from lxml import etree
+
+DAV_NS = 'DAV:'
+CALDAV_NS = 'urn:ietf:params:xml:ns:caldav'
+
+# Matches nothing, used for filters that can never be satisfied
+NOTHING = Q(pk__in=[])
+
+# Properties every VTODO we render contains, per collection
+EMITTED_PROPERTIES = {
+    'tasks': {'UID', 'DTSTAMP', 'SUMMARY', 'STATUS', 'DESCRIPTION'},
+    'shoppinglist': {'UID', 'DTSTAMP', 'SUMMARY', 'STATUS', 'DESCRIPTION'},
+    'shoppingcart': {'UID', 'DTSTAMP', 'SUMMARY', 'STATUS', 'DESCRIPTION'},
+    'inventory': {'UID', 'DTSTAMP', 'SUMMARY', 'STATUS'},
+}
+
+STATUSES = ['NEEDS-ACTION', 'COMPLETED']
+
+
+class ReportError(ValueError):
+    pass
+
+
+class TextMatch(NamedTuple):
+    text: str
+    collation: str | None
+    negate: bool
+
+    def matches(self, value: str) -> bool:
+        return text_matches(self.text, value, self.collation) != self.negate
+
+
+def parse_report(body: bytes) -> etree.Element:
+    try:
+        return etree.fromstring(body)
+    except etree.XMLSyntaxError as e:
+        raise ReportError(str(e))
+
+
+def uuid_from_href(href: str) -> str | None:
+    path = unquote(urlparse(href.strip()).path)
+    segments = [segment for segment in path.split('/') if segment]
+    if not segments:
+        return None
+
+    event_uid = segments[-1]
+    if event_uid.endswith('.ics'):
+        event_uid = event_uid[:-4]
+
+    try:
+        return str(UUID(event_uid))
+    except ValueError:
+        return None
+
+
+def get_multiget_hrefs(report: etree.Element) -> dict[str, str | None]:
+    return {
+        href.text.strip(): uuid_from_href(href.text)
+        for href in report.iterfind(f'{{{DAV_NS}}}href') if href.text
+    }
+
+
+def get_sync_token(report: etree.Element) -> str | None:
+    sync_token = report.find(f'{{{DAV_NS}}}sync-token')
+    if sync_token is None or not sync_token.text:
+        return None
+    return sync_token.text.strip()
+
+
+def compile_calendar_query(report: etree.Element, calendar_id: str) -> Q:
+    calendar_filter = report.find(f'{{{CALDAV_NS}}}filter')
+    if calendar_filter is None:
+        return Q()
+
+    condition = Q()
+    for comp_filter in calendar_filter.iterfind(f'{{{CALDAV_NS}}}comp-filter'):
+        if comp_filter.get('name', '').upper() != 'VCALENDAR' or is_not_defined(comp_filter):
+            return NOTHING
+
+        for todo_filter in comp_filter.iterfind(f'{{{CALDAV_NS}}}comp-filter'):
+            condition &= compile_todo_filter(todo_filter, calendar_id)
+
+    return condition
+
+
+def compile_todo_filter(comp_filter: etree.Element, calendar_id: str) -> Q:
+    if comp_filter.get('name', '').upper() != 'VTODO' or is_not_defined(comp_filter):
+        return NOTHING
+
+    condition = Q()
+
+    time_range = comp_filter.find(f'{{{CALDAV_NS}}}time-range')
+    if time_range is not None:
+        condition &= compile_todo_time_range(time_range, calendar_id)
+
+    for prop_filter in comp_filter.iterfind(f'{{{CALDAV_NS}}}prop-filter'):
+        condition &= compile_prop_filter(prop_filter, calendar_id)
+
+    # We never render sub-components other than the alarm of a task with a deadline
+    for sub_filter in comp_filter.iterfind(f'{{{CALDAV_NS}}}comp-filter'):
+        if sub_filter.get('name', '').upper() == 'VALARM' and calendar_id == 'tasks':
+            condition &= Q(deadline__isnull=is_not_defined(sub_filter))
+        elif not is_not_defined(sub_filter):
+            return NOTHING
+
+    return condition
+
+
+def compile_todo_time_range(time_range: etree.Element, calendar_id: str) -> Q:
+    start = parse_datetime(time_range.get('start'))
+    end = parse_datetime(time_range.get('end'))
+
+    # Shopping and inventory items carry no DUE, COMPLETED or CREATED and therefore match any range (RFC 4791 9.9)
+    if calendar_id != 'tasks':
+        return Q()
+
+    return (
+        Q(deadline__isnull=False) & range_condition('deadline', start, end)
+        | Q(deadline__isnull=True, done__isnull=False) & range_condition('done', start, end)
+        | Q(deadline__isnull=True, done__isnull=True)
+    )
+
+
+def compile_prop_filter(prop_filter: etree.Element, calendar_id: str) -> Q:
+    name = prop_filter.get('name', '').upper()
+    defined = property_defined_condition(name, calendar_id)
+
+    if is_not_defined(prop_filter):
+        return ~defined
+
+    condition = defined
+
+    time_range = prop_filter.find(f'{{{CALDAV_NS}}}time-range')
+    if time_range is not None:
+        condition &= property_time_range_condition(
+            name, calendar_id, parse_datetime(time_range.get('start')), parse_datetime(time_range.get('end'))
+        )
+
+    text_match = prop_filter.find(f'{{{CALDAV_NS}}}text-match')
+    if text_match is not None:
+        condition &= property_text_condition(name, calendar_id, text_match)
+
+    return condition
+
+
+def property_defined_condition(name: str, calendar_id: str) -> Q:
+    if name in EMITTED_PROPERTIES.get(calendar_id, set()):
+        return Q()
+
+    if calendar_id == 'tasks':
+        if name == 'DUE':
+            return Q(deadline__isnull=False)
+        if name == 'COMPLETED':
+            return Q(done__isnull=False)
+
+    return NOTHING
+
+
+def property_time_range_condition(name: str, calendar_id: str, start, end) -> Q:
+    if calendar_id == 'tasks':
+        if name == 'DUE':
+            return range_condition('deadline', start, end)
+        if name == 'COMPLETED':
+            return range_condition('done', start, end)
+
+    # DTSTAMP and other dates cannot be evaluated in the database, clients filter them on their side
+    return Q()
+
+
+def property_text_condition(name: str, calendar_id: str, text_match: etree.Element) -> Q:
+    text = text_match.text or ''
+    negate = text_match.get('negate-condition', 'no') == 'yes'
+
+    if name == 'STATUS':
+        # Exact, the statuses are matched here and only the resulting set is looked up
+        matched = [status for status in STATUSES if text_matches(text, status, text_match.get('collation')) != negate]
+        return status_condition(matched, calendar_id)
+
+    # The SUMMARY of a task is its name, the database narrows the candidates down and get_summary_matches decides.
+    # icontains is a superset of both collations only as long as it is not negated.
+    if name == 'SUMMARY' and calendar_id == 'tasks' and not negate:
+        return Q(name__icontains=text)
+
+    # Not mapped to a column, return a superset
+    return Q()
+
+
+def get_summary_matches(report: etree.Element) -> list[TextMatch]:
+    """The SUMMARY text-matches of a calendar-query, checked against the rendered summary of every candidate."""
+    calendar_filter = report.find(f'{{{CALDAV_NS}}}filter')
+    if calendar_filter is None:
+        return []
+
+    matches = []
+    for comp_filter in calendar_filter.iterfind(f'{{{CALDAV_NS}}}comp-filter'):
+        for todo_filter in comp_filter.iterfind(f'{{{CALDAV_NS}}}comp-filter'):
+            for prop_filter in todo_filter.iterfind(f'{{{CALDAV_NS}}}prop-filter'):
+                text_match = prop_filter.find(f'{{{CALDAV_NS}}}text-match')
+                if prop_filter.get('name', '').upper() == 'SUMMARY' and text_match is not None:
+                    matches.append(TextMatch(
+                        text_match.text or '',
+                        text_match.get('collation'),
+                        text_match.get('negate-condition', 'no') == 'yes',
+                    ))
+    return matches
+
+
+def status_condition(statuses: list[str], calendar_id: str) -> Q:
+    if len(statuses) == len(STATUSES):
+        return Q()
+    if len(statuses) == 0:
+        return NOTHING
+
+    completed = statuses[0] == 'COMPLETED'
+    if calendar_id == 'tasks':
+        return Q(done__isnull=not completed)
+    if calendar_id == 'shoppinglist':
+        return Q(in_cart=completed)
+    if calendar_id == 'shoppingcart':
+        return Q(in_cart=not completed)
+    if calendar_id == 'inventory':
+        if completed:
+            return Q(stock=0)
+        return ~Q(stock=0)
+    return NOTHING
+
+
+def text_matches(text: str, value: str, collation: str | None) -> bool:
+    if collation == 'i;octet':
+        return text in value
+    return text.lower() in value.lower()
+
+
+def range_condition(field: str, start: datetime | None, end: datetime | None) -> Q:
+    condition = Q()
+    if start is not None:
+        condition &= Q(**{f'{field}__gte': start})
+    if end is not None:
+        condition &= Q(**{f'{field}__lte': end})
+    return condition
+
+
+def is_not_defined(element: etree.Element) -> bool:
+    return element.find(f'{{{CALDAV_NS}}}is-not-defined') is not None
+
+
+def parse_datetime(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y%m%dT%H%M%SZ').replace(tzinfo=dt_timezone.utc)
+    except ValueError:
+        raise ReportError(f'Invalid time-range value: {value}')
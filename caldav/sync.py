@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from caldav.models import CalDAVChange, CalDAVTasklist
+
+SYNC_TOKEN_PREFIX = 'urn:cleverlist:sync:'
+
+_last_compaction = None
+
+
+class InvalidSyncToken(ValueError):
+    pass
+
+
+def format_sync_token(token: int) -> str:
+    return f'{SYNC_TOKEN_PREFIX}{token}'
+
+
+def parse_sync_token(sync_token: str | None) -> int:
+    if not sync_token:
+        return 0
+    if not sync_token.startswith(SYNC_TOKEN_PREFIX):
+        raise InvalidSyncToken(sync_token)
+    try:
+        return int(sync_token[len(SYNC_TOKEN_PREFIX):])
+    except ValueError:
+        raise InvalidSyncToken(sync_token)
+
+
+def get_sync_floor(code: str) -> int:
+    return CalDAVTasklist.objects.filter(code=code).values_list('sync_floor', flat=True).first() or 0
+
+
+def get_current_token(code: str) -> int:
+    tasklist = CalDAVTasklist.objects.filter(code=code).values('sync_counter', 'sync_floor').first()
+    return max(tasklist['sync_counter'], tasklist['sync_floor']) if tasklist else 0
+
+
+def get_current_tokens() -> dict[str, str]:
+    return {
+        code: format_sync_token(max(counter, floor))
+        for code, counter, floor in CalDAVTasklist.objects.values_list('code', 'sync_counter', 'sync_floor')
+    }
+
+
+async def aget_current_token(code: str) -> int:
+    tasklist = await CalDAVTasklist.objects.filter(code=code).values('sync_counter', 'sync_floor').afirst()
+    return max(tasklist['sync_counter'], tasklist['sync_floor']) if tasklist else 0
+
+
+async def aget_current_tokens() -> dict[str, str]:
+    return {
+        code: format_sync_token(max(counter, floor))
+        async for code, counter, floor in CalDAVTasklist.objects.values_list('code', 'sync_counter', 'sync_floor')
+    }
+
+
+def get_changes(code: str, token: int) -> tuple[int, dict[str, bool]]:
+    """Return the current token and the uuids changed since ``token`` mapped to whether they were deleted."""
+    if token < get_sync_floor(code) or token > get_current_token(code):
+        raise InvalidSyncToken(format_sync_token(token))
+
+    changes = {}
+    current = token
+    for change_token, uuid, deleted in CalDAVChange.objects.filter(tasklist=code, token__gt=token).order_by(
+            'token').values_list('token', 'uuid', 'deleted'):
+        changes[str(uuid)] = deleted
+        current = change_token
+
+    return current, changes
+
+
+def compact_changes(retention=None) -> int:
+    if retention is None:
+        retention = settings.CALDAV_SYNC_RETENTION
+    cutoff = timezone.now() - retention
+
+    with transaction.atomic():
+        compacted = CalDAVChange.objects.filter(created_at__lt=cutoff, token__isnull=False)
+        floors = compacted.values('tasklist').annotate(floor=Max('token'))
+        for floor in floors:
+            tasklist, created = CalDAVTasklist.objects.get_or_create(code=floor['tasklist'])
+            if floor['floor'] > tasklist.sync_floor:
+                tasklist.sync_floor = floor['floor']
+                tasklist.save(update_fields=['sync_floor'])
+        deleted, _ = compacted.delete()
+
+    return deleted
+
+
+def compact_changes_periodically():
+    global _last_compaction
+    now = timezone.now()
+    if _last_compaction is None or now - _last_compaction > settings.CALDAV_SYNC_COMPACTION_INTERVAL:
+        _last_compaction = now
+        compact_changes()
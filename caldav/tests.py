@@ -1,3 +1,712 @@
-from django.test import TestCase
+import base64
+import socket
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+from urllib.error import URLError
+from uuid import uuid4
+from zoneinfo import ZoneInfo
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User, update_last_login
+from django.core.cache import caches
+from django.test import AsyncClient, AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, \
+    override_settings
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date
+from lxml import etree
+
+from caldav import async_views, cache, helper, ical, push, sync, views
+from caldav.models import CalDAVChange, CalDAVPushSubscription, CalDAVTasklist, bump_tasklists, record_changes
+from caldav.urls import caldav_urlpatterns
+from inventory.models import Location, MinimumProductStock, ProductStock, ProductWithStock
+from master.models import CacheGeneration, Product, Tag
+from shopping.models import Item
+from todo.models import Task
+
+
+def calendar_query(prop_filter: str) -> str:
+    return (
+        '<C:calendar-query xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">'
+        '<D:prop><D:getetag/></D:prop>'
+        '<C:filter><C:comp-filter name="VCALENDAR"><C:comp-filter name="VTODO">'
+        f'{prop_filter}'
+        '</C:comp-filter></C:comp-filter></C:filter>'
+        '</C:calendar-query>'
+    )
+
+
+def summary_filter(text: str, negate: bool = False, collation: str = 'i;ascii-casemap') -> str:
+    negate_condition = 'yes' if negate else 'no'
+    return (
+        f'<C:prop-filter name="SUMMARY"><C:text-match collation="{collation}" '
+        f'negate-condition="{negate_condition}">{text}</C:text-match></C:prop-filter>'
+    )
+
+
+class CalDAVTestCase(TestCase):
+    def setUp(self):
+        User.objects.create_user('caldav', password='secret')
+        credentials = base64.b64encode(b'caldav:secret').decode()
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Basic {credentials}'
+
+    def report(self, calendar_id: str, body: str) -> str:
+        response = self.client.generic('REPORT', f'/caldav/{calendar_id}/', body, content_type='application/xml',
+                                       HTTP_DEPTH='1')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content if response.streaming else [response.content]).decode()
+
+
+class CalendarQueryTest(CalDAVTestCase):
+    def test_summary_matches_rendered_shopping_summary(self):
+        milk = Item.objects.create(product=Product.objects.create(name='Milch'), quantity=2)
+        bread = Item.objects.create(product=Product.objects.create(name='Brot'), quantity=1)
+
+        body = self.report('shoppinglist', calendar_query(summary_filter('2 x Milch')))
+
+        self.assertIn(str(milk.uuid), body)
+        self.assertNotIn(str(bread.uuid), body)
+
+    def test_negated_summary_match(self):
+        milk = Task.objects.create(name='Milch holen')
+        bread = Task.objects.create(name='Brot backen')
+
+        body = self.report('tasks', calendar_query(summary_filter('milch', negate=True)))
+
+        self.assertNotIn(str(milk.uuid), body)
+        self.assertIn(str(bread.uuid), body)
+
+    def test_negated_octet_summary_match(self):
+        upper = Task.objects.create(name='Milch holen')
+        lower = Task.objects.create(name='milch holen')
+
+        body = self.report('tasks', calendar_query(summary_filter('milch', negate=True, collation='i;octet')))
+
+        self.assertIn(str(upper.uuid), body)
+        self.assertNotIn(str(lower.uuid), body)
+
+    def test_negated_status_match(self):
+        open_task = Task.objects.create(name='Offen')
+        Task.objects.create(name='Erledigt', done='2024-01-01T00:00:00Z')
+
+        body = self.report('tasks', calendar_query(
+            '<C:prop-filter name="STATUS"><C:text-match negate-condition="yes">COMPLETED</C:text-match>'
+            '</C:prop-filter>'
+        ))
+
+        self.assertEqual(body.count('<D:response'), 1)
+        self.assertIn(str(open_task.uuid), body)
+
+
+def propfind_body(*props: str) -> str:
+    return f'<D:propfind xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav"><D:prop>{"".join(props)}</D:prop>' \
+           '</D:propfind>'
+
+
+class PropfindTest(CalDAVTestCase):
+    def setUp(self):
+        super().setUp()
+        CalDAVTasklist.objects.create(code='tasks', etag=uuid4().hex)
+        self.task = Task.objects.create(name='Milch holen')
+
+    def propfind(self, body: str, depth: str) -> dict[str, etree.Element]:
+        response = self.client.generic('PROPFIND', '/caldav/tasks/', body, content_type='application/xml',
+                                       HTTP_DEPTH=depth)
+        self.assertIn(response.status_code, [200, 207])
+        multistatus = etree.fromstring(b''.join(response.streaming_content if response.streaming
+                                                else [response.content]))
+        return {response.findtext('{DAV:}href'): response for response in multistatus.iter('{DAV:}response')}
+
+    def test_depth_0_returns_only_the_collection(self):
+        responses = self.propfind(propfind_body('<D:getetag/>'), '0')
+        self.assertEqual(list(responses), ['/caldav/tasks/'])
+
+    def test_requested_props_only(self):
+        task_href = f'/caldav/tasks/{self.task.uuid}/'
+        responses = self.propfind(propfind_body('<D:getetag/>'), '1')
+        self.assertEqual(set(responses), {'/caldav/tasks/', task_href})
+        self.assertIsNotNone(responses[task_href].find('.//{DAV:}getetag'))
+        self.assertIsNone(responses[task_href].find('.//{urn:ietf:params:xml:ns:caldav}calendar-data'))
+        self.assertIsNone(responses[task_href].find('.//{DAV:}displayname'))
+
+        responses = self.propfind(propfind_body('<D:getetag/>', '<C:calendar-data/>'), '1')
+        self.assertIn('SUMMARY:Milch holen', responses[task_href].findtext(
+            './/{urn:ietf:params:xml:ns:caldav}calendar-data'))
+
+    def test_unknown_props_are_not_found(self):
+        responses = self.propfind(propfind_body('<D:getetag/>', '<X:color xmlns:X="urn:example"/>'), '1')
+        for response in responses.values():
+            statuses = {propstat.findtext('{DAV:}status'): propstat for propstat in response.iter('{DAV:}propstat')}
+            self.assertIsNotNone(statuses['HTTP/1.1 404 Not Found'].find('{DAV:}prop/{urn:example}color'))
+            self.assertIsNone(statuses['HTTP/1.1 200 OK'].find('{DAV:}prop/{urn:example}color'))
+
+
+def vtodo(summary: str, status: str = 'NEEDS-ACTION') -> str:
+    return '\r\n'.join([
+        'BEGIN:VCALENDAR', 'VERSION:2.0', 'BEGIN:VTODO', f'SUMMARY:{summary}', f'STATUS:{status}',
+        'END:VTODO', 'END:VCALENDAR', '',
+    ])
+
+
+class ConditionalRequestTest(CalDAVTestCase):
+    def setUp(self):
+        super().setUp()
+        self.task = Task.objects.create(name='Milch holen')
+        self.url = f'/caldav/tasks/{self.task.uuid}.ics'
+        self.etag = self.client.get(self.url)['ETag']
+
+    def put(self, summary: str, **headers):
+        return self.client.put(self.url, vtodo(summary), content_type='text/calendar', **headers)
+
+    def test_get_if_none_match(self):
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_put_if_match(self):
+        self.assertEqual(self.put('Milch kaufen', HTTP_IF_MATCH='"stale"').status_code, 412)
+        self.assertEqual(Task.objects.get(pk=self.task.pk).name, 'Milch holen')
+
+        response = self.put('Milch kaufen', HTTP_IF_MATCH=self.etag)
+        self.assertEqual(response.status_code, 204)
+        self.assertNotEqual(response['ETag'], self.etag)
+        self.assertEqual(self.put('Brot kaufen', HTTP_IF_MATCH=self.etag).status_code, 412)
+
+    def test_put_if_none_match_any(self):
+        self.assertEqual(self.put('Milch kaufen', HTTP_IF_NONE_MATCH='*').status_code, 412)
+
+        created = self.client.put(f'/caldav/tasks/{uuid4()}.ics', vtodo('Brot kaufen'), content_type='text/calendar',
+                                  HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(created.status_code, 204)
+        self.assertTrue(Task.objects.filter(name='Brot kaufen').exists())
+
+    def test_delete_if_match(self):
+        self.assertEqual(self.client.delete(self.url, HTTP_IF_MATCH='"stale"').status_code, 412)
+        self.assertEqual(self.client.delete(self.url, HTTP_IF_MATCH=self.etag).status_code, 204)
+        self.assertFalse(Task.objects.filter(pk=self.task.pk).exists())
+
+
+# The CalDAV routes served by the async handlers, whatever CALDAV_ASYNC_VIEWS is set to, see AsyncHandlerTest
+urlpatterns = caldav_urlpatterns(async_views)
+
+
+@override_settings(ROOT_URLCONF='caldav.tests')
+class AsyncHandlerTest(TransactionTestCase):
+    """Requests through the async handlers, writes run in the sync thread and commit."""
+
+    def setUp(self):
+        User.objects.create_user('caldav', password='secret')
+        credentials = base64.b64encode(b'caldav:secret').decode()
+        # Defaults of the async client are ASGI header names
+        self.async_client = AsyncClient(authorization=f'Basic {credentials}')
+        self.task = Task.objects.create(name='Milch holen')
+        self.url = f'/caldav/tasks/{self.task.uuid}.ics'
+
+    async def content(self, response) -> str:
+        if response.streaming:
+            return b''.join([chunk async for chunk in response.streaming_content]).decode()
+        return response.content.decode()
+
+    async def test_get(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('SUMMARY:Milch holen', response.content.decode())
+        response = await self.async_client.get(self.url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_put(self):
+        etag = (await self.async_client.get(self.url))['ETag']
+        response = await self.async_client.put(self.url, vtodo('Milch kaufen', 'COMPLETED'),
+                                               content_type='text/calendar', headers={'If-Match': etag})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response['ETag'], (await helper.aget_todo('tasks', str(self.task.uuid)))[0])
+        task = await Task.objects.aget(pk=self.task.pk)
+        self.assertEqual(task.name, 'Milch kaufen')
+        self.assertIsNotNone(task.done)
+
+        stale = await self.async_client.put(self.url, vtodo('Brot'), content_type='text/calendar',
+                                            headers={'If-Match': etag})
+        self.assertEqual(stale.status_code, 412)
+
+    async def test_report(self):
+        await Task.objects.acreate(name='Brot backen')
+        response = await self.async_client.generic('REPORT', '/caldav/tasks/', calendar_query(summary_filter('milch')),
+                                                   content_type='application/xml', headers={'Depth': '1'})
+        self.assertEqual(response.status_code, 200)
+        body = await self.content(response)
+        self.assertIn(str(self.task.uuid), body)
+        self.assertEqual(body.count('<D:response'), 1)
+
+    async def test_propfind_and_sync_collection(self):
+        response = await self.async_client.generic('PROPFIND', '/caldav/tasks/', propfind_body('<D:sync-token/>'),
+                                                   content_type='application/xml', headers={'Depth': '0'})
+        token = etree.fromstring((await self.content(response)).encode()).findtext('.//{DAV:}sync-token')
+        created = uuid4()
+        response = await self.async_client.put(f'/caldav/tasks/{created}.ics', vtodo('Brot backen'),
+                                               content_type='text/calendar')
+        self.assertEqual(response.status_code, 204)
+
+        response = await self.async_client.generic(
+            'REPORT', '/caldav/tasks/',
+            '<D:sync-collection xmlns:D="DAV:"><D:sync-token>' + token + '</D:sync-token><D:sync-level>1'
+            '</D:sync-level><D:prop><D:getetag/></D:prop></D:sync-collection>',
+            content_type='application/xml', headers={'Depth': '1'},
+        )
+        self.assertEqual(response.status_code, 200)
+        body = await self.content(response)
+        self.assertIn(str(created), body)
+        self.assertNotIn(str(self.task.uuid), body)
+
+
+class PutQueryCountTest(TestCase):
+    """Queries of a PUT, including the collection bump after the commit and the ETag of the response.
+
+    The counts include the savepoints of the test transaction, two per PUT and one per nested atomic block.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        CalDAVTasklist.objects.bulk_create(
+            [CalDAVTasklist(code=code, etag='') for code in ['tasks', 'shoppinglist', 'shoppingcart', 'inventory']]
+        )
+        CacheGeneration.objects.bulk_create(
+            [CacheGeneration(namespace=namespace) for namespace in ['inventory.under-stock', 'master.products']]
+        )
+        cls.product = Product.objects.create(name='Milch')
+        location = Location.objects.create(name='Keller')
+        ProductStock.objects.create(product=cls.product, location=location, stock=5)
+        MinimumProductStock.objects.create(product=cls.product, location=location, minimum_stock=5)
+
+    def put(self, calendar_id: str, uid, body: str, queries: int):
+        request = RequestFactory().generic('PUT', f'/caldav/{calendar_id}/{uid}.ics', body,
+                                           content_type='text/calendar')
+        with self.assertNumQueries(queries), self.captureOnCommitCallbacks(execute=True):
+            response = views.task_handler(request, calendar_id, f'{uid}.ics')
+        self.assertEqual(response.status_code, 204)
+        if calendar_id != 'inventory':
+            self.assertEqual(response['ETag'], helper.get_todo(calendar_id, str(uid))[0])
+
+    def test_tasks(self):
+        uid = uuid4()
+        # Insert, change record and the tags for the ETag
+        self.put('tasks', uid, vtodo('Milch holen'), 11)
+        # One fetch with its tags, one UPDATE, the change record and the bump
+        self.put('tasks', uid, vtodo('Milch kaufen', 'COMPLETED'), 10)
+
+    def test_shoppinglist(self):
+        uid = uuid4()
+        self.put('shoppinglist', uid, vtodo('2 x Milch'), 18)
+        self.put('shoppinglist', uid, vtodo('3 x Milch', 'COMPLETED'), 14)
+
+    def test_shoppingcart(self):
+        uid = uuid4()
+        self.put('shoppingcart', uid, vtodo('Milch'), 19)
+        self.put('shoppingcart', uid, vtodo('4 x Milch'), 14)
+
+    def test_inventory(self):
+        # Consuming the stock also puts the missing quantity on the shopping list
+        self.put('inventory', self.product.uuid, vtodo('5 x Milch', 'COMPLETED'), 32)
+
+
+class CredentialInvalidationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('caldav', password='secret')
+
+    def test_login_keeps_credentials(self):
+        with mock.patch('caldav.models.broadcast_invalidation') as broadcast:
+            update_last_login(None, User.objects.get(pk=self.user.pk))
+            user = User.objects.get(pk=self.user.pk)
+            user.first_name = 'Name'
+            user.save()
+        broadcast.assert_not_called()
+
+    def test_password_and_deactivation_invalidate(self):
+        with mock.patch('caldav.models.broadcast_invalidation') as broadcast:
+            user = User.objects.get(pk=self.user.pk)
+            user.set_password('changed')
+            user.save()
+            user.is_active = False
+            user.save(update_fields=['is_active'])
+        self.assertEqual(broadcast.call_count, 2)
+
+
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        self.backend = caches['caldav']
+        self.backend.clear()
+        self.response_cache = cache.ResponseCache('caldav')
+
+    def render(self, *chunks: bytes):
+        self.rendered = getattr(self, 'rendered', 0) + 1
+        return iter(chunks)
+
+    def test_waits_for_the_render_of_another_process(self):
+        self.assertTrue(self.backend.add('key:lock', True))
+        # The other process stores its rendering after the first look
+        variants = {'identity': b'<multistatus/>'}
+        with mock.patch('caldav.cache.time.sleep', side_effect=lambda _: self.backend.set('key', variants)):
+            result = self.response_cache.get_or_render('key', lambda: self.render(b'<multistatus/>'))
+
+        self.assertEqual(result, (variants, 'COALESCED'))
+        self.assertFalse(hasattr(self, 'rendered'))
+
+    def test_lock_is_released_after_a_failed_render(self):
+        def fail():
+            raise RuntimeError()
+
+        with self.assertRaises(RuntimeError):
+            self.response_cache.get_or_render('key', fail)
+        self.assertIsNone(self.backend.get('key:lock'))
+
+    @override_settings(CALDAV_RESPONSE_CACHE_MAX_SIZE=8)
+    def test_large_responses_are_streamed(self):
+        for _ in range(2):
+            chunks, status = self.response_cache.get_or_render('key', lambda: self.render(b'<multi', b'status/>'))
+            self.assertEqual((b''.join(chunks), status), (b'<multistatus/>', 'STREAMED'))
+        self.assertEqual(self.rendered, 2)
+        self.assertEqual(self.backend.get('key'), cache.TOO_LARGE)
+
+        variants, status = self.response_cache.get_or_render('small', lambda: self.render(b'<small/>'))
+        self.assertEqual((variants['identity'], status), (b'<small/>', 'MISS'))
+        self.assertEqual(self.response_cache.get_or_render('small', self.render)[1], 'HIT')
+
+
+@override_settings(CALDAV_COMPRESSION_MIN_SIZE=0)
+class CompressionTest(CalDAVTestCase):
+    def propfind(self, **headers):
+        return self.client.generic('PROPFIND', '/caldav/tasks/', '', content_type='application/xml', HTTP_DEPTH='1',
+                                   **headers)
+
+    def test_encoded_responses_have_a_weak_etag(self):
+        Task.objects.create(name='Milch holen')
+        etag = CalDAVTasklist.objects.create(code='tasks', etag=uuid4().hex).etag
+
+        # Rendered and compressed by the response cache, then served from it
+        for cache_status in ['MISS', 'HIT']:
+            response = self.propfind(HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual((response['X-Cache'], response['Content-Encoding']), (cache_status, 'gzip'))
+            self.assertEqual(response['ETag'], f'W/{etag}')
+        self.assertEqual(self.propfind()['ETag'], etag)
+        self.assertEqual(self.propfind(HTTP_IF_NONE_MATCH=f'W/{etag}').status_code, 304)
+
+        # Compressed by the middleware
+        with override_settings(CALDAV_RESPONSE_CACHE=False):
+            response = self.propfind(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual((response['Content-Encoding'], response['ETag']), ('gzip', f'W/{etag}'))
+
+
+def push_register(push_resource: str, expires: datetime | None = None) -> str:
+    expires_element = f'<P:expires>{http_date(expires.timestamp())}</P:expires>' if expires else ''
+    return (
+        '<P:push-register xmlns:P="https://bitfire.at/webdav-push">'
+        f'<P:subscription><P:web-push-subscription><P:push-resource>{push_resource}</P:push-resource>'
+        f'</P:web-push-subscription></P:subscription>{expires_element}'
+        '</P:push-register>'
+    )
+
+
+def resolve(host: str, port: int, **kwargs) -> list[tuple]:
+    addresses = {'push.example': '93.184.216.34', 'intranet.example': '10.0.0.1', 'localhost': '127.0.0.1'}
+    if host not in addresses:
+        raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+    return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (addresses[host], port))]
+
+
+@mock.patch('caldav.push.socket.getaddrinfo', resolve)
+class PushRegisterTest(CalDAVTestCase):
+    def register(self, push_resource: str, expires: datetime | None = None):
+        return self.client.post('/caldav/tasks/', push_register(push_resource, expires), content_type='application/xml')
+
+    def test_register_and_renew(self):
+        response = self.register('https://push.example/a', timezone.now() + timedelta(days=1))
+        self.assertEqual(response.status_code, 201)
+        subscription = CalDAVPushSubscription.objects.get()
+        self.assertEqual(response['Location'], f'/caldav/subscriptions/{subscription.uuid}/')
+        self.assertEqual(parse_http_date(response['Expires']), int(subscription.expires_at.timestamp()))
+
+        expires = timezone.now() + timedelta(days=2)
+        response = self.register('https://push.example/a', expires)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response['Location'], f'/caldav/subscriptions/{subscription.uuid}/')
+        subscription.refresh_from_db()
+        self.assertEqual(int(subscription.expires_at.timestamp()), int(expires.timestamp()))
+        self.assertEqual(CalDAVPushSubscription.objects.count(), 1)
+
+    def test_expiry_is_capped(self):
+        for expires in [timezone.now() + timedelta(days=365), None]:
+            with self.subTest(expires=expires):
+                self.assertIn(self.register('https://push.example/a', expires).status_code, [201, 204])
+                latest_expiry = timezone.now() + settings.CALDAV_PUSH_MAX_EXPIRY
+                self.assertAlmostEqual(CalDAVPushSubscription.objects.get().expires_at, latest_expiry,
+                                       delta=timedelta(seconds=5))
+
+    def test_invalid_push_resource(self):
+        for push_resource in ['', 'ftp://push.example/a', 'https:///a', 'https://unknown.example/a',
+                              'https://push.example:port/a']:
+            with self.subTest(push_resource=push_resource):
+                self.assertEqual(self.register(push_resource).status_code, 400)
+        self.assertFalse(CalDAVPushSubscription.objects.exists())
+
+    def test_internal_push_resource(self):
+        for push_resource in ['http://localhost:8000/admin/', 'http://intranet.example/', 'http://127.0.0.1/',
+                              'http://169.254.169.254/latest/meta-data/', 'http://[::1]/']:
+            with self.subTest(push_resource=push_resource):
+                self.assertEqual(self.register(push_resource).status_code, 400)
+        self.assertFalse(CalDAVPushSubscription.objects.exists())
+
+    @override_settings(CALDAV_PUSH_ALLOWED_HOSTS=['.example.org'])
+    def test_allowed_hosts(self):
+        self.assertEqual(self.register('https://push.example/a').status_code, 400)
+        self.assertFalse(push.is_allowed_push_resource('https://push.example/a'))
+
+    def test_delivery_to_internal_address(self):
+        with mock.patch('caldav.push.urlopen') as urlopen, self.assertRaises(URLError):
+            push.send_push_message('http://intranet.example/', b'')
+        urlopen.assert_not_called()
+
+
+class PushDeliveryTest(TestCase):
+    def test_changes_are_pushed_once_settled(self):
+        user = User.objects.create_user('caldav')
+        for push_resource in ['https://push.example/a', 'https://push.example/b']:
+            CalDAVPushSubscription.objects.create(user=user, tasklist='tasks', push_resource=push_resource,
+                                                  expires_at=timezone.now() + timedelta(days=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            Task.objects.create(name='Milch holen')
+            Task.objects.create(name='Brot backen')
+
+        with mock.patch('caldav.push.send_push_message') as send:
+            self.assertEqual(push.deliver_notifications(), (0, 0, 0))
+            later = timezone.now() + timedelta(minutes=1)
+            with mock.patch('django.utils.timezone.now', return_value=later):
+                self.assertEqual(push.deliver_notifications(), (2, 0, 0))
+                self.assertEqual(push.deliver_notifications(), (0, 0, 0))
+        self.assertEqual(sorted(call.args[0] for call in send.call_args_list),
+                         ['https://push.example/a', 'https://push.example/b'])
+
+
+class SyncTokenTest(TestCase):
+    def test_latest_change_per_resource_is_kept(self):
+        changed, created = uuid4(), uuid4()
+        with self.captureOnCommitCallbacks(execute=True):
+            record_changes('tasks', [changed])
+            bump_tasklists(['tasks'])
+        token = sync.get_current_token('tasks')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            record_changes('tasks', [changed.hex, created, created], deleted=True)
+            bump_tasklists(['tasks'])
+
+        self.assertEqual(CalDAVChange.objects.filter(tasklist='tasks').count(), 2)
+        self.assertEqual(sync.get_changes('tasks', token)[1], {str(changed): True, str(created): True})
+
+    def test_unbumped_change_is_not_below_current_token(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            task = Task.objects.create(name='Milch holen')
+        token = sync.get_current_token('tasks')
+        self.assertEqual(sync.get_changes('tasks', 0), (token, {str(task.uuid): False}))
+
+        # Committed by another transaction whose bump has not run yet
+        late = CalDAVChange.objects.create(tasklist='tasks', uuid=uuid4())
+        self.assertEqual(sync.get_current_token('tasks'), token)
+        self.assertEqual(sync.get_changes('tasks', token), (token, {}))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_tasklists(['tasks'])
+        current, changes = sync.get_changes('tasks', token)
+        self.assertEqual(changes, {str(late.uuid): False})
+        self.assertEqual(current, sync.get_current_token('tasks'))
+        self.assertGreater(current, token)
+
+
+class CollectionVersionTest(TestCase):
+    def version(self, code: str) -> tuple[str, int]:
+        tasklist = CalDAVTasklist.objects.get(code=code)
+        return tasklist.etag, tasklist.sync_counter
+
+    def test_bumped_only_on_rendered_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            task = Task.objects.create(name='Milch holen')
+            item = Item.objects.create(product=Product.objects.create(name='Milch'), quantity=2)
+        versions = {code: self.version(code) for code in ['tasks', 'shoppinglist']}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            task.save()
+            item.save()
+        self.assertEqual({code: self.version(code) for code in versions}, versions)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            task.name = 'Milch kaufen'
+            task.save()
+            item.quantity = 3
+            item.save()
+        for code, (etag, sync_counter) in versions.items():
+            with self.subTest(code=code):
+                self.assertNotEqual(self.version(code)[0], etag)
+                self.assertGreater(self.version(code)[1], sync_counter)
+
+
+class ETagTest(TestCase):
+    def versions(self, calendar_id: str, uuid) -> tuple[str, int]:
+        return helper.get_todo(calendar_id, str(uuid))[0], sync.get_current_token(calendar_id)
+
+    def test_saves_without_changes_keep_etag_and_sync_token(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            task = Task.objects.create(name='Milch holen')
+            item = Item.objects.create(product=Product.objects.create(name='Milch'), quantity=2)
+        task_version = self.versions('tasks', task.uuid)
+        item_version = self.versions('shoppinglist', item.uuid)
+
+        later = timezone.now() + timedelta(minutes=1)
+        with self.captureOnCommitCallbacks(execute=True), mock.patch('django.utils.timezone.now', return_value=later):
+            Task.objects.get(pk=task.pk).save()
+            Item.objects.get(pk=item.pk).save()
+        self.assertEqual(self.versions('tasks', task.uuid), task_version)
+        self.assertEqual(self.versions('shoppinglist', item.uuid), item_version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            task.name = 'Milch kaufen'
+            task.save()
+        etag, token = self.versions('tasks', task.uuid)
+        self.assertNotEqual(etag, task_version[0])
+        self.assertGreater(token, task_version[1])
+
+
+class VTodoSerializerParityTest(TestCase):
+    """The direct serializer has to produce the bytes of the icalendar based one."""
+    ESCAPED = 'Back\\slash; semi, comma\nnew line\r\ncrlf'
+    MULTIBYTE = ['Ä' * 40, 'ß€' * 30, '😀' * 25, 'Grüße 😀 ' * 12]
+
+    def assertTaskParity(self, task: Task):
+        task = Task.objects.prefetch_related('tags').get(pk=task.pk)
+        self.assertEqual(helper.get_task_ical(task), helper.get_task(task).to_ical().decode('utf-8'))
+
+    def assertItemParity(self, item: Item):
+        item = Item.objects.select_related('product').prefetch_related('tags').get(pk=item.pk)
+        for is_cart in [False, True]:
+            self.assertEqual(helper.get_shoppingitem_ical(item, is_cart),
+                             helper.get_shoppingitem(item, is_cart).to_ical().decode('utf-8'))
+
+    def test_task_escaping(self):
+        self.assertTaskParity(Task.objects.create(name=self.ESCAPED))
+
+    def test_task_folding(self):
+        # Prefixes shift the text so multibyte characters land on both sides of the 75 octet limit
+        for text in self.MULTIBYTE:
+            for prefix in range(4):
+                with self.subTest(text=text, prefix=prefix):
+                    self.assertTaskParity(Task.objects.create(name='x' * prefix + text))
+
+    def test_task_due_completed_and_alarm(self):
+        moment = datetime(2024, 3, 4, 5, 6, 7, tzinfo=dt_timezone.utc)
+        self.assertTaskParity(Task.objects.create(name='Due', deadline=moment))
+        self.assertTaskParity(Task.objects.create(name='Completed', done=moment))
+        self.assertTaskParity(Task.objects.create(name='Both', deadline=moment, done=moment))
+
+    def test_task_tags_in_description(self):
+        task = Task.objects.create(name='Tagged')
+        task.tags.set([Tag.objects.create(name='Küche; oben'), Tag.objects.create(name='Bad, unten')])
+        self.assertTaskParity(task)
+
+    def test_shoppingitem(self):
+        product = Product.objects.create(name=self.ESCAPED)
+        self.assertItemParity(Item.objects.create(product=product, quantity=3))
+        self.assertItemParity(Item.objects.create(product=product, in_cart=True))
+        for text in self.MULTIBYTE:
+            with self.subTest(text=text):
+                self.assertItemParity(Item.objects.create(product=product, name=text))
+
+        item = Item.objects.create(product=product, name='Tagged')
+        item.tags.set([Tag.objects.create(name='Markt')])
+        self.assertItemParity(item)
+
+    def test_inventory_item(self):
+        location = Location.objects.create(name='Keller')
+        for index, text in enumerate([self.ESCAPED, *self.MULTIBYTE]):
+            product = Product.objects.create(name=text)
+            ProductStock.objects.create(product=product, location=location, stock=index)
+            if index % 2:
+                MinimumProductStock.objects.create(product=product, location=location, minimum_stock=5)
+
+            item = ProductWithStock.default_manager.get(pk=product.pk)
+            # Inventory items are stamped with the current time
+            now = datetime(2024, 3, 4, 5, 6, 7, tzinfo=dt_timezone.utc)
+            with self.subTest(text=text), mock.patch('django.utils.timezone.now', return_value=now):
+                self.assertEqual(helper.get_inventory_item_ical(item),
+                                 helper.get_inventory_item(item).to_ical().decode('utf-8'))
+
+
+def calendar(*lines: str) -> str:
+    return '\r\n'.join(['BEGIN:VCALENDAR', 'VERSION:2.0', *lines, 'END:VCALENDAR', ''])
+
+
+class VTodoParserTest(TestCase):
+    def parse(self, body: str) -> ical.ParsedTodo:
+        request = RequestFactory().put('/caldav/tasks/x.ics', body.encode('utf-8'), content_type='text/calendar')
+        return helper.calendar_from_request(request)
+
+    def test_unfolding_and_escapes(self):
+        todo = self.parse(calendar(
+            'BEGIN:VTODO', 'SUMMARY:Milch\\, Brot\\; K', ' äse\\nund Ei', 'STATUS:COMPLETED', 'END:VTODO',
+        ))
+        self.assertEqual(todo, ical.ParsedTodo('COMPLETED', 'Milch, Brot; Käse\nund Ei', None))
+
+    def test_only_the_first_vtodo_is_read(self):
+        todo = self.parse(calendar(
+            'BEGIN:VTODO', 'SUMMARY:Erste', 'BEGIN:VALARM', 'SUMMARY:Alarm', 'END:VALARM', 'END:VTODO',
+            'BEGIN:VTODO', 'SUMMARY:Zweite', 'END:VTODO',
+        ))
+        self.assertEqual(todo.summary, 'Erste')
+
+    def test_due(self):
+        forms = {
+            'DUE:20240304T050607Z': datetime(2024, 3, 4, 5, 6, 7, tzinfo=dt_timezone.utc),
+            'DUE;VALUE=DATE:20240304': date(2024, 3, 4),
+            'DUE;TZID=Europe/Berlin:20240304T050607': datetime(2024, 3, 4, 5, 6, 7, tzinfo=ZoneInfo('Europe/Berlin')),
+        }
+        for line, due in forms.items():
+            with self.subTest(line=line):
+                todo = self.parse(calendar('BEGIN:VTODO', 'SUMMARY:Milch', line, 'END:VTODO'))
+                self.assertEqual((todo.due, getattr(todo.due, 'tzinfo', None)), (due, getattr(due, 'tzinfo', None)))
+
+    def test_icalendar_reads_what_the_fast_path_rejects(self):
+        body = calendar(
+            'BEGIN:VTIMEZONE', 'TZID:Eigene Zone', 'BEGIN:STANDARD', 'DTSTART:19700101T000000', 'TZOFFSETFROM:+0200',
+            'TZOFFSETTO:+0200', 'END:STANDARD', 'END:VTIMEZONE',
+            'BEGIN:VTODO', 'SUMMARY:Milch', 'DUE;TZID=Eigene Zone:20240304T050607', 'END:VTODO',
+        )
+        with self.assertRaises(ical.UnsupportedValue):
+            ical.parse_vtodo(body)
+
+        todo = self.parse(body)
+        self.assertEqual(todo.summary, 'Milch')
+        self.assertEqual(todo.due, datetime(2024, 3, 4, 3, 6, 7, tzinfo=dt_timezone.utc))
+
+    def test_missing_vtodo(self):
+        with self.assertRaises(ical.ParseError):
+            self.parse(calendar('BEGIN:VEVENT', 'SUMMARY:Milch', 'END:VEVENT'))
+
+
+@override_settings(CALDAV_MAX_BODY_SIZE=200)
+class BodySizeTest(CalDAVTestCase):
+    url = '/caldav/tasks/b1b2c3d4-0000-4000-8000-000000000000.ics'
+
+    def test_declared_length_over_the_limit(self):
+        response = self.client.put(self.url, vtodo('Milch' * 50), content_type='text/calendar')
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(Task.objects.exists())
+
+    def test_malformed_declared_length(self):
+        for content_length in ['abc', '-1', '1e3']:
+            with self.subTest(content_length=content_length):
+                response = self.client.put(self.url, vtodo('Milch'), content_type='text/calendar',
+                                           CONTENT_LENGTH=content_length)
+                self.assertEqual(response.status_code, 400)
+
+    def test_body_without_declared_length_is_read_up_to_the_limit(self):
+        request = AsyncRequestFactory().put(self.url, vtodo('Milch' * 50), content_type='text/calendar')
+        del request.META['CONTENT_LENGTH']
+        with self.assertRaises(helper.BodyTooLarge):
+            helper.calendar_from_request(request)
+        self.assertEqual(request.read(), vtodo('Milch' * 50).encode('utf-8')[201:])
+
+    def test_body_within_the_limit(self):
+        self.assertEqual(self.client.put(self.url, vtodo('Milch'), content_type='text/calendar').status_code, 204)
@@ -1,16 +1,25 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
 
-urlpatterns = [
-    path('caldav/principal/', views.principal_handler, name='caldav_principal'),
-    path('caldav/principal', views.principal_handler),
-    path('caldav/home/', views.home_handler, name='caldav_home'),
-    path('caldav/home', views.home_handler),
-    path('caldav/<str:calendar_id>/', views.tasklist_handler, name='caldav_propfind'),
-    path('caldav/<str:calendar_id>', views.tasklist_handler),
-    path('caldav/<str:calendar_id>/<str:event_uid>/', views.task_handler, name='caldav_get_event'),
-    path('caldav/<str:calendar_id>/<str:event_uid>', views.task_handler),
-    path('.well-known/caldav/', views.well_known_caldav_redirect),
-    path('.well-known/caldav', views.well_known_caldav_redirect, name='well_known_caldav'),
 
-]
+def caldav_urlpatterns(handlers) -> list:
+    return [
+        path('caldav/principal/', handlers.principal_handler, name='caldav_principal'),
+        path('caldav/principal', handlers.principal_handler),
+        path('caldav/home/', handlers.home_handler, name='caldav_home'),
+        path('caldav/home', handlers.home_handler),
+        path('caldav/<str:calendar_id>/', handlers.tasklist_handler, name='caldav_propfind'),
+        path('caldav/<str:calendar_id>', handlers.tasklist_handler),
+        path('caldav/subscriptions/<uuid:subscription_id>/', handlers.subscription_handler,
+             name='caldav_push_subscription'),
+        path('caldav/subscriptions/<uuid:subscription_id>', handlers.subscription_handler),
+        path('caldav/<str:calendar_id>/<str:event_uid>/', handlers.task_handler, name='caldav_get_event'),
+        path('caldav/<str:calendar_id>/<str:event_uid>', handlers.task_handler),
+        path('.well-known/caldav/', handlers.well_known_caldav_redirect),
+        path('.well-known/caldav', handlers.well_known_caldav_redirect, name='well_known_caldav'),
+
+    ]
+
+
+urlpatterns = caldav_urlpatterns(async_views if settings.CALDAV_ASYNC_VIEWS else views)
@@ -1,14 +1,19 @@
 import hashlib
-
-from django.http import HttpResponse, HttpResponseRedirect, HttpResponseNotAllowed
+from functools import partial
+from typing import Callable, Iterator, NamedTuple
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import HttpResponse, HttpResponseRedirect, HttpResponseNotAllowed, HttpResponseBadRequest, \
+    StreamingHttpResponse
+from django.utils.http import http_date
 from django.views.decorators.csrf import csrf_exempt
-from lxml import etree
-from caldav import helper
+from caldav import cache, helper, ical, props, push, report, sync
 
-from caldav.models import CalDAVTasklist
+from caldav.models import CalDAVPushSubscription, CalDAVTasklist
 
 # Define namespaces
-nsmap = {'D': 'DAV:', 'C': 'urn:ietf:params:xml:ns:caldav'}
+nsmap = helper.nsmap
 
 
 # Create your views here.
@@ -23,46 +28,32 @@ def principal_handler(request):
     if request.method != 'PROPFIND':
         return HttpResponseNotAllowed(['PROPFIND'])
 
-    # Create the multistatus element
-    multistatus = etree.Element('{DAV:}multistatus', nsmap=nsmap)
+    return HttpResponse(helper.principal_multistatus(), content_type='application/xml')
 
-    # Create a response element for the principal resource
-    response = etree.SubElement(multistatus, '{DAV:}response')
-    href = etree.SubElement(response, '{DAV:}href')
-    href.text = '/caldav/principal/'
 
-    # Create propstat element to hold properties
-    propstat = etree.SubElement(response, '{DAV:}propstat')
-    prop = etree.SubElement(propstat, '{DAV:}prop')
+def get_home_etag(etags: dict[str, str]) -> str:
+    return hashlib.md5(''.join(etags.values()).encode('utf-8')).hexdigest()
 
-    # Add current-user-principal
-    current_user_principal = etree.SubElement(prop, '{DAV:}current-user-principal')
-    principal_href = etree.SubElement(current_user_principal, '{DAV:}href')
-    principal_href.text = '/caldav/principal/'
 
-    # Add calendar-home-set
-    calendar_home_set = etree.SubElement(prop, '{urn:ietf:params:xml:ns:caldav}calendar-home-set')
-    home_href = etree.SubElement(calendar_home_set, '{DAV:}href')
-    home_href.text = '/caldav/home/'  # This should be the URL where calendars are located
+def wants_sync_tokens(request, propfind: props.Propfind) -> bool:
+    return request.headers.get('Depth', 'infinity') != '0' and propfind.wants('{DAV:}sync-token')
 
-    # Add displayname
-    displayname = etree.SubElement(prop, '{DAV:}displayname')
-    displayname.text = 'Cleverlist'
 
-    # Add supported-calendar-component-set
-    supported_calendar_component_set = etree.SubElement(
-        prop, '{urn:ietf:params:xml:ns:caldav}supported-calendar-component-set'
-    )
-    # etree.SubElement(supported_calendar_component_set, '{urn:ietf:params:xml:ns:caldav}comp', name='VEVENT')
-    etree.SubElement(supported_calendar_component_set, '{urn:ietf:params:xml:ns:caldav}comp', name='VTODO')
+def get_topics(tasklists: list[dict]) -> dict[str, str]:
+    # Push topics are only announced while clients can register for them
+    if not settings.CALDAV_PUSH:
+        return {}
+    return {tasklist['code']: str(tasklist['uuid']) for tasklist in tasklists}
 
-    # Set the status for the propstat
-    status = etree.SubElement(propstat, '{DAV:}status')
-    status.text = 'HTTP/1.1 200 OK'
 
-    # Convert the XML tree to a string
-    xml_str = etree.tostring(multistatus, pretty_print=True).decode()
-    return HttpResponse(xml_str, content_type='application/xml')
+def home_multistatus(request, propfind: props.Propfind, etags: dict[str, str], tokens: dict[str, str],
+                     topics: dict[str, str]) -> bytes:
+    elements = [helper.home_response(propfind)]
+    if request.headers.get('Depth', 'infinity') != '0':
+        for code in helper.TASKLISTS.keys():
+            sync_token = partial(tokens.get, code, sync.format_sync_token(0))
+            elements.append(helper.tasklist_response(code, propfind, etags.get(code), sync_token, topics.get(code)))
+    return helper.render_multistatus(helper.serialize(element) for element in elements)
 
 
 @csrf_exempt
@@ -70,58 +61,266 @@ def home_handler(request):
     if request.method != 'PROPFIND':
         return HttpResponseNotAllowed(['PROPFIND'])
 
-    multistatus = etree.Element('{DAV:}multistatus', nsmap=nsmap)
+    try:
+        propfind = props.parse_propfind(request.body)
+    except report.ReportError as e:
+        return HttpResponseBadRequest(str(e))
 
-    etags = {tasklist['code']: tasklist['etag'] for tasklist in CalDAVTasklist.objects.values('code', 'etag').all()}
+    tasklists = list(CalDAVTasklist.objects.values('code', 'etag', 'uuid'))
+    etags = {tasklist['code']: tasklist['etag'] for tasklist in tasklists}
 
-    home_etag = hashlib.md5(''.join(etags.values()).encode('utf-8')).hexdigest()
+    home_etag = get_home_etag(etags)
 
-    if len(etags.values()) > 0 and request.headers.get('If-None-Match') == home_etag:
+    if len(etags.values()) > 0 and helper.etag_matches(request.headers.get('If-None-Match', ''), home_etag):
         return HttpResponse(status=304)
 
-    helper.add_tasklist(multistatus, 'tasks', 'Aufgaben', '#EE81EE', etags.get('tasks'))
-    helper.add_tasklist(multistatus, 'shoppinglist', 'Einkaufsliste 📋', '#FFA600', etags.get('shoppinglist'))
-    helper.add_tasklist(multistatus, 'shoppingcart', 'Einkaufswagen 🛒', '#FFA600', etags.get('shoppingcart'))
-    helper.add_tasklist(multistatus, 'inventory', 'Bestand 🏠', '#FFA600', etags.get('inventory'))
-
-    xml_str = etree.tostring(multistatus, pretty_print=True).decode()
-    response = HttpResponse(xml_str, content_type='application/xml')
+    tokens = sync.get_current_tokens() if wants_sync_tokens(request, propfind) else {}
+    response = HttpResponse(home_multistatus(request, propfind, etags, tokens, get_topics(tasklists)),
+                            content_type='application/xml')
     response['ETag'] = home_etag
     return response
 
 
+class CollectionRequest(NamedTuple):
+    propfind: props.Propfind
+    depth: str
+    condition: Q
+    multiget_hrefs: dict[str, str | None]
+    sync_token: str | None
+    summary_matches: list[report.TextMatch]
+
+
+def parse_collection_request(request, calendar_id: str) -> CollectionRequest | HttpResponse:
+    """Read what a PROPFIND or REPORT on a collection asks for, an error response if the request is invalid."""
+    condition = Q()
+    multiget_hrefs = {}
+    sync_token = None
+    summary_matches = []
+    propfind = props.ALLPROP
+    depth = request.headers.get('Depth', 'infinity')
+    if request.method == 'PROPFIND':
+        try:
+            propfind = props.parse_propfind(request.body)
+        except report.ReportError as e:
+            return HttpResponseBadRequest(str(e))
+
+    if request.method == 'REPORT' and request.body:
+        try:
+            calendar_report = report.parse_report(request.body)
+            propfind = props.get_requested_props(calendar_report)
+            if calendar_report.tag == f'{{{report.CALDAV_NS}}}calendar-multiget':
+                multiget_hrefs = report.get_multiget_hrefs(calendar_report)
+                condition = Q(uuid__in={uuid for uuid in multiget_hrefs.values() if uuid is not None})
+            elif calendar_report.tag == f'{{{report.CALDAV_NS}}}calendar-query':
+                condition = report.compile_calendar_query(calendar_report, calendar_id)
+                summary_matches = report.get_summary_matches(calendar_report)
+            elif calendar_report.tag == f'{{{report.DAV_NS}}}sync-collection':
+                sync.compact_changes_periodically()
+                token = sync.parse_sync_token(report.get_sync_token(calendar_report))
+                if token:
+                    token, changes = sync.get_changes(calendar_id, token)
+                    multiget_hrefs = {f'/caldav/{calendar_id}/{uuid}/': uuid for uuid in changes.keys()}
+                    condition = Q(uuid__in=[uuid for uuid, deleted in changes.items() if not deleted])
+                else:
+                    token = sync.get_current_token(calendar_id)
+                sync_token = sync.format_sync_token(token)
+        except report.ReportError as e:
+            return HttpResponseBadRequest(str(e))
+        except sync.InvalidSyncToken:
+            return helper.error_response('{DAV:}valid-sync-token', status=403)
+
+    return CollectionRequest(propfind, depth, condition, multiget_hrefs, sync_token, summary_matches)
+
+
+def is_whole_collection(collection: CollectionRequest) -> bool:
+    return not collection.condition and not collection.multiget_hrefs and collection.sync_token is None \
+        and not collection.summary_matches
+
+
+def matches_summary(calendar_id: str, task_id, etag: str, render: Callable[[], str],
+                    collection: CollectionRequest) -> bool:
+    # Checked on the rendered VTODO, the database filter is only a superset
+    if not collection.summary_matches:
+        return True
+    summary = ical.parse_vtodo(helper.get_todo_ical(calendar_id, str(task_id), etag, render)).summary or ''
+    return all(text_match.matches(summary) for text_match in collection.summary_matches)
+
+
+def is_not_modified(request, tasklist: CalDAVTasklist | None, collection: CollectionRequest) -> bool:
+    # A filtered report must not be answered with the etag of the whole collection
+    return tasklist is not None and is_whole_collection(collection) \
+        and helper.etag_matches(request.headers.get('If-None-Match', ''), tasklist.etag)
+
+
+def get_collection_cache_key(request, calendar_id: str, tasklist: CalDAVTasklist | None,
+                             collection: CollectionRequest) -> str | None:
+    # Unfiltered requests render the whole collection, its version identifies the response
+    if not settings.CALDAV_RESPONSE_CACHE or tasklist is None or not is_whole_collection(collection):
+        return None
+    request_key = hashlib.md5(
+        repr((request.method, collection.depth, collection.propfind.key())).encode('utf-8')
+    ).hexdigest()
+    return f'caldav:collection:{calendar_id}:{tasklist.etag}:{request_key}'
+
+
+def collection_head(request, calendar_id: str, tasklist: CalDAVTasklist | None, collection: CollectionRequest,
+                    sync_token: Callable[[], str]) -> list[bytes]:
+    """The response for the collection itself, part of a PROPFIND only."""
+    if request.method != 'PROPFIND' or calendar_id not in helper.TASKLISTS:
+        return []
+    tasklist_etag = tasklist.etag if tasklist else None
+    topic = str(tasklist.uuid) if tasklist and settings.CALDAV_PUSH else None
+    return [helper.serialize(
+        helper.tasklist_response(calendar_id, collection.propfind, tasklist_etag, sync_token, topic)
+    )]
+
+
+def collection_tail(collection: CollectionRequest, found: set[str]) -> list[bytes]:
+    fragments = [
+        helper.serialize(helper.not_found_response(href))
+        for href, uuid in collection.multiget_hrefs.items() if uuid not in found
+    ]
+    if collection.sync_token is not None:
+        fragments.append(helper.serialize(helper.sync_token_element(collection.sync_token)))
+    return fragments
+
+
+def collection_fragments(request, calendar_id: str, tasklist: CalDAVTasklist | None,
+                         collection: CollectionRequest) -> Iterator[bytes]:
+    head = collection_head(request, calendar_id, tasklist, collection,
+                           lambda: sync.format_sync_token(sync.get_current_token(calendar_id)))
+    yield from head
+    if head and collection.depth == '0':
+        return
+
+    found = set()
+    for task_id, etag, render in helper.get_todos(calendar_id, collection.condition):
+        if not matches_summary(calendar_id, task_id, etag, render, collection):
+            continue
+        found.add(str(task_id))
+        yield helper.todo_fragment(calendar_id, task_id, etag, render, collection.propfind)
+
+    yield from collection_tail(collection, found)
+
+
+def cached_collection_response(request, cache_key: str, render: Callable[[], Iterator[bytes]]) -> HttpResponse:
+    variants, status = cache.response_cache.get_or_render(cache_key, render)
+    if status == 'STREAMED':
+        response = StreamingHttpResponse(variants, content_type='application/xml')
+    else:
+        response = helper.encoded_response(request, variants, 'application/xml')
+    response['X-Cache'] = status
+    return response
+
+
+def push_register(request, calendar_id: str) -> HttpResponse:
+    """Register the WebDAV-Push subscription a client POSTs to a collection."""
+    if calendar_id not in helper.TASKLISTS:
+        return HttpResponse(status=404)
+
+    try:
+        registration = push.parse_push_register(request.body)
+    except report.ReportError as e:
+        return HttpResponseBadRequest(str(e))
+
+    subscription, created = push.register_subscription(request.user, calendar_id, registration)
+    response = HttpResponse(status=201 if created else 204)
+    response['Location'] = f'/caldav/subscriptions/{subscription.uuid}/'
+    response['Expires'] = http_date(subscription.expires_at.timestamp())
+    return response
+
+
+def allowed_collection_methods() -> list[str]:
+    return ['PROPFIND', 'REPORT', 'POST'] if settings.CALDAV_PUSH else ['PROPFIND', 'REPORT']
+
+
 @csrf_exempt
 def tasklist_handler(request, calendar_id):
-    if request.method not in ['PROPFIND', 'REPORT']:
-        return HttpResponseNotAllowed(['PROPFIND', 'REPORT'])
+    if request.method not in allowed_collection_methods():
+        return HttpResponseNotAllowed(allowed_collection_methods())
 
-    tasklist = CalDAVTasklist.objects.filter(code=calendar_id).first()
+    if request.method == 'POST':
+        return push_register(request, calendar_id)
 
-    if tasklist and request.headers.get('If-None-Match') == tasklist.etag:
+    collection = parse_collection_request(request, calendar_id)
+    if isinstance(collection, HttpResponse):
+        return collection
+
+    tasklist = CalDAVTasklist.objects.filter(code=calendar_id).first()
+    if is_not_modified(request, tasklist, collection):
         return HttpResponse(status=304)
 
-    multistatus = etree.Element('{DAV:}multistatus', nsmap=nsmap)
-    if calendar_id == 'tasks':
-        for task_id, task in helper.get_tasks():
-            helper.add_todo(multistatus, calendar_id, task_id, task)
+    fragments = partial(collection_fragments, request, calendar_id, tasklist, collection)
+    cache_key = get_collection_cache_key(request, calendar_id, tasklist, collection)
+    if cache_key is not None:
+        response = cached_collection_response(request, cache_key, lambda: helper.stream_multistatus(fragments()))
+    elif settings.CALDAV_STREAMING:
+        response = StreamingHttpResponse(helper.stream_multistatus(fragments()), content_type='application/xml')
+    else:
+        response = HttpResponse(helper.render_multistatus(fragments()), content_type='application/xml')
 
-    if calendar_id == 'shoppinglist':
-        for task_id, task in helper.get_shoppingitems():
-            helper.add_todo(multistatus, calendar_id, task_id, task)
+    if tasklist is not None:
+        response['ETag'] = tasklist.etag
+    return response
 
-    if calendar_id == 'shoppingcart':
-        for task_id, task in helper.get_shoppingcart():
-            helper.add_todo(multistatus, calendar_id, task_id, task)
 
-    if calendar_id == 'inventory':
-        for task_id, task in helper.get_inventory():
-            helper.add_todo(multistatus, calendar_id, task_id, task)
+@csrf_exempt
+def subscription_handler(request, subscription_id):
+    if request.method != 'DELETE':
+        return HttpResponseNotAllowed(['DELETE'])
 
-    xml_str = etree.tostring(multistatus, pretty_print=True).decode()
-    response = HttpResponse(xml_str, content_type='application/xml')
+    deleted, _ = CalDAVPushSubscription.objects.filter(uuid=subscription_id, user=request.user).delete()
+    return HttpResponse(status=204 if deleted else 404)
 
-    if tasklist is not None:
-        response['ETag'] = tasklist.etag
+
+def content_length_error(request) -> HttpResponse | None:
+    # The declared length is checked first so oversized uploads are never read
+    if request.method != 'PUT':
+        return None
+    content_length = request.META.get('CONTENT_LENGTH') or '0'
+    if not (content_length.isascii() and content_length.isdigit()):
+        return HttpResponseBadRequest('Invalid Content-Length')
+    if int(content_length) > settings.CALDAV_MAX_BODY_SIZE:
+        return HttpResponse(status=413)
+    return None
+
+
+def has_preconditions(request) -> bool:
+    return request.method in ['DELETE', 'PUT'] and (
+        request.headers.get('If-Match') is not None or request.headers.get('If-None-Match') is not None
+    )
+
+
+def failed_precondition(request, todo: tuple[str, Callable[[], str]] | None) -> HttpResponse | None:
+    if_match = request.headers.get('If-Match')
+    if_none_match = request.headers.get('If-None-Match')
+    etag = todo[0] if todo is not None else None
+    if if_match is not None and not helper.etag_matches(if_match, etag):
+        return HttpResponse(status=412)
+    if if_none_match is not None and helper.etag_matches(if_none_match, etag):
+        return HttpResponse(status=412)
+    return None
+
+
+def changed_response(todo: tuple[str, Callable[[], str]] | None) -> HttpResponse:
+    response = HttpResponse(status=204)
+    if todo is not None:
+        response['ETag'] = todo[0]
+    return response
+
+
+def todo_response(request, calendar_id: str, event_uid: str,
+                  todo: tuple[str, Callable[[], str]] | None) -> HttpResponse:
+    if todo is None:
+        return HttpResponse(status=404)
+
+    etag, render = todo
+    if helper.etag_matches(request.headers.get('If-None-Match', ''), etag):
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(helper.get_todo_ical(calendar_id, event_uid, etag, render),
+                                content_type='text/calendar')
+    response['ETag'] = etag
     return response
 
 
@@ -130,47 +329,30 @@ def task_handler(request, calendar_id: str, event_uid: str):
     if event_uid.endswith('.ics'):
         event_uid = event_uid[:-4]
 
-    if request.method in ['DELETE', 'PUT']:
-        helper.on_change_tasklist(calendar_id)
+    error = content_length_error(request)
+    if error is not None:
+        return error
+
+    if has_preconditions(request):
+        failed = failed_precondition(request, helper.get_todo(calendar_id, event_uid))
+        if failed is not None:
+            return failed
 
     if request.method == 'DELETE':
-        if calendar_id == 'tasks':
-            helper.delete_task(event_uid)
-        if calendar_id == 'shoppinglist':
-            helper.delete_shoppingitem(event_uid)
-        if calendar_id == 'shoppingcart':
-            helper.delete_shoppingitem(event_uid)
+        helper.delete_todo(calendar_id, event_uid)
         return HttpResponse(status=204)
 
     if request.method == 'PUT':
-        if calendar_id == 'tasks':
-            helper.change_task(event_uid, helper.calendar_from_request(request))
-        if calendar_id == 'shoppinglist':
-            helper.change_shoppingitem(event_uid, helper.calendar_from_request(request))
-        if calendar_id == 'shoppingcart':
-            helper.change_shoppingcart(event_uid, helper.calendar_from_request(request))
-        if calendar_id == 'inventory':
-            helper.change_inventory(event_uid, helper.calendar_from_request(request))
+        try:
+            todo = helper.calendar_from_request(request)
+        except helper.BodyTooLarge:
+            return HttpResponse(status=413)
+        except (ical.ParseError, UnicodeDecodeError) as e:
+            return HttpResponseBadRequest(str(e))
 
-        return HttpResponse(status=204)
+        return changed_response(helper.change_todo(calendar_id, event_uid, todo))
 
     if request.method != 'GET':
         return HttpResponseNotAllowed(['GET'])
 
-    calendar = None
-    if calendar_id == 'tasks':
-        calendar = helper.get_task(event_uid)
-
-    if calendar_id == 'shoppinglist':
-        calendar = helper.get_shoppingitem(event_uid, False)
-
-    if calendar_id == 'shoppingcart':
-        calendar = helper.get_shoppingitem(event_uid, True)
-
-    if calendar_id == 'inventory':
-        calendar = helper.get_inventory_item(event_uid)
-
-    if calendar is not None:
-        return HttpResponse(calendar.to_ical().decode('utf-8'), content_type='text/calendar')
-
-    return HttpResponse(status=404)
+    return todo_response(request, calendar_id, event_uid, helper.get_todo(calendar_id, event_uid))
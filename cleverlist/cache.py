@@ -0,0 +1,68 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache:
+    """Bounded in-process cache, least recently used entries are evicted first.
+
+    Entries are grouped by a tag (for example a resource uuid) so all entries of one object can be dropped at once.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.tags = {}
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            try:
+                tag, value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, tag=None):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (tag, value)
+            self.entries.move_to_end(key)
+            if tag is not None:
+                self.tags.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.maxsize:
+                evicted_key, (evicted_tag, _) = self.entries.popitem(last=False)
+                self.untag(evicted_tag, evicted_key)
+                self.evictions += 1
+
+    def untag(self, tag, key):
+        keys = self.tags.get(tag)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.tags[tag]
+
+    def invalidate(self, tag):
+        with self.lock:
+            for key in self.tags.pop(tag, ()):
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tags.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
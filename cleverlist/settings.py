@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 import os
 import django
+from datetime import timedelta
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -49,6 +50,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'caldav.middleware.CompressionMiddleware',
+    'master.middleware.CacheInvalidationMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,6 +86,7 @@ TEMPLATES = [
 FORM_RENDERER = 'django.forms.renderers.TemplatesSetting'
 
 WSGI_APPLICATION = 'cleverlist.wsgi.application'
+ASGI_APPLICATION = 'cleverlist.asgi.application'
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
@@ -115,6 +119,25 @@ else:
         }
     }
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Rendered CalDAV collections, a shared backend lets all processes reuse one rendering
+    'caldav': {
+        'BACKEND': os.environ.get('DJANGO_CALDAV_RESPONSE_CACHE_BACKEND',
+                                  'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CALDAV_RESPONSE_CACHE_LOCATION', 'caldav-responses'),
+        'TIMEOUT': 3600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100,
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -170,6 +193,82 @@ WEBDAV_CURRENT_USER_PRINCIPAL_BASE = '/principals'
 WEBDAV_ADDRESSBOOK_HOME_SET_BASE = '/addressbook'
 WEBDAV_CALENDAR_HOME_SET_BASE = '/calendars'
 
+# Serve /caldav/ with the async views, set by cleverlist.asgi for deployments running under an ASGI server
+CALDAV_ASYNC_VIEWS = os.environ.get('DJANGO_CALDAV_ASYNC_VIEWS', 'False') == 'True'
+
+# Changes older than this are compacted, clients holding an older sync-token have to do a full sync
+CALDAV_SYNC_RETENTION = timedelta(days=int(os.environ.get('DJANGO_CALDAV_SYNC_RETENTION_DAYS', 30)))
+CALDAV_SYNC_COMPACTION_INTERVAL = timedelta(hours=1)
+
+# Collection responses are written incrementally instead of being built in memory
+CALDAV_STREAMING = os.environ.get('DJANGO_CALDAV_STREAMING', 'True') == 'True'
+CALDAV_STREAMING_CHUNK_SIZE = 64 * 1024
+CALDAV_QUERY_CHUNK_SIZE = 500
+
+# Number of rendered VTODO responses kept per worker
+CALDAV_FRAGMENT_CACHE_SIZE = int(os.environ.get('DJANGO_CALDAV_FRAGMENT_CACHE_SIZE', 20000))
+
+# Larger VTODO uploads are rejected before they are parsed
+CALDAV_MAX_BODY_SIZE = int(os.environ.get('DJANGO_CALDAV_MAX_BODY_SIZE', 64 * 1024))
+
+# CalDAV clients rarely return cookies, authenticate every request without creating a session
+CALDAV_SESSIONLESS_AUTH = os.environ.get('DJANGO_CALDAV_SESSIONLESS_AUTH', 'True') == 'True'
+CALDAV_AUTH_CACHE_TTL = timedelta(seconds=int(os.environ.get('DJANGO_CALDAV_AUTH_CACHE_TTL', 300)))
+CALDAV_AUTH_CACHE_SIZE = 1000
+
+# Responses below /caldav/ are compressed with the best encoding the client accepts, the cached collection responses
+# are stored compressed. zstd and br are offered when the zstandard and brotli packages are installed. The admin is
+# compressed with gzip regardless.
+CALDAV_COMPRESSION = os.environ.get('DJANGO_CALDAV_COMPRESSION', 'True') == 'True'
+CALDAV_COMPRESSION_MIN_SIZE = int(os.environ.get('DJANGO_CALDAV_COMPRESSION_MIN_SIZE', 1024))
+CALDAV_COMPRESSION_LEVELS = {
+    'gzip': int(os.environ.get('DJANGO_CALDAV_GZIP_LEVEL', 6)),
+    'br': int(os.environ.get('DJANGO_CALDAV_BROTLI_LEVEL', 5)),
+    'zstd': int(os.environ.get('DJANGO_CALDAV_ZSTD_LEVEL', 3)),
+}
+
+# Unfiltered collection responses are cached per collection version in the 'caldav' cache. Requests for a response
+# that is being rendered wait up to this many seconds for it instead of rendering it again. Responses larger than
+# CALDAV_RESPONSE_CACHE_MAX_SIZE bytes are streamed instead, memcached stores at most 1 MB per key by default.
+CALDAV_RESPONSE_CACHE = os.environ.get('DJANGO_CALDAV_RESPONSE_CACHE', 'True') == 'True'
+CALDAV_RESPONSE_CACHE_WAIT = 10
+CALDAV_RESPONSE_CACHE_MAX_SIZE = int(os.environ.get('DJANGO_CALDAV_RESPONSE_CACHE_MAX_SIZE', 512 * 1024))
+
+# Clients can register for WebDAV-Push notifications of a collection. A burst of changes is delivered as one message
+# by deliver_caldav_push once the collection had no change for CALDAV_PUSH_DEBOUNCE, or at the latest
+# CALDAV_PUSH_MAX_DELAY after the first change. Run it with --watch as a worker next to the web server.
+CALDAV_PUSH = os.environ.get('DJANGO_CALDAV_PUSH', 'True') == 'True'
+CALDAV_PUSH_DEBOUNCE = timedelta(seconds=int(os.environ.get('DJANGO_CALDAV_PUSH_DEBOUNCE', 5)))
+CALDAV_PUSH_MAX_DELAY = timedelta(seconds=int(os.environ.get('DJANGO_CALDAV_PUSH_MAX_DELAY', 60)))
+CALDAV_PUSH_MAX_EXPIRY = timedelta(days=7)
+CALDAV_PUSH_TIMEOUT = 10
+# Push resources clients may register, '.example.com' also matches the subdomains and '*' any host. Whatever the host,
+# push resources resolving to private, loopback or other non-public addresses are refused.
+CALDAV_PUSH_ALLOWED_HOSTS = os.environ.get('DJANGO_CALDAV_PUSH_ALLOWED_HOSTS', '*').split(',')
+
+# Products under minimum stock offered on the shopping list form, dropped on every stock or item change. Deployments
+# with several processes need a shared CACHES backend for the invalidation to reach all of them.
+SHOPPING_UNDER_STOCK_CACHE_TTL = timedelta(minutes=10)
+
+# Stock movements older than this are folded into snapshots by compact_stock_movements
+INVENTORY_LEDGER_RETENTION = timedelta(days=int(os.environ.get('DJANGO_INVENTORY_LEDGER_RETENTION_DAYS', 90)))
+
+# Consumption rates are averaged over this window. With reorder days set, products whose stock will not last that
+# long are suggested for the shopping list as well, 0 only uses the minimum stock.
+INVENTORY_FORECAST_WINDOW = timedelta(days=int(os.environ.get('DJANGO_INVENTORY_FORECAST_WINDOW_DAYS', 28)))
+INVENTORY_FORECAST_REORDER_DAYS = int(os.environ.get('DJANGO_INVENTORY_FORECAST_REORDER_DAYS', 0))
+
+# In-process caches of one worker are cleared when another worker changes their data. Each process reads the
+# generation counters at most once every CACHE_INVALIDATION_INTERVAL seconds, before a request. Single process
+# deployments can turn this off.
+CACHE_INVALIDATION_BUS = os.environ.get('DJANGO_CACHE_INVALIDATION_BUS', 'True') == 'True'
+CACHE_INVALIDATION_INTERVAL = float(os.environ.get('DJANGO_CACHE_INVALIDATION_INTERVAL', 1))
+
+# Free-text product names from CalDAV clients are matched casefolded and with collapsed whitespace. Run
+# normalize_product_names after changing the accent folding.
+PRODUCT_NAME_FOLD_ACCENTS = os.environ.get('DJANGO_PRODUCT_NAME_FOLD_ACCENTS', 'False') == 'True'
+PRODUCT_RESOLVER_CACHE_SIZE = 10000
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -4,40 +4,18 @@ from django.utils import timezone
 from django.utils.html import format_html
 
 from cleverlist.admin import ListActionModelAdmin
+from inventory.forecast import with_forecast
 from inventory.models import Location, ProductStock, ProductWithStock, MinimumProductStock
+from inventory.services import add_missing_items
 from django.db.models import Count
-from django.utils.translation import gettext_lazy as _
+from django.utils.translation import gettext_lazy as _, ngettext
 
 from master.admin import format_tag, TagFilter
-from shopping.models import Item
 
 
 @admin.action(description=_('Add Shopping Item'))
 def add_shopping_item(modeladmin, request, queryset):
-    existing_item_dict = {}
-
-    for existing_item in Item.objects.values('id', 'product_id', 'list_id', 'quantity').all():
-        if existing_item_dict.get(existing_item['product_id']):
-            existing_item_dict.get(existing_item['product_id'])['total_quantity'] += existing_item['quantity']
-        else:
-            existing_item_dict[existing_item['product_id']] = existing_item
-            existing_item_dict[existing_item['product_id']]['total_quantity'] = existing_item['quantity']
-
-    for product in queryset.all():
-        item = Item(
-            product=product,
-            name=product.name,
-            quantity=product.stock_needed
-        )
-
-        existing_item = existing_item_dict.get(product.pk)
-        if existing_item:
-            item.quantity -= existing_item['total_quantity']
-            item.quantity += existing_item['quantity']
-            item.pk = existing_item['id']
-
-        if item.quantity > 0:
-            item.save()
+    add_missing_items(queryset)
 
 
 class ProductStockInline(admin.StackedInline):
@@ -97,7 +75,7 @@ class LocationAdmin(ListActionModelAdmin):
 @admin.register(ProductWithStock)
 class ProductWithStockAdmin(ListActionModelAdmin):
     pass
-    list_display = ['name', 'stock', 'minimum_stock', 'stock_needed', 'display_locations', 'display_tags']
+    list_display = ['name', 'stock', 'minimum_stock', 'stock_needed', 'runs_out', 'display_locations', 'display_tags']
     inlines = [ProductStockInline, MinimumProductStockInline]
     search_fields = ['name']
     exclude = ['name', 'tags']
@@ -128,6 +106,13 @@ class ProductWithStockAdmin(ListActionModelAdmin):
             return format_html('<span style="color: red">{}</span>', obj.stock_needed)
         return format_html('<span style="color: green">{}</span>', obj.stock_needed)
 
+    @admin.display(description=_('Runs out in'), ordering='days_left')
+    def runs_out(self, obj):
+        if obj.days_left is None:
+            return None
+        days = int(obj.days_left)
+        return ngettext('%(days)d day', '%(days)d days', days) % {'days': days}
+
     @admin.display(description=_('Locations'))
     def display_locations(self, obj):
         location_stock_dict = {}
@@ -159,4 +144,4 @@ class ProductWithStockAdmin(ListActionModelAdmin):
         queryset = super().get_queryset(request)
         queryset = queryset.prefetch_related('productstock_set__location')
         queryset = queryset.prefetch_related('productstock_set__tags')
-        return queryset
+        return with_forecast(queryset)
@@ -0,0 +1,62 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Case, ExpressionWrapper, F, FloatField, IntegerField, OuterRef, Subquery, Sum, Value, \
+    When
+from django.db.models.functions import Cast, Ceil, Coalesce, Greatest
+from django.utils import timezone
+
+from inventory.models import ProductWithStock, StockMovement
+
+
+def consumption_rate(window: timedelta | None = None):
+    """Average units taken from the stock per day over the window, for querysets of products.
+
+    The window should not reach further back than INVENTORY_LEDGER_RETENTION, older movements are compacted.
+    """
+    window = window or settings.INVENTORY_FORECAST_WINDOW
+    consumed = StockMovement.objects.filter(
+        product_id=OuterRef('pk'), kind=StockMovement.Kind.CONSUME, created_at__gt=timezone.now() - window
+    ).values('product_id').annotate(total=Sum(F('quantity') * -1)).values('total')
+
+    return ExpressionWrapper(
+        Cast(Coalesce(Subquery(consumed, output_field=IntegerField()), Value(0)), FloatField())
+        / Value(window / timedelta(days=1)),
+        output_field=FloatField(),
+    )
+
+
+def with_forecast(queryset, window: timedelta | None = None):
+    """Annotate products with stock with `consumption_rate` per day and `days_left` until the stock runs out.
+
+    `days_left` is None for products that were not consumed within the window.
+    """
+    queryset = queryset.annotate(consumption_rate=consumption_rate(window))
+    return queryset.annotate(
+        days_left=Case(
+            When(consumption_rate__gt=0, then=Cast(F('stock'), FloatField()) / F('consumption_rate')),
+            default=None,
+            output_field=FloatField(),
+        )
+    )
+
+
+def forecast_needed(days: int):
+    """Units needed to last the given number of days at the current consumption rate, for forecast querysets."""
+    return Greatest(
+        Cast(Ceil(F('consumption_rate') * days), IntegerField()) - F('stock'),
+        Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def get_forecasts(products=None, window: timedelta | None = None) -> dict[int, tuple[float, float | None]]:
+    """Consumption rate and days left of all products, computed in a single query."""
+    queryset = ProductWithStock.default_manager.all()
+    if products is not None:
+        queryset = queryset.filter(pk__in=products.values('pk'))
+    return {
+        product_id: (rate, days_left)
+        for product_id, rate, days_left in with_forecast(queryset, window).values_list(
+            'pk', 'consumption_rate', 'days_left')
+    }
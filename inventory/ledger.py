@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from inventory.models import StockMovement, StockSnapshot
+
+# Only taking stock for use counts, corrections and transfers lower the stock without anything being consumed
+CONSUMED = Coalesce(Sum(Case(When(kind=StockMovement.Kind.CONSUME, then=-F('quantity')), default=Value(0))), Value(0),
+                    output_field=IntegerField())
+
+
+def get_base(product_id: int, when: datetime) -> tuple[datetime | None, int, int] | None:
+    """Nearest snapshot at or before `when` as (taken_at, stock, consumed), None if that history was compacted."""
+    snapshot = StockSnapshot.objects.filter(product_id=product_id, taken_at__lte=when).order_by('-taken_at').first()
+    if snapshot is not None:
+        return snapshot.taken_at, snapshot.stock, snapshot.consumed
+    if StockSnapshot.objects.filter(product_id=product_id).exists():
+        return None
+    # Not compacted yet, the ledger holds every change of the product
+    return None, 0, 0
+
+
+def get_ledger_tail(product_id: int, since: datetime | None, until: datetime) -> dict[str, int]:
+    movements = StockMovement.objects.filter(product_id=product_id, created_at__lte=until)
+    if since is not None:
+        movements = movements.filter(created_at__gt=since)
+    return movements.aggregate(
+        total=Coalesce(Sum('quantity'), Value(0), output_field=IntegerField()),
+        consumed=CONSUMED,
+    )
+
+
+def get_stock_at(product_id: int, when: datetime) -> int | None:
+    """Total stock of a product at `when`, None before the oldest snapshot."""
+    base = get_base(product_id, when)
+    if base is None:
+        return None
+    taken_at, stock, _ = base
+    return stock + get_ledger_tail(product_id, taken_at, when)['total']
+
+
+def get_consumed_until(product_id: int, when: datetime) -> int | None:
+    base = get_base(product_id, when)
+    if base is None:
+        return None
+    taken_at, _, consumed = base
+    return consumed + get_ledger_tail(product_id, taken_at, when)['consumed']
+
+
+def get_consumption(product_id: int, since: datetime, until: datetime | None = None) -> int | None:
+    """Units taken from the stock of a product between `since` and `until`, None before the oldest snapshot."""
+    until = until or timezone.now()
+    consumed_since = get_consumed_until(product_id, since)
+    consumed_until = get_consumed_until(product_id, until)
+    if consumed_since is None or consumed_until is None:
+        return None
+    return consumed_until - consumed_since
+
+
+def compact_stock_movements(retention: timedelta | None = None) -> tuple[int, int]:
+    """Fold movements older than the retention into one snapshot per product, returns (snapshots, movements)."""
+    cutoff = timezone.now() - (retention if retention is not None else settings.INVENTORY_LEDGER_RETENTION)
+
+    with transaction.atomic():
+        old_movements = StockMovement.objects.filter(created_at__lte=cutoff)
+        totals = {
+            product_id: (quantity, consumed)
+            for product_id, quantity, consumed in old_movements.values('product_id').annotate(
+                total=Sum('quantity'), consumed=CONSUMED).values_list('product_id', 'total', 'consumed')
+        }
+
+        product_ids = list(totals)
+        snapshots = []
+        for start in range(0, len(product_ids), 1000):
+            bases = {}
+            for snapshot in StockSnapshot.objects.filter(
+                    product_id__in=product_ids[start:start + 1000], taken_at__lte=cutoff).order_by('taken_at'):
+                bases[snapshot.product_id] = snapshot
+            for product_id in product_ids[start:start + 1000]:
+                base = bases.get(product_id)
+                quantity, consumed = totals[product_id]
+                snapshots.append(StockSnapshot(
+                    product_id=product_id,
+                    taken_at=cutoff,
+                    stock=(base.stock if base else 0) + quantity,
+                    consumed=(base.consumed if base else 0) + consumed,
+                ))
+        StockSnapshot.objects.bulk_create(snapshots, batch_size=1000)
+        deleted, _ = old_movements.delete()
+
+    return len(snapshots), deleted
@@ -0,0 +1,73 @@
+import random
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from inventory.forecast import get_forecasts
+from inventory.ledger import get_consumption
+from inventory.models import ProductStock, StockMovement, refresh_stock_summaries
+from master.models import Product
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measures the forecast of consumption rates and run-out dates for all products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--movements', type=int, default=100000)
+        parser.add_argument('--rounds', type=int, default=3)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.benchmark(options['products'], options['movements'], options['rounds'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def benchmark(self, product_count: int, movement_count: int, rounds: int):
+        random.seed(0)
+        now = timezone.now()
+        Product.objects.bulk_create([Product(name=f'Benchmark product {i}') for i in range(product_count)],
+                                    batch_size=1000)
+        products = list(Product.objects.filter(name__startswith='Benchmark product').values_list('pk', flat=True))
+        ProductStock.objects.bulk_create([
+            ProductStock(product_id=product_id, stock=random.randint(0, 20)) for product_id in products
+        ], batch_size=1000)
+        for start in range(0, len(products), 1000):
+            refresh_stock_summaries(products[start:start + 1000])
+        StockMovement.objects.bulk_create([
+            StockMovement(product_id=random.choice(products), quantity=quantity,
+                          kind=StockMovement.Kind.CONSUME if quantity < 0 else StockMovement.Kind.PURCHASE,
+                          created_at=now - timedelta(days=random.uniform(0, 60)))
+            for quantity in random.choices([-1, -1, -2, 3], k=movement_count)
+        ], batch_size=1000)
+
+        best = None
+        for _ in range(rounds):
+            start = time.perf_counter()
+            forecasts = get_forecasts()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        self.stdout.write(f' all products: {best * 1000:8.1f} ms for {len(forecasts)} products')
+
+        # Per-product ledger queries for a sample, as a reference for the rates
+        sample = random.sample(products, min(200, len(products)))
+        window = settings.INVENTORY_FORECAST_WINDOW
+        start = time.perf_counter()
+        expected = {product_id: get_consumption(product_id, timezone.now() - window) for product_id in sample}
+        per_product = (time.perf_counter() - start) / len(sample)
+        self.stdout.write(f'  per product: {per_product * 1000:8.2f} ms, '
+                          f'{per_product * len(products) * 1000:.0f} ms extrapolated')
+
+        days = window / timedelta(days=1)
+        mismatches = sum(1 for product_id in sample if round(forecasts[product_id][0] * days) != expected[product_id])
+        self.stdout.write(f'   mismatches: {mismatches}')
@@ -0,0 +1,86 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from inventory.models import Location, MinimumProductStock, ProductStock, refresh_stock_summaries, with_live_stock
+from inventory.services import add_missing_items, find_missing_stock
+from master.models import Product
+from shopping.models import Item
+
+
+class Rollback(Exception):
+    pass
+
+
+def find_missing_stock_per_row() -> dict[int, int]:
+    # The previous implementation: every item loaded into a dict, every product checked in Python
+    existing_quantities = {}
+    for existing_item in Item.objects.values('id', 'product_id', 'list_id', 'quantity').all():
+        existing_quantities[existing_item['product_id']] = \
+            existing_quantities.get(existing_item['product_id'], 0) + existing_item['quantity']
+
+    missing = {}
+    for product in with_live_stock(Product.objects.all()):
+        quantity = product.stock_needed - existing_quantities.get(product.pk, 0)
+        if quantity > 0:
+            missing[product.pk] = quantity
+    return missing
+
+
+class Command(BaseCommand):
+    help = 'Compares the per-row and the set-based computation of products under minimum stock'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--items', type=int, default=50000)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.benchmark(options['products'], options['items'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def benchmark(self, product_count: int, item_count: int):
+        random.seed(0)
+        location = Location.objects.create(name='Benchmark')
+        Product.objects.bulk_create([Product(name=f'Benchmark product {i}') for i in range(product_count)],
+                                    batch_size=1000)
+        products = list(Product.objects.filter(name__startswith='Benchmark product').values_list('pk', flat=True))
+
+        ProductStock.objects.bulk_create([
+            ProductStock(product_id=product_id, location=location, stock=random.randint(0, 5))
+            for product_id in products
+        ], batch_size=1000)
+        MinimumProductStock.objects.bulk_create([
+            MinimumProductStock(product_id=product_id, location=location, minimum_stock=random.randint(0, 8))
+            for product_id in products
+        ], batch_size=1000)
+        Item.objects.bulk_create([
+            Item(product_id=random.choice(products), name='Benchmark item', quantity=random.randint(1, 2),
+                 in_cart=random.random() < 0.1)
+            for _ in range(item_count)
+        ], batch_size=1000)
+        for start in range(0, len(products), 1000):
+            refresh_stock_summaries(products[start:start + 1000])
+
+        start = time.perf_counter()
+        per_row = find_missing_stock_per_row()
+        per_row_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        set_based = dict(find_missing_stock().values_list('pk', 'missing_quantity'))
+        set_based_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        created, updated = add_missing_items()
+        apply_time = time.perf_counter() - start
+
+        self.stdout.write(f'   per-row: {per_row_time * 1000:8.1f} ms')
+        self.stdout.write(f' set-based: {set_based_time * 1000:8.1f} ms')
+        self.stdout.write(f'   speedup: {per_row_time / set_based_time:8.1f}x')
+        self.stdout.write(f'     apply: {apply_time * 1000:8.1f} ms ({created} created, {updated} updated)')
+        self.stdout.write(f'mismatches: {len(set(per_row.items()) ^ set(set_based.items()))}')
@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from inventory.ledger import compact_stock_movements
+
+
+class Command(BaseCommand):
+    help = 'Folds stock movements older than the ledger retention into per-product snapshots'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Retention in days, defaults to INVENTORY_LEDGER_RETENTION')
+
+    def handle(self, *args, **options):
+        retention = timedelta(days=options['days']) if options['days'] is not None else None
+        snapshots, deleted = compact_stock_movements(retention)
+        self.stdout.write(f'Folded {deleted} stock movements into {snapshots} snapshots')
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from inventory.models import ProductStockSummary, refresh_stock_summaries, with_live_stock
+from master.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Compares the stock summaries with the stock rows and optionally repairs them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Recompute the summaries that differ')
+
+    def handle(self, *args, **options):
+        summaries = {
+            summary.product_id: (summary.stock, summary.minimum_stock, summary.stock_needed)
+            for summary in ProductStockSummary.objects.all()
+        }
+
+        mismatched = []
+        live = with_live_stock(Product.objects.all()).values_list('pk', 'name', 'stock', 'minimum_stock', 'stock_needed')
+        for product_id, name, *values in live.iterator(chunk_size=1000):
+            expected = tuple(values)
+            actual = summaries.get(product_id, (0, 0, 0))
+            if actual != expected:
+                mismatched.append(product_id)
+                self.stdout.write(f'{name}: summary {actual}, stock rows {expected}')
+
+        if mismatched and options['fix']:
+            refresh_stock_summaries(mismatched)
+            self.stdout.write(f'Repaired {len(mismatched)} summaries')
+        else:
+            self.stdout.write(f'{len(mismatched)} mismatched summaries')
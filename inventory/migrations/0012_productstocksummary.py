@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0011_remove_productstock_uuid_null'),
+        ('master', '0004_remove_product_uuid_null'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductStockSummary',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock_summary', serialize=False, to='master.product')),
+                ('stock', models.IntegerField(default=0)),
+                ('minimum_stock', models.IntegerField(default=0)),
+                ('stock_needed', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
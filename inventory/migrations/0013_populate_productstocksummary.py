@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:46
+from django.db import migrations
+from django.db.models import Sum
+
+
+def populate_summaries(apps, schema_editor):
+    Product = apps.get_model('master', 'Product')
+    ProductStock = apps.get_model('inventory', 'ProductStock')
+    MinimumProductStock = apps.get_model('inventory', 'MinimumProductStock')
+    ProductStockSummary = apps.get_model('inventory', 'ProductStockSummary')
+
+    stock = dict(ProductStock.objects.values('product_id').annotate(total=Sum('stock'))
+                 .values_list('product_id', 'total'))
+    minimum_stock = dict(MinimumProductStock.objects.values('product_id').annotate(total=Sum('minimum_stock'))
+                         .values_list('product_id', 'total'))
+
+    summaries = []
+    for product_id in Product.objects.values_list('pk', flat=True):
+        product_stock = stock.get(product_id) or 0
+        product_minimum_stock = minimum_stock.get(product_id) or 0
+        summaries.append(ProductStockSummary(
+            product_id=product_id,
+            stock=product_stock,
+            minimum_stock=product_minimum_stock,
+            stock_needed=max(product_minimum_stock - product_stock, 0),
+        ))
+    ProductStockSummary.objects.bulk_create(summaries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('inventory', '0012_productstocksummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_summaries, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0013_populate_productstocksummary'),
+        ('master', '0004_remove_product_uuid_null'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productstock',
+            name='tag_signature',
+            field=models.CharField(blank=True, default='', editable=False, max_length=40),
+        ),
+        migrations.AddIndex(
+            model_name='productstock',
+            index=models.Index(fields=['product', 'tag_signature'], name='inventory_p_product_700fd5_idx'),
+        ),
+    ]
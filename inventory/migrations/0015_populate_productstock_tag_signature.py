@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:32
+from django.db import migrations
+
+from master.models import get_tag_signature
+
+
+def populate_tag_signatures(apps, schema_editor):
+    ProductStock = apps.get_model('inventory', 'ProductStock')
+    tag_ids = {}
+    for pk, tag_id in ProductStock.tags.through.objects.values_list('productstock_id', 'tag_id'):
+        tag_ids.setdefault(pk, []).append(tag_id)
+
+    ProductStock.objects.bulk_update(
+        [ProductStock(pk=pk, tag_signature=get_tag_signature(ids)) for pk, ids in tag_ids.items()],
+        ['tag_signature'],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('inventory', '0014_productstock_tag_signature'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_tag_signatures, reverse_code=migrations.RunPython.noop),
+    ]
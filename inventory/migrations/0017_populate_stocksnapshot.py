@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:05
+from django.db import migrations
+from django.db.models import Sum
+from django.utils import timezone
+
+
+def snapshot_current_stock(apps, schema_editor):
+    ProductStock = apps.get_model('inventory', 'ProductStock')
+    StockSnapshot = apps.get_model('inventory', 'StockSnapshot')
+
+    # The ledger starts now, earlier stock is only known as a total
+    taken_at = timezone.now()
+    StockSnapshot.objects.bulk_create([
+        StockSnapshot(product_id=product_id, taken_at=taken_at, stock=stock or 0, consumed=0)
+        for product_id, stock in ProductStock.objects.values('product_id').annotate(
+            total=Sum('stock')).values_list('product_id', 'total')
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('inventory', '0016_stockmovement_stocksnapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(snapshot_current_stock, reverse_code=migrations.RunPython.noop),
+    ]
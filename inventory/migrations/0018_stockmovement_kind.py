@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0017_populate_stocksnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockmovement',
+            name='kind',
+            field=models.CharField(choices=[('consume', 'Consumption'), ('purchase', 'Purchase'), ('correction', 'Correction'), ('transfer', 'Transfer')], default='correction', max_length=20, verbose_name='Kind'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:10
+from django.db import migrations
+
+
+def classify_movements(apps, schema_editor):
+    StockMovement = apps.get_model('inventory', 'StockMovement')
+
+    # The kind of earlier movements is unknown, decreases stay consumption as the snapshots already count them so
+    StockMovement.objects.filter(quantity__lt=0).update(kind='consume')
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('inventory', '0018_stockmovement_kind'),
+    ]
+
+    operations = [
+        migrations.RunPython(classify_movements, reverse_code=migrations.RunPython.noop),
+    ]
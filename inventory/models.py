@@ -1,12 +1,17 @@
 from uuid import uuid4
 
+from django.core.cache import cache
 from django.db import models, transaction
 from django.db.models import OuterRef, Sum, Subquery, Value, F, IntegerField
 from django.db.models.functions import Coalesce, Greatest
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
+from django.utils import timezone
 
-from master.models import Product, Tag
+from master.models import Product, Tag, TrackedModel, broadcast_invalidation, on_tags_changed, register_invalidation, \
+    remember_tagged, update_tagged
+from master.signals import bulk_changed
+from master.tags import inherit_tags_on_commit
 from django.utils.translation import gettext_lazy as _
 
 
@@ -25,7 +30,7 @@ class Location(models.Model):
         return self.name
 
 
-class ProductStock(models.Model):
+class ProductStock(TrackedModel):
     pass
     uuid = models.UUIDField(default=uuid4, editable=False, unique=True)
     product = models.ForeignKey(Product, on_delete=models.RESTRICT, verbose_name=_('Product'))
@@ -35,6 +40,7 @@ class ProductStock(models.Model):
     description = models.TextField(null=True, blank=True, editable=False, verbose_name=_('Description'))
     updated_at = models.DateTimeField(auto_now=True, verbose_name=_('Updated at'))
     update_reason = models.TextField(null=True, blank=True, verbose_name=_('Update reason'))
+    tag_signature = models.CharField(max_length=40, default='', blank=True, editable=False)
 
     def __str__(self):
         return f"{self.product.name}"
@@ -42,18 +48,19 @@ class ProductStock(models.Model):
     class Meta:
         verbose_name = _("Product Stock")
         verbose_name_plural = _("Product Stock")
+        indexes = [
+            models.Index(fields=['product', 'tag_signature']),
+        ]
 
     def save(self, *args, **kwargs):
-        if self.pk is not None:
-            original = ProductStock.objects.get(pk=self.pk)
-
-            if self.update_reason == original.update_reason:
-                self.update_reason = ''
+        # A reason left over from the previous change does not describe this one
+        if self.pk is not None and not self.has_changed('update_reason'):
+            self.update_reason = ''
 
         super(ProductStock, self).save(*args, **kwargs)
 
 
-class MinimumProductStock(models.Model):
+class MinimumProductStock(TrackedModel):
     pass
     product = models.ForeignKey(Product, on_delete=models.RESTRICT, verbose_name=_('Product'))
     location = models.ForeignKey(Location, on_delete=models.RESTRICT, verbose_name=_('Location'))
@@ -68,36 +75,80 @@ class MinimumProductStock(models.Model):
         verbose_name_plural = _("Minimum Product Stocks")
 
 
-class ProductStockManager(models.Manager):
-    def get_queryset(self):
-        stock_subquery = ProductStock.objects.filter(
-            product_id=OuterRef('id')
-        ).values('product_id').annotate(
-            total_stock=Sum('stock')
-        ).values('total_stock')[:1]
-
-        minimum_stock_subquery = MinimumProductStock.objects.filter(
-            product_id=OuterRef('id')
-        ).values('product_id').annotate(
-            total_minimum_stock=Sum('minimum_stock')
-        ).values('total_minimum_stock')[:1]
-
-        queryset = super().get_queryset()
-        queryset = queryset.annotate(
-            stock=Coalesce(Subquery(stock_subquery, output_field=IntegerField()),
-                           Value(0, output_field=IntegerField())),
-            minimum_stock=Coalesce(Subquery(minimum_stock_subquery, output_field=IntegerField()),
-                                   Value(0, output_field=IntegerField()))
+class ProductStockSummary(models.Model):
+    """Stock totals per product, kept current by the ProductStock and MinimumProductStock receivers."""
+    product = models.OneToOneField(Product, primary_key=True, on_delete=models.CASCADE,
+                                   related_name='stock_summary')
+    stock = models.IntegerField(default=0)
+    minimum_stock = models.IntegerField(default=0)
+    stock_needed = models.IntegerField(default=0)
+
+
+def with_live_stock(queryset):
+    """Annotate products with stock totals computed from the stock rows, used to verify the summaries."""
+    stock_subquery = ProductStock.objects.filter(
+        product_id=OuterRef('id')
+    ).values('product_id').annotate(
+        total_stock=Sum('stock')
+    ).values('total_stock')[:1]
+
+    minimum_stock_subquery = MinimumProductStock.objects.filter(
+        product_id=OuterRef('id')
+    ).values('product_id').annotate(
+        total_minimum_stock=Sum('minimum_stock')
+    ).values('total_minimum_stock')[:1]
+
+    queryset = queryset.annotate(
+        stock=Coalesce(Subquery(stock_subquery, output_field=IntegerField()),
+                       Value(0, output_field=IntegerField())),
+        minimum_stock=Coalesce(Subquery(minimum_stock_subquery, output_field=IntegerField()),
+                               Value(0, output_field=IntegerField()))
+    )
+
+    return queryset.annotate(
+        stock_needed=Greatest(
+            Coalesce(F('minimum_stock') - F('stock'), Value(0, output_field=IntegerField())),
+            Value(0, output_field=IntegerField())
         )
+    )
+
 
-        queryset = queryset.annotate(
-            stock_needed=Greatest(
-                Coalesce(F('minimum_stock') - F('stock'), Value(0, output_field=IntegerField())),
-                Value(0, output_field=IntegerField())
-            )
+def refresh_stock_summaries(product_ids):
+    """Recompute the summaries of the given products from their stock rows."""
+    product_ids = set(product_ids) - {None}
+    if not product_ids:
+        return
+
+    with transaction.atomic():
+        # Products deleted in the meantime would violate the foreign key. Missing summaries are created first and all
+        # of them are locked, so the totals below are not overwritten by a concurrent refresh. An upsert would be one
+        # statement, but MySQL cannot name the conflicting field.
+        existing = Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True)
+        ProductStockSummary.objects.bulk_create(
+            [ProductStockSummary(product_id=product_id) for product_id in existing], ignore_conflicts=True
         )
+        summaries = list(ProductStockSummary.objects.select_for_update().filter(product_id__in=product_ids))
+
+        stock = dict(ProductStock.objects.filter(product_id__in=product_ids).values('product_id').annotate(
+            total=Sum('stock')).values_list('product_id', 'total'))
+        minimum_stock = dict(MinimumProductStock.objects.filter(product_id__in=product_ids).values(
+            'product_id').annotate(total=Sum('minimum_stock')).values_list('product_id', 'total'))
 
-        return queryset
+        for summary in summaries:
+            summary.stock = stock.get(summary.product_id) or 0
+            summary.minimum_stock = minimum_stock.get(summary.product_id) or 0
+            summary.stock_needed = max(summary.minimum_stock - summary.stock, 0)
+        ProductStockSummary.objects.bulk_update(summaries, ['stock', 'minimum_stock', 'stock_needed'])
+
+
+class ProductStockManager(models.Manager):
+    def get_queryset(self):
+        zero = Value(0, output_field=IntegerField())
+        return super().get_queryset().annotate(
+            stock=Coalesce(F('stock_summary__stock'), zero),
+            minimum_stock=Coalesce(F('stock_summary__minimum_stock'), zero),
+            stock_needed=Coalesce(F('stock_summary__stock_needed'), zero),
+        )
 
 
 class ProductWithStock(Product):
@@ -111,18 +162,186 @@ class ProductWithStock(Product):
         proxy = True
 
 
+# Stock rows inherit the tags of their product and location
+STOCK_TAG_SOURCES = [('product_id', 'product'), ('location_id', 'location')]
+
+
 @receiver(post_save, sender=MinimumProductStock)
 @receiver(post_save, sender=ProductStock)
 def add_default_tags(sender, instance, created, **kwargs):
     if created:
-        tags = list(instance.tags.all())
-        if instance.product:
-            for tag in instance.product.tags.all():
-                if tag not in tags:
-                    tags.append(tag)
-        if instance.location:
-            for tag in instance.location.tags.all():
-                if tag not in tags:
-                    tags.append(tag)
-        if len(tags) > 0 and (instance.location or instance.product):
-            transaction.on_commit(lambda: instance.tags.add(*tags))
+        inherit_tags_on_commit(sender, instance, STOCK_TAG_SOURCES)
+
+
+def adjust_stock_summary(product_id, stock: int = 0, minimum_stock: int = 0):
+    """Add the given differences to the summary of a product.
+
+    Differences are applied in the database so concurrent writes to stock rows of the same product do not get lost.
+    Code writing stock rows without save() or delete() has to call this itself.
+    """
+    if product_id is None or (stock == 0 and minimum_stock == 0):
+        return
+
+    with transaction.atomic():
+        summary = ProductStockSummary.objects.filter(product_id=product_id)
+        if not summary.update(stock=F('stock') + stock, minimum_stock=F('minimum_stock') + minimum_stock):
+            # First stock row of the product
+            ProductStockSummary.objects.bulk_create([ProductStockSummary(product_id=product_id)], ignore_conflicts=True)
+            summary.update(stock=F('stock') + stock, minimum_stock=F('minimum_stock') + minimum_stock)
+        # Separate statement, databases disagree on whether SET sees the values assigned before it
+        summary.update(stock_needed=Greatest(F('minimum_stock') - F('stock'), Value(0)))
+
+
+def get_row_changes(instance, field_name: str, created: bool, deleted: bool) -> list[tuple[int, int]] | None:
+    """Differences a save or delete of a stock row made to the totals of its products, None if unknown."""
+    if not created and not hasattr(instance, '_loaded_values'):
+        # Saved or deleted without being loaded, the previous values are unknown
+        return None
+
+    if created:
+        old_product_id, old_value = None, 0
+    else:
+        old_product_id = instance.get_loaded_value('product_id')
+        old_value = instance.get_loaded_value(field_name) or 0
+    new_product_id, new_value = (None, 0) if deleted else (instance.product_id, getattr(instance, field_name))
+
+    if old_product_id == new_product_id:
+        changes = [(new_product_id, new_value - old_value)]
+    else:
+        changes = [(old_product_id, -old_value), (new_product_id, new_value)]
+    return [(product_id, change) for product_id, change in changes if product_id is not None and change != 0]
+
+
+@receiver(post_save, sender=MinimumProductStock)
+@receiver(post_save, sender=ProductStock)
+@receiver(post_delete, sender=MinimumProductStock)
+@receiver(post_delete, sender=ProductStock)
+def update_stock_summary(sender, instance, **kwargs):
+    field_name = 'stock' if sender is ProductStock else 'minimum_stock'
+    changes = get_row_changes(instance, field_name, kwargs.get('created', False), 'created' not in kwargs)
+
+    if changes is None:
+        refresh_stock_summaries([instance.product_id])
+        return
+
+    for product_id, change in changes:
+        adjust_stock_summary(product_id, **{field_name: change})
+
+
+class StockMovement(models.Model):
+    """Append-only ledger of stock changes, old entries are folded into StockSnapshot by compact_stock_movements."""
+
+    class Kind(models.TextChoices):
+        CONSUME = 'consume', _('Consumption')
+        PURCHASE = 'purchase', _('Purchase')
+        CORRECTION = 'correction', _('Correction')
+        TRANSFER = 'transfer', _('Transfer')
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name=_('Product'))
+    stock = models.ForeignKey(ProductStock, null=True, blank=True, on_delete=models.SET_NULL,
+                              verbose_name=_('Product Stock'))
+    quantity = models.IntegerField(verbose_name=_('Quantity'))
+    kind = models.CharField(max_length=20, choices=Kind.choices, default=Kind.CORRECTION, verbose_name=_('Kind'))
+    reason = models.TextField(blank=True, default='', verbose_name=_('Update reason'))
+    created_at = models.DateTimeField(default=timezone.now, verbose_name=_('Created at'))
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'created_at']),
+            models.Index(fields=['created_at']),
+        ]
+
+
+class StockSnapshot(models.Model):
+    """Stock of a product at a point in time and everything consumed up to then."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    taken_at = models.DateTimeField()
+    stock = models.IntegerField()
+    consumed = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'taken_at'], name='unique_stock_snapshot'),
+        ]
+
+
+def record_movements(movements: list[tuple[ProductStock | None, int, int, str]], kind: str, created_at=None):
+    """Append (stock, product_id, quantity, reason) entries of one StockMovement.Kind to the ledger."""
+    created_at = created_at or timezone.now()
+    StockMovement.objects.bulk_create([
+        StockMovement(stock=stock, product_id=product_id, quantity=quantity, kind=kind, reason=reason or '',
+                      created_at=created_at)
+        for stock, product_id, quantity, reason in movements if quantity != 0
+    ], batch_size=1000)
+
+
+@receiver(post_save, sender=ProductStock)
+@receiver(post_delete, sender=ProductStock)
+def record_stock_movement(sender, instance, **kwargs):
+    deleted = 'created' not in kwargs
+    # Rows saved without being loaded have no known difference, their change is not in the ledger
+    changes = get_row_changes(instance, 'stock', kwargs.get('created', False), deleted) or []
+    # Code saving stock rows for another reason sets movement_kind on the instance, anything else, like the stock counted
+    # by hand in the admin, corrects the stock
+    record_movements([
+        (None if deleted else instance, product_id, change, instance.update_reason)
+        for product_id, change in changes
+    ], getattr(instance, 'movement_kind', StockMovement.Kind.CORRECTION))
+
+
+UNDER_STOCK_VERSION_KEY = 'inventory:under-stock:version'
+UNDER_STOCK_MODELS = {'inventory.ProductStock', 'inventory.MinimumProductStock', 'shopping.Item', 'master.Product'}
+
+
+def get_under_stock_version() -> int:
+    return cache.get_or_set(UNDER_STOCK_VERSION_KEY, 0, timeout=None)
+
+
+def bump_under_stock_version():
+    try:
+        cache.incr(UNDER_STOCK_VERSION_KEY)
+    except ValueError:
+        cache.set(UNDER_STOCK_VERSION_KEY, 1, timeout=None)
+
+
+def invalidate_under_stock():
+    """Drop the cached under-stock candidates of all shopping lists once the current transaction commits."""
+    transaction.on_commit(bump_under_stock_version)
+    broadcast_invalidation('inventory.under-stock')
+
+
+# The default cache is local to each process unless a shared backend is configured
+register_invalidation('inventory.under-stock', bump_under_stock_version)
+
+
+@receiver(post_save, sender=ProductStock)
+@receiver(post_save, sender=MinimumProductStock)
+@receiver(post_save, sender='shopping.Item')
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=ProductStock)
+@receiver(post_delete, sender=MinimumProductStock)
+@receiver(post_delete, sender='shopping.Item')
+@receiver(post_delete, sender=Product)
+def on_under_stock_change(sender, **kwargs):
+    invalidate_under_stock()
+
+
+@receiver(bulk_changed)
+def on_under_stock_bulk_change(sender, **kwargs):
+    if sender._meta.label in UNDER_STOCK_MODELS:
+        invalidate_under_stock()
+
+
+@receiver(m2m_changed, sender=ProductStock.tags.through)
+def update_tag_signature(sender, instance, action, reverse, pk_set, **kwargs):
+    on_tags_changed(ProductStock, instance, action, reverse, pk_set)
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tagged_stock(sender, instance, **kwargs):
+    remember_tagged(ProductStock, instance)
+
+
+@receiver(post_delete, sender=Tag)
+def update_tagged_stock(sender, instance, **kwargs):
+    update_tagged(ProductStock, instance)
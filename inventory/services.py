@@ -0,0 +1,219 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, CharField, F, IntegerField, Min, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from inventory.forecast import forecast_needed, with_forecast
+from inventory.models import STOCK_TAG_SOURCES, ProductStock, ProductWithStock, StockMovement, \
+    adjust_stock_summary, record_movements
+from master.signals import bulk_changed
+from master.tags import inherit_tags
+from shopping.models import ITEM_TAG_SOURCES, Item, List
+
+
+def find_missing_stock(products=None, shoppinglist: List | None = None):
+    """Products whose needed stock is not covered by shopping items yet, in one aggregate query.
+
+    Annotates `open_quantity` (all items of the product, including the cart), `missing_quantity` and
+    `existing_item_id`, the oldest item not in the cart the missing quantity can be added to. With a shopping list
+    only items of that list are considered for `existing_item_id`.
+
+    With INVENTORY_FORECAST_REORDER_DAYS set, products also count as needed when their stock will not last that long
+    at the current consumption rate.
+    """
+    queryset = ProductWithStock.default_manager.all()
+    if products is not None:
+        queryset = queryset.filter(pk__in=products.values('pk'))
+
+    needed = F('stock_needed')
+    if settings.INVENTORY_FORECAST_REORDER_DAYS:
+        queryset = with_forecast(queryset)
+        needed = Greatest(needed, forecast_needed(settings.INVENTORY_FORECAST_REORDER_DAYS))
+
+    existing_item_filter = Q(item__in_cart=False)
+    if shoppinglist is not None:
+        existing_item_filter &= Q(item__list_id=shoppinglist.pk)
+
+    return queryset.annotate(
+        open_quantity=Coalesce(Sum('item__quantity'), Value(0, output_field=IntegerField())),
+        missing_quantity=needed - F('open_quantity'),
+        existing_item_id=Min('item__id', filter=existing_item_filter),
+    ).filter(missing_quantity__gt=0).order_by('name')
+
+
+def add_missing_items(products=None, shoppinglist: List | None = None) -> tuple[int, int]:
+    """Put the missing quantity of the products on a shopping list, returns the number of created and updated items."""
+    with transaction.atomic():
+        missing = list(find_missing_stock(products, shoppinglist).values_list(
+            'pk', 'name', 'missing_quantity', 'existing_item_id'))
+
+        existing_items = Item.objects.in_bulk([item_id for *_, item_id in missing if item_id is not None])
+        now = timezone.now()
+        updated = []
+        created = []
+        for product_id, name, quantity, item_id in missing:
+            if item_id is not None:
+                item = existing_items[item_id]
+                item.quantity += quantity
+                item.updated_at = now
+                updated.append(item)
+            else:
+                created.append(Item(product_id=product_id, name=name, quantity=quantity, list=shoppinglist))
+
+        Item.objects.bulk_update(updated, ['quantity', 'updated_at'], batch_size=1000)
+        Item.objects.bulk_create(created, batch_size=1000)
+        if any(item.pk is None for item in created):
+            # Backends without RETURNING leave the primary keys unset
+            pks = dict(Item.objects.filter(uuid__in=[item.uuid for item in created]).values_list('uuid', 'pk'))
+            for item in created:
+                item.pk = pks[item.uuid]
+        inherit_tags(Item, created, ITEM_TAG_SOURCES)
+
+        bulk_changed.send(sender=Item, pks=[item.pk for item in updated + created])
+
+    return len(created), len(updated)
+
+
+def find_stock_with_tags(items: list[Item]) -> dict[tuple[int, str], ProductStock]:
+    """The first stock row carrying at least the tags of each item, keyed by product and tag signature."""
+    stock_rows = ProductStock.objects.filter(
+        product_id__in={item.product_id for item in items}, tags__isnull=False
+    ).distinct().prefetch_related('tags').order_by('pk')
+    found = {}
+    for item in items:
+        key = (item.product_id, item.tag_signature)
+        if key in found:
+            continue
+        item_tags = {tag.pk for tag in item.tags.all()}
+        for stock in stock_rows:
+            if stock.product_id == item.product_id and item_tags <= {tag.pk for tag in stock.tags.all()}:
+                found[key] = stock
+                break
+    return found
+
+
+def move_items_to_inventory(items) -> int:
+    """Add shopping items to the stock of their product and delete them, returns the number of items moved.
+
+    Each item goes to the stock row with exactly the same tags (without location for untagged items), found by the
+    indexed tag signature, otherwise to the first row carrying at least its tags. Items without product are left alone.
+    """
+    with transaction.atomic():
+        items = [
+            item for item in items.select_related('product', 'list').prefetch_related('tags').order_by('pk')
+            if item.product_id is not None
+        ]
+        if not items:
+            return 0
+
+        stock_rows = {}
+        for stock in ProductStock.objects.filter(
+                product_id__in={item.product_id for item in items},
+                tag_signature__in={item.tag_signature for item in items},
+        ).order_by('pk'):
+            if stock.tag_signature == '' and stock.location_id is not None:
+                continue
+            stock_rows.setdefault((stock.product_id, stock.tag_signature), stock)
+        # Tagged items without a row of exactly their tags go to a row carrying at least their tags
+        missing = [
+            item for item in items if item.tag_signature and (item.product_id, item.tag_signature) not in stock_rows
+        ]
+        if missing:
+            stock_rows.update(find_stock_with_tags(missing))
+
+        adjustments = {}
+        created = {}
+        created_tags = {}
+        for item in items:
+            key = (item.product_id, item.tag_signature)
+            stock = stock_rows.get(key) or created.get(key)
+            if stock is None:
+                stock = created[key] = ProductStock(product_id=item.product_id, stock=0)
+                created_tags[key] = {tag.pk for tag in item.tags.all()}
+
+            if item.list:
+                update_reason = _('Shopping item “%(item)s” from “%(list)s” added.') % {
+                    'list': str(item.list), 'item': str(item)}
+            else:
+                update_reason = _('Shopping item “%(item)s” added.') % {'item': str(item)}
+
+            if stock.pk is None:
+                stock.stock += item.quantity
+                stock.update_reason = update_reason
+            else:
+                quantity = adjustments.get(stock.pk, (stock, 0, ''))[1]
+                adjustments[stock.pk] = (stock, quantity + item.quantity, update_reason)
+
+        ProductStock.objects.bulk_create(created.values(), batch_size=1000)
+        if any(stock.pk is None for stock in created.values()):
+            # Backends without RETURNING leave the primary keys unset
+            pks = dict(ProductStock.objects.filter(uuid__in=[stock.uuid for stock in created.values()]).values_list(
+                'uuid', 'pk'))
+            for stock in created.values():
+                stock.pk = pks[stock.uuid]
+        for stock in created.values():
+            adjust_stock_summary(stock.product_id, stock=stock.stock)
+        record_movements([(stock, stock.product_id, stock.stock, stock.update_reason) for stock in created.values()],
+                         StockMovement.Kind.PURCHASE)
+
+        inherit_tags(ProductStock, created.values(), STOCK_TAG_SOURCES,
+                     extra_tags={stock.pk: created_tags[key] for key, stock in created.items()})
+
+        Item.objects.filter(pk__in=[item.pk for item in items]).delete()
+        adjust_stock(adjustments.values(), StockMovement.Kind.PURCHASE)
+        bulk_changed.send(sender=ProductStock, pks=[stock.pk for stock in created.values()])
+
+    return len(items)
+
+
+def adjust_stock(adjustments, kind: str = StockMovement.Kind.CORRECTION, updated_at=None):
+    """Add quantities to stock rows, given as (stock, quantity, update_reason) tuples, recorded as movements of kind.
+
+    The quantity is added in the UPDATE statement itself, concurrent adjustments of the same row do not get lost.
+    """
+    adjustments = [adjustment for adjustment in adjustments if adjustment[1] != 0]
+    if not adjustments:
+        return
+
+    updated_at = updated_at or timezone.now()
+    quantities = {}
+    update_reasons = {}
+    product_quantities = {}
+    for stock, quantity, update_reason in adjustments:
+        quantities[stock.pk] = quantities.get(stock.pk, 0) + quantity
+        update_reasons[stock.pk] = update_reason
+        product_quantities[stock.product_id] = product_quantities.get(stock.product_id, 0) + quantity
+    with transaction.atomic():
+        ProductStock.objects.filter(pk__in=quantities).update(
+            stock=F('stock') + Case(*[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+                                    output_field=IntegerField()),
+            update_reason=Case(*[When(pk=pk, then=Value(reason)) for pk, reason in update_reasons.items()],
+                               output_field=CharField()),
+            updated_at=updated_at,
+        )
+        for product_id, quantity in product_quantities.items():
+            adjust_stock_summary(product_id, stock=quantity)
+        record_movements([
+            (stock, stock.product_id, quantity, update_reason) for stock, quantity, update_reason in adjustments
+        ], kind, updated_at)
+        bulk_changed.send(sender=ProductStock, pks=[stock.pk for stock, *_ in adjustments])
+
+
+def consume_stock(product_id: int, quantity: int = 1, update_reason: str = '') -> bool:
+    """Take a quantity from the first stock row of a product that still has it, False if none has.
+
+    The stock is checked in the UPDATE statement, two clients consuming the last unit cannot both succeed.
+    """
+    with transaction.atomic():
+        for stock in ProductStock.objects.filter(product_id=product_id, stock__gte=quantity).order_by('pk'):
+            updated = ProductStock.objects.filter(pk=stock.pk, stock__gte=quantity).update(
+                stock=F('stock') - quantity, update_reason=update_reason, updated_at=timezone.now()
+            )
+            if updated:
+                adjust_stock_summary(product_id, stock=-quantity)
+                record_movements([(stock, product_id, -quantity, update_reason)], StockMovement.Kind.CONSUME)
+                bulk_changed.send(sender=ProductStock, pks=[stock.pk])
+                return True
+    return False
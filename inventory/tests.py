@@ -1,3 +1,262 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from inventory.forecast import get_forecasts
+from inventory.ledger import get_consumption
+from inventory.models import Location, MinimumProductStock, ProductStock, ProductStockSummary, StockMovement, \
+    refresh_stock_summaries
+from inventory.services import add_missing_items, adjust_stock, consume_stock, find_missing_stock, \
+    move_items_to_inventory
+from master.models import Product, Tag
+from shopping.models import Item
+
+
+class StockSummaryTest(TestCase):
+    def setUp(self):
+        self.location = Location.objects.create(name='Keller')
+        self.milk = Product.objects.create(name='Milch')
+        self.bread = Product.objects.create(name='Brot')
+
+    def assertSummary(self, product: Product, stock: int, minimum_stock: int, stock_needed: int):
+        summary = ProductStockSummary.objects.get(product=product)
+        self.assertEqual((summary.stock, summary.minimum_stock, summary.stock_needed),
+                         (stock, minimum_stock, stock_needed))
+
+    # MySQL cannot upsert on a named unique field, the refresh must work without that
+    @mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False)
+    def test_refresh_creates_and_updates_summaries(self):
+        ProductStock.objects.create(product=self.milk, location=self.location, stock=2)
+        MinimumProductStock.objects.create(product=self.milk, location=self.location, minimum_stock=5)
+        ProductStock.objects.filter(product=self.milk).update(stock=4)
+        ProductStock.objects.bulk_create([ProductStock(product=self.bread, location=self.location, stock=3)])
+
+        refresh_stock_summaries([self.milk.pk, self.bread.pk, None])
+
+        self.assertSummary(self.milk, 4, 5, 1)
+        self.assertSummary(self.bread, 3, 0, 0)
+
+    @mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False)
+    def test_save_without_loaded_values_refreshes(self):
+        stock = ProductStock.objects.create(product=self.milk, location=self.location, stock=2)
+
+        ProductStock(pk=stock.pk, uuid=stock.uuid, product=self.milk, location=self.location, stock=7).save()
+
+        self.assertSummary(self.milk, 7, 0, 0)
+
+    @mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False)
+    def test_reconcile_fix(self):
+        ProductStock.objects.create(product=self.milk, location=self.location, stock=2)
+        ProductStockSummary.objects.filter(product=self.milk).update(stock=9)
+
+        call_command('reconcile_stock_summary', '--fix', stdout=StringIO())
+
+        self.assertSummary(self.milk, 2, 0, 0)
+
+
+class FindMissingStockTest(TestCase):
+    def test_totals_match_a_per_product_loop(self):
+        cellar, kitchen = Location.objects.create(name='Keller'), Location.objects.create(name='Küche')
+        rows = {
+            # Stock and minimum per location, quantities of the shopping items
+            'Milch': ([(cellar, 1, 4), (kitchen, 2, 3)], [1, 2]),
+            'Brot': ([(cellar, 0, 2), (kitchen, 5, 0)], []),
+            'Käse': ([(cellar, 0, 3), (kitchen, 0, 3)], [2]),
+            'Eier': ([(cellar, 6, 2)], [1]),
+            'Mehl': ([(cellar, 0, 5), (kitchen, 1, 1)], [5]),
+        }
+        for name, (stock_rows, quantities) in rows.items():
+            product = Product.objects.create(name=name)
+            for location, stock, minimum_stock in stock_rows:
+                ProductStock.objects.create(product=product, location=location, stock=stock)
+                MinimumProductStock.objects.create(product=product, location=location, minimum_stock=minimum_stock)
+            for quantity in quantities:
+                Item.objects.create(product=product, quantity=quantity)
+
+        expected = {}
+        for product in Product.objects.all():
+            stock = sum(ProductStock.objects.filter(product=product).values_list('stock', flat=True))
+            minimum_stock = sum(MinimumProductStock.objects.filter(product=product).values_list('minimum_stock',
+                                                                                              flat=True))
+            open_quantity = sum(Item.objects.filter(product=product).values_list('quantity', flat=True))
+            missing_quantity = max(minimum_stock - stock, 0) - open_quantity
+            if missing_quantity > 0:
+                expected[product.name] = (open_quantity, missing_quantity)
+
+        self.assertEqual(expected, {'Milch': (3, 1), 'Käse': (2, 4)})
+        self.assertEqual({
+            product.name: (product.open_quantity, product.missing_quantity) for product in find_missing_stock()
+        }, expected)
+
+
+class AddMissingItemsTest(TestCase):
+    def setUp(self):
+        self.location = Location.objects.create(name='Keller')
+        self.tag = Tag.objects.create(name='Vorrat')
+
+    def create_products(self, count: int):
+        products = []
+        for index in range(count):
+            product = Product.objects.create(name=f'Produkt {Product.objects.count()}')
+            product.tags.set([self.tag])
+            MinimumProductStock.objects.create(product=product, location=self.location, minimum_stock=2)
+            products.append(product.pk)
+        return Product.objects.filter(pk__in=products)
+
+    def test_query_count_does_not_grow_with_items(self):
+        # The first run also creates the CalDAV collections it bumps
+        with self.captureOnCommitCallbacks(execute=True):
+            add_missing_items(self.create_products(1))
+
+        single = self.create_products(1)
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(add_missing_items(single), (1, 0))
+
+        products = self.create_products(5)
+        with self.assertNumQueries(len(queries)), self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(add_missing_items(products), (5, 0))
+
+        for item in Item.objects.filter(product__in=products):
+            self.assertEqual(item.quantity, 2)
+            self.assertEqual(list(item.tags.values_list('name', flat=True)), ['Vorrat'])
+
+
+class MoveItemsToInventoryTest(TestCase):
+    def setUp(self):
+        self.milk = Product.objects.create(name='Milch')
+        self.cold, self.organic, self.frozen = [Tag.objects.create(name=name) for name in ['Kühl', 'Bio', 'Tiefkühl']]
+        self.untagged = ProductStock.objects.create(product=self.milk, stock=1)
+        self.cold_stock = self.create_stock([self.cold], 1)
+        self.cold_organic_stock = self.create_stock([self.cold, self.organic], 2)
+
+    def create_stock(self, tags: list[Tag], stock: int) -> ProductStock:
+        stock_row = ProductStock.objects.create(product=self.milk, stock=stock)
+        stock_row.tags.set(tags)
+        return stock_row
+
+    def create_item(self, tags: list[Tag], quantity: int) -> Item:
+        item = Item.objects.create(product=self.milk, quantity=quantity)
+        item.tags.set(tags)
+        return item
+
+    def stock(self, stock_row: ProductStock) -> int:
+        return ProductStock.objects.get(pk=stock_row.pk).stock
+
+    def test_items_go_to_matching_rows(self):
+        self.create_item([], 1)
+        self.create_item([self.cold], 2)
+        self.create_item([self.cold], 3)
+        # No row has exactly these tags, the first row with at least them is used
+        self.create_item([self.organic], 4)
+        self.create_item([self.frozen], 5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(move_items_to_inventory(Item.objects.all()), 5)
+
+        self.assertEqual(
+            [self.stock(self.untagged), self.stock(self.cold_stock), self.stock(self.cold_organic_stock)], [2, 6, 6]
+        )
+        frozen = ProductStock.objects.get(product=self.milk, tags=self.frozen)
+        self.assertEqual((frozen.stock, list(frozen.tags.all())), (5, [self.frozen]))
+        self.assertEqual(ProductStockSummary.objects.get(product=self.milk).stock, 19)
+        self.assertFalse(Item.objects.exists())
+
+    def test_query_count(self):
+        # The first run also creates the CalDAV collections it bumps
+        self.create_item([self.cold], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            move_items_to_inventory(Item.objects.all())
+
+        self.create_item([self.cold], 1)
+        self.create_item([self.organic], 1)
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            move_items_to_inventory(Item.objects.all())
+
+        for _ in range(4):
+            self.create_item([self.cold], 1)
+            self.create_item([self.organic], 1)
+        # Matching and stock updates take the same queries, the CalDAV signal records each deleted shopping item
+        with self.assertNumQueries(len(queries) + 6), self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(move_items_to_inventory(Item.objects.all()), 8)
+
+        self.assertEqual([self.stock(self.cold_stock), self.stock(self.cold_organic_stock)], [7, 7])
+
+
+class StockAdjustmentTest(TestCase):
+    def setUp(self):
+        self.milk = Product.objects.create(name='Milch')
+        self.first = ProductStock.objects.create(product=self.milk, stock=1)
+        self.second = ProductStock.objects.create(product=self.milk, stock=3)
+
+    def stock(self) -> list[int]:
+        return list(ProductStock.objects.filter(product=self.milk).order_by('pk').values_list('stock', flat=True))
+
+    def test_consume_takes_from_the_first_row_with_enough_stock(self):
+        self.assertTrue(consume_stock(self.milk.pk, 2, 'Gekocht'))
+        self.assertTrue(consume_stock(self.milk.pk))
+        self.assertEqual(self.stock(), [0, 1])
+        self.assertEqual(ProductStockSummary.objects.get(product=self.milk).stock, 1)
+        consumed = StockMovement.objects.filter(kind=StockMovement.Kind.CONSUME).order_by('pk')
+        self.assertEqual(list(consumed.values_list('stock', 'quantity', 'reason')), [
+            (self.second.pk, -2, 'Gekocht'), (self.first.pk, -1, ''),
+        ])
+
+    def test_consume_never_goes_below_zero(self):
+        self.assertFalse(consume_stock(self.milk.pk, 4))
+        self.assertEqual(self.stock(), [1, 3])
+        self.assertFalse(StockMovement.objects.filter(kind=StockMovement.Kind.CONSUME).exists())
+
+    def test_adjust_adds_to_the_current_stock(self):
+        # The instances are stale, the quantities are added to what the database holds
+        ProductStock.objects.filter(pk=self.first.pk).update(stock=5)
+        adjust_stock([(self.first, 2, 'Gekauft'), (self.second, -1, 'Verschüttet'), (self.first, 1, 'Gekauft')],
+                     StockMovement.Kind.PURCHASE)
+        self.assertEqual(self.stock(), [8, 2])
+        self.assertEqual(StockMovement.objects.filter(kind=StockMovement.Kind.PURCHASE).count(), 3)
+
+
+class StockMovementTest(TestCase):
+    def setUp(self):
+        self.milk = Product.objects.create(name='Milch')
+        self.start = timezone.now() - timedelta(minutes=1)
+
+    def test_movements_are_recorded_with_their_kind(self):
+        Item.objects.create(product=self.milk, quantity=4)
+        move_items_to_inventory(Item.objects.all())
+        self.assertTrue(consume_stock(self.milk.pk))
+
+        stock = ProductStock.objects.get(product=self.milk)
+        stock.stock = 1
+        stock.save()
+
+        self.assertEqual(list(StockMovement.objects.order_by('pk').values_list('kind', 'quantity')), [
+            (StockMovement.Kind.PURCHASE, 4),
+            (StockMovement.Kind.CONSUME, -1),
+            (StockMovement.Kind.CORRECTION, -2),
+        ])
+        self.assertEqual(get_consumption(self.milk.pk, self.start), 1)
+
+
+class ForecastTest(TestCase):
+    def test_only_consumption_counts(self):
+        milk = Product.objects.create(name='Milch')
+        ProductStock.objects.create(product=milk, stock=20)
+        now = timezone.now()
+        StockMovement.objects.bulk_create([
+            StockMovement(product=milk, quantity=-14, kind=StockMovement.Kind.CONSUME, created_at=now),
+            StockMovement(product=milk, quantity=-10, kind=StockMovement.Kind.CORRECTION, created_at=now),
+            StockMovement(product=milk, quantity=-5, kind=StockMovement.Kind.TRANSFER, created_at=now),
+            StockMovement(product=milk, quantity=-7, kind=StockMovement.Kind.CONSUME,
+                          created_at=now - timedelta(days=30)),
+        ])
+
+        rate, days_left = get_forecasts(window=timedelta(days=7))[milk.pk]
 
-# Create your tests here.
+        self.assertEqual(rate, 2)
+        self.assertEqual(days_left, 10)
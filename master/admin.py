@@ -3,12 +3,13 @@ import operator
 from django.contrib import admin
 from django import forms
 from django.contrib.admin.utils import get_model_from_relation
+from django.db.models import Case, When
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
 
 from cleverlist.admin import ListActionModelAdmin
-from master.models import Product, Tag
+from master.models import Product, Tag, normalize_product_name, resolve_product
 
 
 def format_tag(tag: Tag) -> str:
@@ -91,6 +92,17 @@ class ProductAdmin(ListActionModelAdmin):
         queryset = queryset.prefetch_related('tags')
         return queryset
 
+    def get_search_results(self, request, queryset, search_term):
+        # Searches the normalized names, so case, spacing and accents match like product names from CalDAV do
+        for word in normalize_product_name(search_term).split():
+            queryset = queryset.filter(normalized_name__contains=word)
+
+        # The exact match is offered first in autocomplete, the changelist applies its own ordering afterwards
+        product = resolve_product(search_term)
+        if product is not None:
+            queryset = queryset.order_by(Case(When(pk=product[0], then=0), default=1), 'name')
+        return queryset, False
+
     @admin.display(description='Tags')
     def display_tags(self, obj):
         tags = obj.tags.all()
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from master.models import Product, normalize_product_name
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the normalized product names, needed after changing PRODUCT_NAME_FOLD_ACCENTS'
+
+    def handle(self, *args, **options):
+        changed = []
+        for product in Product.objects.only('pk', 'name', 'normalized_name').iterator(chunk_size=1000):
+            normalized_name = normalize_product_name(product.name)
+            if product.normalized_name != normalized_name:
+                product.normalized_name = normalized_name
+                changed.append(product)
+
+        Product.objects.bulk_update(changed, ['normalized_name'], batch_size=1000)
+        self.stdout.write(f'Updated {len(changed)} product names')
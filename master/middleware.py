@@ -0,0 +1,24 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from master.models import acheck_invalidations, check_invalidations
+
+
+class CacheInvalidationMiddleware:
+    """Clears the in-process caches invalidated by other worker processes before the request is handled."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        check_invalidations()
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        await acheck_invalidations()
+        return await self.get_response(request)
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:07
+from django.db import migrations
+
+from master.models import normalize_product_name
+
+
+def populate_normalized_names(apps, schema_editor):
+    Product = apps.get_model('master', 'Product')
+    products = list(Product.objects.only('pk', 'name'))
+    for product in products:
+        product.normalized_name = normalize_product_name(product.name)
+    Product.objects.bulk_update(products, ['normalized_name'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('master', '0005_product_normalized_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_normalized_names, reverse_code=migrations.RunPython.noop),
+    ]
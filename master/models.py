@@ -1,11 +1,144 @@
+import hashlib
+import time
+import unicodedata
+from functools import partial
+from threading import local
+from typing import Callable
 from uuid import uuid4
 
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
 
+from cleverlist.cache import LRUCache
+
+
+class TrackedModel(models.Model):
+    """Remembers the values a row was loaded with, so receivers can tell whether a save changed anything."""
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = {field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields}
+
+    def get_loaded_value(self, field_name: str):
+        return getattr(self, '_loaded_values', {}).get(field_name)
+
+    def has_changed(self, *field_names: str) -> bool:
+        loaded_values = getattr(self, '_loaded_values', None)
+        if loaded_values is None:
+            return True
+
+        for field_name in field_names:
+            if field_name not in loaded_values or loaded_values[field_name] != getattr(self, field_name):
+                return True
+        return False
+
+
+class CacheGeneration(models.Model):
+    """Generation counter of an in-process cache namespace, shared by all worker processes through the database."""
+    namespace = models.CharField(max_length=100, unique=True)
+    generation = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.namespace}: {self.generation}'
+
+
+# Namespace to the callbacks clearing the caches of this process, the generations this process has seen and when it
+# reads them next
+_invalidation_callbacks = {}
+_seen_generations = {}
+_pending_invalidations = local()
+_next_check = 0.0
+
+
+def register_invalidation(namespace: str, clear: Callable[[], None]):
+    """Clear an in-process cache whenever another process broadcasts an invalidation of its namespace."""
+    _invalidation_callbacks.setdefault(namespace, []).append(clear)
+
+
+def broadcast_invalidation(namespace: str):
+    """Have every process clear the namespace before its next request, once the current transaction commits.
+
+    Like the collection bumps of the caldav app, the namespaces of one transaction are collected and written together.
+    """
+    if not settings.CACHE_INVALIDATION_BUS:
+        return
+    pending = getattr(_pending_invalidations, 'namespaces', None)
+    if pending is None:
+        pending = _pending_invalidations.namespaces = set()
+    pending.add(namespace)
+    transaction.on_commit(flush_invalidations)
+
+
+def flush_invalidations():
+    namespaces = getattr(_pending_invalidations, 'namespaces', None)
+    if not namespaces:
+        return
+    _pending_invalidations.namespaces = set()
+    for namespace in sorted(namespaces):
+        bump_cache_generation(namespace)
+
+
+def bump_cache_generation(namespace: str):
+    generations = CacheGeneration.objects.filter(namespace=namespace)
+    # The row stays locked until the generation is read back, no bump of another process comes in between
+    with transaction.atomic():
+        if not generations.update(generation=F('generation') + 1):
+            CacheGeneration.objects.bulk_create([CacheGeneration(namespace=namespace)], ignore_conflicts=True)
+            generations.update(generation=F('generation') + 1)
+        generation = generations.values_list('generation', flat=True).get()
+
+    # The caller has invalidated its own caches already, they are not cleared again unless other bumps were missed
+    if _seen_generations.get(namespace) == generation - 1:
+        _seen_generations[namespace] = generation
+
+
+def invalidations_due() -> bool:
+    """Whether this process reads the generations again, at most once every CACHE_INVALIDATION_INTERVAL seconds."""
+    global _next_check
+    now = time.monotonic()
+    if not settings.CACHE_INVALIDATION_BUS or now < _next_check:
+        return False
+    _next_check = now + settings.CACHE_INVALIDATION_INTERVAL
+    return True
+
+
+def check_invalidations():
+    """Clear the caches whose generation moved since the last check, one query for all namespaces."""
+    if not invalidations_due():
+        return
+    for namespace, generation in CacheGeneration.objects.values_list('namespace', 'generation'):
+        apply_generation(namespace, generation)
+
+
+async def acheck_invalidations():
+    if not invalidations_due():
+        return
+    async for namespace, generation in CacheGeneration.objects.values_list('namespace', 'generation'):
+        apply_generation(namespace, generation)
+
+
+def apply_generation(namespace: str, generation: int):
+    if _seen_generations.get(namespace) != generation:
+        _seen_generations[namespace] = generation
+        for clear in _invalidation_callbacks.get(namespace, []):
+            clear()
+
 
 # Create your models here.
-class Tag(models.Model):
+class Tag(TrackedModel):
     pass
     name = models.CharField(unique=True, max_length=100, verbose_name=_('Name'))
     color = models.CharField(max_length=7, default='#ffffff', verbose_name=_('Color'))
@@ -19,10 +152,11 @@ class Tag(models.Model):
         return self.name
 
 
-class Product(models.Model):
+class Product(TrackedModel):
     pass
     uuid = models.UUIDField(default=uuid4, editable=False, unique=True)
     name = models.CharField(max_length=100, verbose_name=_('Name'))
+    normalized_name = models.CharField(max_length=255, default='', blank=True, editable=False, db_index=True)
     tags = models.ManyToManyField(Tag, blank=True, verbose_name=_('Tags'))
 
     class Meta:
@@ -31,3 +165,103 @@ class Product(models.Model):
 
     def __str__(self):
         return self.name
+
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_product_name(self.name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'normalized_name'}
+        super().save(*args, **kwargs)
+
+
+def normalize_product_name(name: str) -> str:
+    """Casefolded name with collapsed whitespace, accents are dropped as well with PRODUCT_NAME_FOLD_ACCENTS."""
+    name = ' '.join(name.split()).casefold()
+    if settings.PRODUCT_NAME_FOLD_ACCENTS:
+        name = ''.join(char for char in unicodedata.normalize('NFKD', name) if not unicodedata.combining(char))
+    return name[:255]
+
+
+# Normalized name to (product id, name), tagged by product id. Misses are not cached.
+product_cache = LRUCache(settings.PRODUCT_RESOLVER_CACHE_SIZE)
+
+
+def resolve_product(name: str) -> tuple[int, str] | None:
+    """Id and name of the oldest product with the same normalized name, None if there is none."""
+    normalized_name = normalize_product_name(name)
+    if not normalized_name:
+        return None
+
+    product = product_cache.get(normalized_name)
+    if product is None:
+        product = Product.objects.filter(normalized_name=normalized_name).order_by('pk').values_list(
+            'pk', 'name'
+        ).first()
+        if product is not None:
+            # A product created in a transaction that is rolled back must not stay resolvable
+            transaction.on_commit(partial(product_cache.set, normalized_name, product, tag=product[0]))
+    return product
+
+
+register_invalidation('master.products', product_cache.clear)
+
+
+@receiver(post_save, sender=Product)
+def invalidate_renamed_product(sender, instance, created, **kwargs):
+    # Misses are not cached, a new product needs no invalidation
+    if not created and instance.has_changed('normalized_name'):
+        product_cache.invalidate(instance.pk)
+        broadcast_invalidation('master.products')
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_deleted_product(sender, instance, **kwargs):
+    product_cache.invalidate(instance.pk)
+    broadcast_invalidation('master.products')
+
+
+def get_tag_signature(tag_ids) -> str:
+    """Order independent fingerprint of a set of tags, empty for no tags."""
+    tag_ids = sorted(set(tag_ids))
+    if not tag_ids:
+        return ''
+    return hashlib.sha1(','.join(map(str, tag_ids)).encode()).hexdigest()
+
+
+def update_tag_signatures(model, pks):
+    """Recompute the stored tag_signature of the given rows from their tag assignments."""
+    pks = list(pks)
+    through = model.tags.through
+    column = f'{model.tags.field.m2m_field_name()}_id'
+    for start in range(0, len(pks), 1000):
+        tag_ids = {pk: [] for pk in pks[start:start + 1000]}
+        for pk, tag_id in through.objects.filter(**{f'{column}__in': tag_ids.keys()}).values_list(column, 'tag_id'):
+            tag_ids[pk].append(tag_id)
+        model.objects.bulk_update(
+            [model(pk=pk, tag_signature=get_tag_signature(ids)) for pk, ids in tag_ids.items()], ['tag_signature']
+        )
+
+
+def on_tags_changed(model, instance, action: str, reverse: bool, pk_set):
+    """Keep tag_signature current, to be called from the m2m_changed receiver of a model's tags."""
+    if not reverse:
+        if action in ['post_add', 'post_remove', 'post_clear']:
+            update_tag_signatures(model, [instance.pk])
+    elif action == 'pre_clear':
+        instance._cleared_pks = list(model.objects.filter(tags=instance).values_list('pk', flat=True))
+    elif action == 'post_clear':
+        update_tag_signatures(model, getattr(instance, '_cleared_pks', []))
+    elif action in ['post_add', 'post_remove']:
+        update_tag_signatures(model, pk_set)
+
+
+def remember_tagged(model, tag: Tag):
+    """Called before a tag is deleted, its assignments are removed without m2m_changed."""
+    if not hasattr(tag, '_tagged_pks'):
+        tag._tagged_pks = {}
+    tag._tagged_pks[model] = list(model.objects.filter(tags=tag).values_list('pk', flat=True))
+
+
+def update_tagged(model, tag: Tag):
+    """Called after a tag was deleted, with the rows remembered by remember_tagged."""
+    update_tag_signatures(model, getattr(tag, '_tagged_pks', {}).get(model, []))
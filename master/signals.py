@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent after rows were written with bulk_create, bulk_update or QuerySet.update, which skip the model signals.
+# The sender is the model class, receivers get the primary keys of the affected rows as `pks`.
+bulk_changed = Signal()
@@ -0,0 +1,60 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db import transaction
+
+from master.models import Tag, update_tag_signatures
+from master.signals import bulk_changed
+
+# A tag source pairs the attribute holding a related id on the tagged instance with the lookup from Tag to that id,
+# e.g. ('product_id', 'product') for the tags of the product.
+TagSource = tuple[str, str]
+
+
+def get_inherited_tags(instances: list, sources: list[TagSource]) -> dict[int, set[int]]:
+    """Tag ids the instances inherit from their related objects, one query per source and 1000 related ids."""
+    inherited = {instance.pk: set() for instance in instances}
+    for attname, lookup in sources:
+        related_ids = list({getattr(instance, attname) for instance in instances} - {None})
+        related_tags = {}
+        for start in range(0, len(related_ids), 1000):
+            for related_id, tag_id in Tag.objects.filter(
+                    **{f'{lookup}__in': related_ids[start:start + 1000]}).values_list(lookup, 'pk'):
+                related_tags.setdefault(related_id, set()).add(tag_id)
+        for instance in instances:
+            inherited[instance.pk] |= related_tags.get(getattr(instance, attname), set())
+    return inherited
+
+
+def inherit_tags(model, instances, sources: list[TagSource], extra_tags: dict[int, set[int]] | None = None) -> int:
+    """Add the inherited tags, and optional extra tag ids per primary key, to saved instances in bulk.
+
+    Tags the instances already have are kept. Returns the number of assignments written, no m2m_changed is sent.
+    """
+    instances = [instance for instance in instances if instance.pk is not None]
+    tag_ids = get_inherited_tags(instances, sources)
+    for pk, extra in (extra_tags or {}).items():
+        tag_ids.setdefault(pk, set()).update(extra)
+
+    through = model.tags.through
+    column = f'{model.tags.field.m2m_field_name()}_id'
+    rows = [through(**{column: pk, 'tag_id': tag_id}) for pk, ids in tag_ids.items() for tag_id in ids]
+    through.objects.bulk_create(rows, ignore_conflicts=True, batch_size=1000)
+
+    try:
+        model._meta.get_field('tag_signature')
+    except FieldDoesNotExist:
+        pass
+    else:
+        update_tag_signatures(model, [pk for pk, ids in tag_ids.items() if ids])
+    return len(rows)
+
+
+def inherit_tags_on_commit(model, instance, sources: list[TagSource]):
+    """Inherit tags for a single saved instance once the transaction commits.
+
+    The admin assigns the tags of the form after saving the object, tags added earlier would be replaced.
+    """
+    def inherit():
+        if inherit_tags(model, [instance], sources):
+            bulk_changed.send(sender=model, pks=[instance.pk])
+
+    transaction.on_commit(inherit)
@@ -1,3 +1,80 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.db.models import F
+from django.test import TestCase, override_settings
+
+from master import models
+from master.models import CacheGeneration, Product, broadcast_invalidation, check_invalidations, product_cache, \
+    resolve_product
+
+
+class ResolveProductTest(TestCase):
+    def setUp(self):
+        product_cache.clear()
+
+    def resolve(self, name: str) -> tuple[int, str] | None:
+        # Resolved products are cached once the transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return resolve_product(name)
+
+    def test_case_and_whitespace_are_normalized(self):
+        milk = Product.objects.create(name='Vollmilch  3,5 %')
+        Product.objects.create(name='vollmilch 3,5 %')
+
+        for name in ['Vollmilch 3,5 %', ' VOLLMILCH\t3,5 % ', 'vollmilch 3,5  %']:
+            with self.subTest(name=name):
+                self.assertEqual(self.resolve(name), (milk.pk, 'Vollmilch  3,5 %'))
+        self.assertIsNone(self.resolve('Vollmilch'))
+        self.assertIsNone(self.resolve('  '))
+
+    def test_rename_invalidates_the_cache(self):
+        milk = Product.objects.create(name='Milch')
+        self.assertEqual(self.resolve('milch'), (milk.pk, 'Milch'))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.resolve('MILCH'), (milk.pk, 'Milch'))
+
+        milk.name = 'Hafermilch'
+        milk.save()
+        self.assertIsNone(self.resolve('milch'))
+        self.assertEqual(self.resolve('hafermilch'), (milk.pk, 'Hafermilch'))
+
+        milk.delete()
+        self.assertIsNone(self.resolve('hafermilch'))
+
+
+@override_settings(CACHE_INVALIDATION_BUS=True, CACHE_INVALIDATION_INTERVAL=0)
+class CacheInvalidationTest(TestCase):
+    def setUp(self):
+        self.clear = mock.Mock()
+        patches = [
+            mock.patch.dict(models._invalidation_callbacks, {'test': [self.clear]}),
+            mock.patch.dict(models._seen_generations),
+            mock.patch.object(models, '_next_check', 0.0),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        CacheGeneration.objects.create(namespace='test')
+        check_invalidations()
+        self.clear.reset_mock()
+
+    def test_bump_of_another_process_clears_the_namespace(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            broadcast_invalidation('test')
+        # The process that broadcast the bump has cleared its own caches
+        check_invalidations()
+        self.clear.assert_not_called()
+
+        # Another process has not seen the bump
+        models._seen_generations.clear()
+        check_invalidations()
+        self.clear.assert_called_once()
+
+    def test_generations_are_read_once_per_interval(self):
+        CacheGeneration.objects.filter(namespace='test').update(generation=F('generation') + 1)
+        with override_settings(CACHE_INVALIDATION_INTERVAL=60):
+            with self.assertNumQueries(1):
+                check_invalidations()
+            with self.assertNumQueries(0):
+                check_invalidations()
+        self.clear.assert_called_once()
@@ -1,10 +1,14 @@
 from django import forms
+from django.conf import settings
+from django.core.cache import cache
 from django.contrib import admin
 from django.utils.html import format_html
 
 from cleverlist.admin import ListActionModelAdmin
-from inventory.models import ProductStock, ProductWithStock
+from inventory.models import get_under_stock_version
+from inventory.services import add_missing_items, find_missing_stock, move_items_to_inventory
 from master.admin import format_tag, TagFilter
+from master.models import Product
 from shopping.models import List, Item
 from django.db.models import Count
 from django.utils.translation import gettext_lazy as _
@@ -29,42 +33,33 @@ class ListAdminForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super(ListAdminForm, self).__init__(*args, **kwargs)
 
-        self.fields['products_under_stock'].choices = [
-            (item.product.id, str(item)) for item in find_items_under_stock(self.instance)
-        ]
+        self.fields['products_under_stock'].choices = get_under_stock_choices(self.instance)
 
     class Meta:
         model = List
         fields = ['name', 'tags', 'products_under_stock']
 
 
-def find_items_under_stock(shoppinglist: List) -> list:
-    existing_item_dict = {}
+def get_under_stock_choices(shoppinglist: List) -> list[tuple[int, str]]:
+    # Rendering and posting the change form both need the choices, they are recomputed after stock or item changes
+    key = f'shopping:under-stock:{get_under_stock_version()}:{shoppinglist.pk}'
+    choices = cache.get(key)
+    if choices is None:
+        choices = [(item.product_id, str(item)) for item in find_items_under_stock(shoppinglist)]
+        cache.set(key, choices, settings.SHOPPING_UNDER_STOCK_CACHE_TTL.total_seconds())
+    return choices
 
-    for existing_item in Item.objects.values('id', 'product_id', 'list_id', 'quantity').all():
-        if existing_item_dict.get(existing_item['product_id']):
-            existing_item_dict.get(existing_item['product_id'])['quantity'] += existing_item['quantity']
-        else:
-            existing_item_dict[existing_item['product_id']] = existing_item
 
-    products = ProductWithStock.default_manager.all()
-    for product in products:
-        item = Item(
+def find_items_under_stock(shoppinglist: List) -> list:
+    for product in find_missing_stock(shoppinglist=shoppinglist):
+        yield Item(
+            pk=product.existing_item_id if shoppinglist.pk else None,
             product=product,
             name=product.name,
-            quantity=product.stock_needed,
+            quantity=product.missing_quantity,
             list=shoppinglist
         )
 
-        existing_item = existing_item_dict.get(product.pk)
-        if existing_item:
-            item.quantity -= existing_item['quantity']
-            if existing_item['list_id'] == shoppinglist.id:
-                item.pk = existing_item['id']
-
-        if item.quantity > 0:
-            yield item
-
 
 # Register your models here.
 @admin.register(List)
@@ -96,11 +91,7 @@ class ListAdmin(ListActionModelAdmin):
         super().save_model(request, obj, form, change)
         products_to_add = [int(product_id) for product_id in form.cleaned_data['products_under_stock']]
         if len(products_to_add):
-            for item in find_items_under_stock(obj):
-                if item.product.id in products_to_add:
-                    if item.pk:
-                        item.quantity += Item.objects.values('quantity').get(pk=item.pk)['quantity']
-                    item.save()
+            add_missing_items(Product.objects.filter(pk__in=products_to_add), obj)
 
 
 @admin.action(description=_("Add to cart"))
@@ -119,38 +110,7 @@ def remove_from_cart(modeladmin, request, queryset):
 
 @admin.action(description=_("Move to inventory"))
 def move_to_inventory(modeladmin, request, queryset):
-    items = queryset.select_related('product', 'list').prefetch_related('tags').all()
-    for item in items:
-        tags = item.tags.all()
-        stock_queryset = ProductStock.objects.filter(product=item.product)
-        if len(tags):
-            stock_queryset = stock_queryset.filter(tags__in=tags).distinct()
-            stock_queryset = stock_queryset.annotate(num_tags=Count('tags', distinct=True)).filter(num_tags=len(tags))
-        else:
-            stock_queryset = stock_queryset.filter(location=None).annotate(num_tags=Count('tags')).filter(num_tags=0)
-
-        stock = stock_queryset.first()
-
-        if item.list:
-            update_reason = _('Shopping item “%(item)s” from “%(list)s” added.') % {'list': str(item.list),
-                                                                                    'item': str(item)}
-        else:
-            update_reason = _('Shopping item “%(item)s” added.') % {'item': str(item)}
-
-        if stock:
-            stock.stock += item.quantity
-            stock.update_reason = update_reason
-            stock.save()
-        else:
-            stock = ProductStock(
-                product=item.product,
-                stock=item.quantity,
-                update_reason=update_reason
-            )
-            stock.save()
-            stock.tags.set(item.tags.all())
-
-        item.delete()
+    move_items_to_inventory(queryset)
 
 
 @admin.register(Item)
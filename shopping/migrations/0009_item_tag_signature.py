@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('master', '0004_remove_product_uuid_null'),
+        ('shopping', '0008_item_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='tag_signature',
+            field=models.CharField(blank=True, default='', editable=False, max_length=40),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['product', 'tag_signature'], name='shopping_it_product_c47f5d_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:32
+from django.db import migrations
+
+from master.models import get_tag_signature
+
+
+def populate_tag_signatures(apps, schema_editor):
+    Item = apps.get_model('shopping', 'Item')
+    tag_ids = {}
+    for pk, tag_id in Item.tags.through.objects.values_list('item_id', 'tag_id'):
+        tag_ids.setdefault(pk, []).append(tag_id)
+
+    Item.objects.bulk_update(
+        [Item(pk=pk, tag_signature=get_tag_signature(ids)) for pk, ids in tag_ids.items()],
+        ['tag_signature'],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('shopping', '0009_item_tag_signature'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_tag_signatures, reverse_code=migrations.RunPython.noop),
+    ]
@@ -1,10 +1,11 @@
 from uuid import uuid4
 
-from django.db import models, transaction
-from django.db.models.signals import post_save
+from django.db import models
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
-from master.models import Product, Tag
+from master.models import Product, Tag, TrackedModel, on_tags_changed, remember_tagged, update_tagged
+from master.tags import inherit_tags_on_commit
 
 
 # Create your models here.
@@ -21,7 +22,7 @@ class List(models.Model):
         return self.name
 
 
-class Item(models.Model):
+class Item(TrackedModel):
     pass
     uuid = models.UUIDField(default=uuid4, editable=False, unique=True)
     product = models.ForeignKey(Product, on_delete=models.RESTRICT, null=True, blank=True, verbose_name=_('Product'))
@@ -31,10 +32,14 @@ class Item(models.Model):
     tags = models.ManyToManyField(Tag, blank=True, verbose_name=_('Tags'))
     in_cart = models.BooleanField(default=False, verbose_name=_('In-Cart'))
     updated_at = models.DateTimeField(auto_now=True, verbose_name=_('Updated at'))
+    tag_signature = models.CharField(max_length=40, default='', blank=True, editable=False)
 
     class Meta:
         verbose_name = _('Shopping Item')
         verbose_name_plural = _('Shopping Items')
+        indexes = [
+            models.Index(fields=['product', 'tag_signature']),
+        ]
 
     def __str__(self):
         product_name = self.product.name if self.product else _('without product')
@@ -48,22 +53,26 @@ class Item(models.Model):
         super().save(*args, **kwargs)
 
 
+# Items inherit the tags of their product, their list and the minimum stock of their product
+ITEM_TAG_SOURCES = [('product_id', 'product'), ('list_id', 'list'), ('product_id', 'minimumproductstock__product')]
+
+
 @receiver(post_save, sender=Item)
 def add_default_tags(sender, instance, created, **kwargs):
     if created:
-        tags = list(instance.tags.all())
-        if instance.product:
-            for tag in instance.product.tags.all():
-                if tag not in tags:
-                    tags.append(tag)
-        if instance.list:
-            for tag in instance.list.tags.all():
-                if tag not in tags:
-                    tags.append(tag)
-        if instance.product and instance.product.minimumproductstock_set:
-            for minstock in instance.product.minimumproductstock_set.all():
-                for tag in minstock.tags.all():
-                    if tag not in tags:
-                        tags.append(tag)
-        if len(tags) > 0 and (instance.list or instance.product):
-            transaction.on_commit(lambda: instance.tags.add(*tags))
+        inherit_tags_on_commit(Item, instance, ITEM_TAG_SOURCES)
+
+
+@receiver(m2m_changed, sender=Item.tags.through)
+def update_tag_signature(sender, instance, action, reverse, pk_set, **kwargs):
+    on_tags_changed(Item, instance, action, reverse, pk_set)
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tagged_items(sender, instance, **kwargs):
+    remember_tagged(Item, instance)
+
+
+@receiver(post_delete, sender=Tag)
+def update_tagged_items(sender, instance, **kwargs):
+    update_tagged(Item, instance)
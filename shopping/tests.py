@@ -1,3 +1,37 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
-# Create your tests here.
+from inventory.models import Location, MinimumProductStock
+from master.models import Product, Tag
+from master.tags import inherit_tags
+from shopping.models import ITEM_TAG_SOURCES, Item, List
+
+
+class InheritTagsTest(TestCase):
+    def setUp(self):
+        self.shoppinglist = List.objects.create(name='Wocheneinkauf')
+        self.shoppinglist.tags.set([Tag.objects.create(name='Woche')])
+        location = Location.objects.create(name='Keller')
+        self.products = []
+        for index in range(5):
+            product = Product.objects.create(name=f'Produkt {index}')
+            product.tags.set([Tag.objects.create(name=f'Tag {index}')])
+            MinimumProductStock.objects.create(product=product, location=location, minimum_stock=1)
+            self.products.append(product)
+
+    def create_items(self, products) -> list[Item]:
+        items = Item.objects.bulk_create([Item(product=product, list=self.shoppinglist) for product in products])
+        return list(Item.objects.filter(pk__in=[item.pk for item in items]))
+
+    def test_query_count_does_not_grow_with_instances(self):
+        single_item = self.create_items(self.products[:1])
+        with CaptureQueriesContext(connection) as single:
+            inherit_tags(Item, single_item, ITEM_TAG_SOURCES)
+
+        items = self.create_items(self.products)
+        with self.assertNumQueries(len(single)):
+            inherit_tags(Item, items, ITEM_TAG_SOURCES)
+
+        for item, product in zip(items, self.products):
+            self.assertEqual(set(item.tags.values_list('name', flat=True)), {'Woche', product.tags.get().name})
@@ -2,12 +2,12 @@ from uuid import uuid4
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
-from master.models import Tag
+from master.models import Tag, TrackedModel
 from shopping.models import List
 
 
 # Create your models here.
-class Task(models.Model):
+class Task(TrackedModel):
     pass
     uuid = models.UUIDField(default=uuid4, editable=False, unique=True)
     name = models.CharField(max_length=255)